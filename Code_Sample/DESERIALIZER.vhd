@@ -58,7 +58,18 @@ architecture Behavioral of DESERIALIZER is
  -- In VALUE, we read data as long as the length counter determines.
  -- Finally, we return to IDLE/TAG state waiting for the next group of data.
  -- Optional values do not have a LENGTH field.
-type STATE is (RESET, TAG, LENGTH, VALUE_REPEATED, VALUE_OPTIONAL);
+ -- Trimmed weights (tag 0x42) carry the diameter and then only the diameter x diameter block around the center.
+ -- TRIMMED_DIAMETER reads the diameter. TRIMMED_WEIGHTS walks the NEIGHBORHOOD_SIZE x NEIGHBORHOOD_SIZE window:
+ -- a position inside the block waits for its value from UART, a position outside it outputs a 0 weight on its own,
+ -- one per clock. The window is complete after the last position, so LENGTH is not used.
+ -- A row of padding takes up to NEIGHBORHOOD_SIZE clocks and the rows above the block up to (N*N-1)/2 = 420 clocks,
+ -- far less than one byte of UART (e.g. 8,680 clocks at 115,200 baud), so no byte arrives meanwhile.
+ -- Compressed grids (tags 0x3a and 0x4a) are pairs of varints, a count (RUN_COUNT) and a cell value (RUN_VALUE).
+ -- RUN_EXPAND writes the cells of a pair to the FIFO, one per clock: count cells of the value for runs (0x3a), count
+ -- 0s and then the value for sparse grids (0x4a). LENGTH is the number of cells and the grid ends after the last one.
+ -- The host keeps a pair at 4,096 cells at most, so a pair is out before the next byte, as above. The FIFO has to
+ -- take them at one cell per clock.
+type STATE is (RESET, TAG, LENGTH, VALUE_REPEATED, VALUE_OPTIONAL, TRIMMED_DIAMETER, TRIMMED_WEIGHTS, RUN_COUNT, RUN_VALUE, RUN_EXPAND);
 signal FSM_STATE : STATE;
 
  -- ======= FOR TAG STATE ======= --
@@ -69,8 +80,11 @@ constant tag_bram: std_logic_vector(7 downto 0) := "00011010"; -- Hex=0x1a, Deci
 constant tag_others: std_logic_vector(7 downto 0) := "00100000"; -- Hex=0x20, Decimal = 32
 constant tag_addr_sel: std_logic_vector(7 downto 0) := "00101000"; -- Hex=0x28, Decimal = 40
 constant tag_grid: std_logic_vector(7 downto 0) := "00110010"; -- Hex=0x32, Decimal = 50
+constant tag_weights_trimmed: std_logic_vector(7 downto 0) := "01000010"; -- Hex=0x42, Decimal = 66
+constant tag_grid_runs: std_logic_vector(7 downto 0) := "00111010"; -- Hex=0x3a, Decimal = 58
+constant tag_grid_sparse: std_logic_vector(7 downto 0) := "01001010"; -- Hex=0x4a, Decimal = 74
 -- The select of demultiplexer.
-signal data_kind: integer range 0 to 6 := 0;
+signal data_kind: integer range 0 to 9 := 0;
 
 -- ======= FOR LENGHT STATE ======= --
 -- Counts the number of the following data. Worst case senario is when we have a grid full of 255s, 
@@ -93,6 +107,14 @@ signal signal_valid_weight: std_logic := '0';
 signal weights_counter: INTEGER RANGE 0 TO NEIGHBORHOOD_SIZE-1 := NEIGHBORHOOD_SIZE-1;
 --signal sig_w_x, sig_w_y, w_x, w_y: INTEGER RANGE 0 TO NEIGHBORHOOD_SIZE-1 := NEIGHBORHOOD_SIZE-1;
 --signal sig_w_x, sig_w_y: INTEGER RANGE 0 TO NEIGHBORHOOD_SIZE-1 := NEIGHBORHOOD_SIZE-1;
+-- Extra for trimmed weights. Position in the window and first/last row (and column) of the block.
+signal trim_x, trim_y: INTEGER RANGE 0 TO NEIGHBORHOOD_SIZE-1 := 0;
+signal trim_first: INTEGER RANGE 0 TO NEIGHBORHOOD_SIZE := 0;
+signal trim_last: INTEGER RANGE -1 TO NEIGHBORHOOD_SIZE-1 := NEIGHBORHOOD_SIZE-1;
+-- Extra for compressed grids. Cells left of the current pair, its value and whether the value of a sparse pair is out.
+signal run_count: unsigned(20 downto 0) := (others => '0');
+signal run_value: std_logic_vector(13 downto 0) := (others => '0');
+signal run_value_pending: std_logic := '0';
 
 -- Extra for total gens
 signal signal_total_gens: std_logic_vector(13 downto 0) := (OTHERS => '0');
@@ -129,6 +151,10 @@ begin
                 signal_data_out_valid <= '0';
                 weights_counter <= NEIGHBORHOOD_SIZE-1;
                 write_address <= 16383;
+                trim_x <= 0;
+                trim_y <= 0;
+                run_count <= (others => '0');
+                run_value_pending <= '0';
                 FSM_STATE <= TAG;
                 
             when TAG => -- wait for a tag
@@ -139,7 +165,11 @@ begin
                 total_bytes_received <= 0;
                 data_kind <= 0;
                 weights_counter <= NEIGHBORHOOD_SIZE-1;
-                write_address <= 16383;                                          
+                write_address <= 16383;
+                trim_x <= 0;
+                trim_y <= 0;
+                run_count <= (others => '0');
+                run_value_pending <= '0';
                 if data_in = tag_grid and data_in_valid = '1' then
                     data_kind <= 1;
                     FSM_STATE <= LENGTH;
@@ -158,6 +188,15 @@ begin
                 elsif data_in = tag_addr_sel and data_in_valid = '1' then
                     data_kind <= 6; -- Time step is 'optional' and does not have Length field. Jump immediately to VALUE state.
                     FSM_STATE <= VALUE_OPTIONAL;
+                elsif data_in = tag_weights_trimmed and data_in_valid = '1' then
+                    data_kind <= 7; -- Weights, to the same outputs.
+                    FSM_STATE <= LENGTH;
+                elsif data_in = tag_grid_runs and data_in_valid = '1' then
+                    data_kind <= 8; -- Grid, to the FIFO.
+                    FSM_STATE <= LENGTH;
+                elsif data_in = tag_grid_sparse and data_in_valid = '1' then
+                    data_kind <= 9; -- Grid, to the FIFO.
+                    FSM_STATE <= LENGTH;
                 else
                     FSM_STATE <= TAG;
                 end if;
@@ -178,7 +217,13 @@ begin
                             tag_length(7*(bytes_counter+1)-1 downto 7*bytes_counter) <= data_in(6 downto 0);
                         end if;                 
                         bytes_counter <= 0;-- Getting it ready for VALUE state.
-                        FSM_STATE <= VALUE_REPEATED;
+                        if data_kind = 7 then
+                            FSM_STATE <= TRIMMED_DIAMETER;
+                        elsif data_kind = 8 or data_kind = 9 then
+                            FSM_STATE <= RUN_COUNT;
+                        else
+                            FSM_STATE <= VALUE_REPEATED;
+                        end if;
                     end if;
                 else
                     FSM_STATE <= LENGTH;
@@ -188,29 +233,38 @@ begin
                 -- Valid data from UART and last byte to be received.
                 -- Also we are sure the the worst case senario is to have a value = 255. 2-byte in protocol buffers
                 if data_in_valid = '1' and total_bytes_received = to_integer(unsigned(tag_length))-1 then
-                    -- The last byte always has stop bit (MSB='0')
-                    if bytes_counter = 1 then -- Previous byte had continuation bit.           
-                        signal_data_out(13 downto 7) <= data_in(6 downto 0);
-                    else
-                        signal_data_out <= "0000000" & data_in(6 downto 0);
-                    end if;                    
-                    signal_data_out_valid <= '1'; -- Data are ready.               
-                    
-                    -- Update weights' counter
-                    if weights_counter = NEIGHBORHOOD_SIZE-1 then
-                         weights_counter <= 0;
-                    else
-                         weights_counter <= weights_counter + 1;
-                    end if;
-                    
-                    -- Update BRAM's  writing address
-                    if write_address = 16383 then
-                        write_address <= 0;
-                    else
-                        write_address <= write_address + 1;
+                    -- The last value may take 2 bytes too (e.g. a cell or a LUT value of 128 or more).
+                    -- Its continuation byte is kept and the field only ends on its stop byte.
+                    if data_in(7) = '1' then -- Continuation bit.
+                        signal_data_out(6 downto 0) <= data_in(6 downto 0);
+                        signal_data_out_valid <= '0'; -- Yet to be ready.
+                        bytes_counter <= 1;
+                        FSM_STATE <= VALUE_REPEATED;
+                    else -- Stop bit.
+                        if bytes_counter = 1 then -- Previous byte had continuation bit.           
+                            signal_data_out(13 downto 7) <= data_in(6 downto 0);
+                        else
+                            signal_data_out <= "0000000" & data_in(6 downto 0);
+                        end if;                    
+                        bytes_counter <= 0;
+                        signal_data_out_valid <= '1'; -- Data are ready.               
+                        
+                        -- Update weights' counter
+                        if weights_counter = NEIGHBORHOOD_SIZE-1 then
+                             weights_counter <= 0;
+                        else
+                             weights_counter <= weights_counter + 1;
+                        end if;
+                        
+                        -- Update BRAM's  writing address
+                        if write_address = 16383 then
+                            write_address <= 0;
+                        else
+                            write_address <= write_address + 1;
+                        end if;
+                                                                    
+                        FSM_STATE <= TAG; -- Jump back to wait the next TAG.
                     end if;
-                                                                
-                    FSM_STATE <= TAG; -- Jump back to wait the next TAG.
                 elsif data_in_valid = '1' and total_bytes_received < to_integer(unsigned(tag_length))-1 then
                     if data_in(7) = '1' then -- Continuation bit.
                         signal_data_out(6 downto 0) <= data_in(6 downto 0);
@@ -270,6 +324,137 @@ begin
                     signal_data_out_valid <= '0';
                     FSM_STATE <= VALUE_OPTIONAL;
                 end if;
+
+            when TRIMMED_DIAMETER =>
+                -- A single byte, up to NEIGHBORHOOD_SIZE. Larger diameters take the whole window.
+                if data_in_valid = '1' then
+                    if to_integer(unsigned(data_in(6 downto 0))) >= NEIGHBORHOOD_SIZE then
+                        trim_first <= 0;
+                        trim_last <= NEIGHBORHOOD_SIZE-1;
+                    else
+                        trim_first <= (NEIGHBORHOOD_SIZE - to_integer(unsigned(data_in(6 downto 0))))/2;
+                        trim_last <= (NEIGHBORHOOD_SIZE + to_integer(unsigned(data_in(6 downto 0))))/2 - 1;
+                    end if;
+                    trim_x <= 0;
+                    trim_y <= 0;
+                    FSM_STATE <= TRIMMED_WEIGHTS;
+                else
+                    FSM_STATE <= TRIMMED_DIAMETER;
+                end if;
+                signal_data_out_valid <= '0';
+
+            when TRIMMED_WEIGHTS =>
+                if trim_y < trim_first or trim_y > trim_last or trim_x < trim_first or trim_x > trim_last then
+                    -- Outside the block. 0 weight, without waiting for UART.
+                    signal_data_out <= (others => '0');
+                    signal_data_out_valid <= '1';
+                elsif data_in_valid = '1' then
+                    if data_in(7) = '1' then -- Continuation bit.
+                        signal_data_out(6 downto 0) <= data_in(6 downto 0);
+                        bytes_counter <= 1;
+                    else -- Stop bit.
+                        if bytes_counter = 1 then -- Previous byte had continuation bit.
+                            signal_data_out(13 downto 7) <= data_in(6 downto 0);
+                        else
+                            signal_data_out <= "0000000" & data_in(6 downto 0);
+                        end if;
+                        bytes_counter <= 0;
+                    end if;
+                    signal_data_out_valid <= not data_in(7);
+                else -- Otherwise, wait valid data.
+                    signal_data_out_valid <= '0';
+                end if;
+
+                -- A weight is out (a 0, or a value that just ended). Next position of the window.
+                if (trim_y < trim_first or trim_y > trim_last or trim_x < trim_first or trim_x > trim_last)
+                   or (data_in_valid = '1' and data_in(7) = '0') then
+                    if weights_counter = NEIGHBORHOOD_SIZE-1 then
+                        weights_counter <= 0;
+                    else
+                        weights_counter <= weights_counter + 1;
+                    end if;
+                    if trim_x = NEIGHBORHOOD_SIZE-1 then
+                        trim_x <= 0;
+                        if trim_y = NEIGHBORHOOD_SIZE-1 then
+                            FSM_STATE <= TAG; -- Window complete.
+                        else
+                            trim_y <= trim_y + 1;
+                            FSM_STATE <= TRIMMED_WEIGHTS;
+                        end if;
+                    else
+                        trim_x <= trim_x + 1;
+                        FSM_STATE <= TRIMMED_WEIGHTS;
+                    end if;
+                else
+                    FSM_STATE <= TRIMMED_WEIGHTS;
+                end if;
+
+            when RUN_COUNT =>
+                -- Up to 3 bytes (21 bits), as LENGTH. Later bytes of the same count are ignored.
+                if data_in_valid = '1' then
+                    if bytes_counter < 3 then
+                        run_count(7*(bytes_counter+1)-1 downto 7*bytes_counter) <= unsigned(data_in(6 downto 0));
+                    end if;
+                    if data_in(7) = '1' then -- Continuation bit.
+                        if bytes_counter < 3 then
+                            bytes_counter <= bytes_counter + 1;
+                        end if;
+                        FSM_STATE <= RUN_COUNT;
+                    else
+                        bytes_counter <= 0;
+                        FSM_STATE <= RUN_VALUE;
+                    end if;
+                else
+                    FSM_STATE <= RUN_COUNT;
+                end if;
+                signal_data_out_valid <= '0';
+
+            when RUN_VALUE =>
+                if data_in_valid = '1' then
+                    if data_in(7) = '1' then -- Continuation bit.
+                        run_value(6 downto 0) <= data_in(6 downto 0);
+                        bytes_counter <= 1;
+                        FSM_STATE <= RUN_VALUE;
+                    else -- Stop bit
+                        if bytes_counter = 1 then -- Previous byte had continuation bit.
+                            run_value(13 downto 7) <= data_in(6 downto 0);
+                        else
+                            run_value <= "0000000" & data_in(6 downto 0);
+                        end if;
+                        bytes_counter <= 0;
+                        run_value_pending <= '1';
+                        FSM_STATE <= RUN_EXPAND;
+                    end if;
+                else
+                    FSM_STATE <= RUN_VALUE;
+                end if;
+                signal_data_out_valid <= '0';
+
+            when RUN_EXPAND =>
+                if total_bytes_received >= to_integer(unsigned(tag_length)) then -- Grid complete.
+                    signal_data_out_valid <= '0';
+                    FSM_STATE <= TAG;
+                elsif run_count /= 0 then
+                    if data_kind = 8 then
+                        signal_data_out <= run_value;
+                    else
+                        signal_data_out <= (others => '0');
+                    end if;
+                    signal_data_out_valid <= '1';
+                    run_count <= run_count - 1;
+                    total_bytes_received <= total_bytes_received + 1;
+                    FSM_STATE <= RUN_EXPAND;
+                elsif data_kind = 9 and run_value_pending = '1' then -- The value after the 0s.
+                    signal_data_out <= run_value;
+                    signal_data_out_valid <= '1';
+                    run_value_pending <= '0';
+                    total_bytes_received <= total_bytes_received + 1;
+                    FSM_STATE <= RUN_EXPAND;
+                else -- Pair done. Wait for the next one.
+                    signal_data_out_valid <= '0';
+                    run_value_pending <= '0';
+                    FSM_STATE <= RUN_COUNT;
+                end if;
             end case;
      end if;
 END PROCESS;             
@@ -278,7 +463,7 @@ END PROCESS;
 -- That way we drive incoming data to the proper modules.
 DEMUX: PROCESS(data_kind, signal_data_out, signal_data_out_valid, write_address)
 BEGIN
-    if data_kind = 1 then -- Send them to FIFO
+    if data_kind = 1 or data_kind = 8 or data_kind = 9 then -- Send them to FIFO
         FIFO_data <= signal_data_out(7 downto 0);
         FIFO_valid <= signal_data_out_valid;
         -- Unset rest valid signals.
@@ -287,7 +472,7 @@ BEGIN
 	    BRAM_we <= '0';
 	    signal_others_valid <= '0';
 	    signal_addr_sel_valid <= '0'; 
-    elsif data_kind = 2 then -- Weights.
+    elsif data_kind = 2 or data_kind = 7 then -- Weights, complete or trimmed.
         signal_weight <= signal_data_out(7 downto 0);      
 		signal_valid_weight <= signal_data_out_valid;
         -- Unset rest valid signals.
@@ -0,0 +1,211 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Writer of the simulation results as palette-indexed BMPs, straight from the extracted grids.
+	     A state is the index of its colour in the palette (total_states colours, gray levels by default), so a
+	     grid is written as it is: 4 bits per pixel for up to 16 states (two cells per byte, first cell in the
+	     high nibble), else 8 bits per pixel. The header and the palette are built once per image size, the rows
+	     are flipped and packed with NumPy into one array, written to the file at once.
+	     BmpWriter encodes many snapshots at once on a thread (or process) pool. read_bmp() reads them back, or a part of one.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+from functools import lru_cache
+import struct
+from collections import namedtuple
+# Pools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import os
+import time
+
+# Global Scope
+GRID_WIDTH = 1920
+GRID_HEIGHT = 1080
+FILE_HEADER = 14 	# BITMAPFILEHEADER
+INFO_HEADER = 40 	# BITMAPINFOHEADER
+PIXELS_PER_METER = 2835 # 72 DPI.
+BmpInfo = namedtuple("BmpInfo", "width height bits offset bottom_up palette")
+
+# ============================== FORMAT ============================== #
+
+# 4 bits per pixel for up to 16 states, else 8.
+def bits_per_pixel(total_states):
+	return 4 if total_states <= 16 else 8
+
+# Gray levels from black (state 0) to white (last state), as (R, G, B).
+def gray_palette(total_states):
+	levels = [255*k//max(1, total_states - 1) for k in range(total_states)]
+	return tuple((level, level, level) for level in levels)
+
+# Bytes of a row of pixels, padded to 4 bytes.
+def row_stride(width, bits):
+	return (width*bits + 31)//32*4
+
+"""
+File header, info header and palette (B, G, R, 0 per colour) of a bottom-up, uncompressed BMP.
+The palette is a tuple of (R, G, B). Cached, since every snapshot of a run has the same one.
+"""
+@lru_cache(maxsize=None)
+def bmp_header(width, height, bits, palette):
+	offset = FILE_HEADER + INFO_HEADER + 4*len(palette)
+	image_size = row_stride(width, bits)*height
+	header = struct.pack("<2sIHHI", b"BM", offset + image_size, 0, 0, offset)
+	header += struct.pack("<IiiHHIIiiII", INFO_HEADER, width, height, 1, bits, 0, image_size,
+						  PIXELS_PER_METER, PIXELS_PER_METER, len(palette), len(palette))
+	return header + bytes(channel for red, green, blue in palette for channel in (blue, green, red, 0))
+
+"""
+Pixel array of an extracted grid: bottom row first, rows padded to 4 bytes, 4-bit cells two per byte.
+Non toroidal grids miss vertical_offset rows (14 on top, 14 at the bottom), written as state 0.
+"""
+def pixel_array(grid, vertical_offset, bits):
+	grid = np.asarray(grid, dtype=np.uint8)
+	rows, width = grid.shape
+	pixels = np.zeros((rows + vertical_offset, row_stride(width, bits)), dtype=np.uint8)
+	bottom = vertical_offset - vertical_offset//2
+	flipped = pixels[bottom:bottom + rows][::-1]
+	if bits == 8:
+		flipped[:, :width] = grid
+	else:
+		flipped[:, :(width + 1)//2] = grid[:, 0::2] << np.uint8(4)
+		flipped[:, :width//2] |= grid[:, 1::2] & np.uint8(0xf)
+	return pixels
+
+# Write an extracted grid to a BMP at path. palette is a tuple of (R, G, B), gray levels if None.
+def write_bmp(grid, path, vertical_offset, total_states, palette=None):
+	palette = palette or gray_palette(total_states)
+	bits = bits_per_pixel(len(palette))
+	grid = np.asarray(grid)
+	header = bmp_header(grid.shape[1], grid.shape[0] + vertical_offset, bits, tuple(palette))
+	pixels = pixel_array(grid, vertical_offset, bits)
+	with open(path, "wb") as file:
+		file.write(header)
+		file.write(pixels.data)
+	return path
+
+# Headers and palette of an uncompressed, palette-indexed BMP (4 or 8 bits per pixel), as written by write_bmp().
+def bmp_info(path):
+	with open(path, "rb") as file:
+		data = file.read(FILE_HEADER + INFO_HEADER)
+		magic, _, _, _, offset = struct.unpack_from("<2sIHHI", data)
+		info_size, width, height, _, bits, compression, _, _, _, colors = struct.unpack_from("<IiiHHIIiiI", data, FILE_HEADER)
+		if magic != b"BM" or bits not in (4, 8) or compression != 0:
+			raise ValueError("%s is not an uncompressed, palette-indexed BMP." % path)
+		file.seek(FILE_HEADER + info_size)
+		table = file.read(4*(colors or 1 << bits))
+	palette = tuple((red, green, blue) for blue, green, red in zip(table[0::4], table[1::4], table[2::4]))
+	return BmpInfo(width, abs(height), bits, offset, height > 0, palette)
+
+"""
+Palette indices of rows [row_start, row_stop) and columns [col_start, col_stop) of a BMP, top row first.
+The pixel array is mapped in memory, so only the rows asked for are read from the file.
+"""
+def read_bmp(path, row_start=0, row_stop=None, col_start=0, col_stop=None, info=None):
+	info = info or bmp_info(path)
+	row_stop = info.height if row_stop is None else row_stop
+	col_stop = info.width if col_stop is None else col_stop
+	pixels = np.memmap(path, dtype=np.uint8, mode="r", offset=info.offset, shape=(info.height, row_stride(info.width, info.bits)))
+	if info.bottom_up:
+		pixels = pixels[info.height - row_stop:info.height - row_start][::-1]
+	else:
+		pixels = pixels[row_start:row_stop]
+	if info.bits == 8:
+		return np.array(pixels[:, col_start:col_stop])
+	pixels = pixels[:, col_start//2:(col_stop + 1)//2]
+	image = np.empty((pixels.shape[0], 2*pixels.shape[1]), dtype=np.uint8)
+	image[:, 0::2] = pixels >> np.uint8(4)
+	image[:, 1::2] = pixels & np.uint8(0xf)
+	return image[:, col_start % 2:col_start % 2 + col_stop - col_start]
+
+# ============================== WRITER POOL ============================== #
+class BmpWriter:
+	"""
+	Writes the snapshots of a run concurrently. submit(grid, path) queues one and returns its future; the grid must not
+	be changed afterwards. NumPy and file writes release the GIL, so threads are enough; processes=True uses a process
+	pool instead (every grid is then pickled to its worker). Use it as a context manager: leaving it waits for every
+	file and raises the first error.
+	"""
+	def __init__(self, vertical_offset, total_states, palette=None, workers=None, processes=False):
+		self.vertical_offset = vertical_offset
+		self.total_states = total_states
+		self.palette = tuple(palette) if palette else gray_palette(total_states)
+		self.pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers or os.cpu_count())
+		self.futures = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def submit(self, grid, path):
+		self.futures.append(self.pool.submit(write_bmp, grid, path, self.vertical_offset, self.total_states, self.palette))
+		return self.futures[-1]
+
+	# Wait for the submitted files. Returns their paths, in order.
+	def wait(self):
+		futures, self.futures = self.futures, []
+		return [future.result() for future in futures]
+
+	def close(self):
+		try:
+			self.wait()
+		finally:
+			self.pool.shutdown()
+
+# ============================== BENCHMARK ============================== #
+
+"""
+Seconds to write total_extracts snapshots: one after the other, a row at a time (as the image viewer did), then with
+BmpWriter on threads and on processes. The files must be byte for byte the same.
+"""
+def benchmark(grid_type="NULL", total_states=2, total_extracts=16, workers=None):
+	import tempfile
+	from boundary import vertical_offset as null_offset
+	rng = np.random.default_rng(0)
+	vertical_offset = null_offset(grid_type)
+	grids = [rng.integers(0, total_states, size=(GRID_HEIGHT - vertical_offset, GRID_WIDTH), dtype=np.uint8) for _ in range(total_extracts)]
+	palette = gray_palette(total_states)
+	bits = bits_per_pixel(total_states)
+	def write_row_by_row(grid, path):
+		rows, width = grid.shape
+		stride = row_stride(width, bits)
+		blank = bytes(stride)
+		with open(path, "wb") as file:
+			file.write(bmp_header(width, rows + vertical_offset, bits, palette))
+			for _ in range(vertical_offset//2):
+				file.write(blank)
+			for row in grid[::-1]:
+				if bits == 8:
+					data = bytes(int(cell) for cell in row)
+				else:
+					data = bytes((int(row[x]) << 4) | (int(row[x + 1]) if x + 1 < width else 0) for x in range(0, width, 2))
+				file.write(data + bytes(stride - len(data)))
+			for _ in range(vertical_offset - vertical_offset//2):
+				file.write(blank)
+	timings = []
+	with tempfile.TemporaryDirectory() as directory:
+		paths = {mode: [os.path.join(directory, "%s_%d.bmp" % (mode, i)) for i in range(total_extracts)]
+				 for mode in ("rows", "threads", "processes")}
+		start = time.perf_counter()
+		for grid, path in zip(grids, paths["rows"]):
+			write_row_by_row(grid, path)
+		timings.append(time.perf_counter() - start)
+		for processes in (False, True):
+			start = time.perf_counter()
+			with BmpWriter(vertical_offset, total_states, workers=workers, processes=processes) as writer:
+				for grid, path in zip(grids, paths["processes" if processes else "threads"]):
+					writer.submit(grid, path)
+			timings.append(time.perf_counter() - start)
+		for files in zip(*paths.values()):
+			contents = [open(path, "rb").read() for path in files]
+			if any(content != contents[0] for content in contents):
+				raise ValueError("BMPs of %s differ." % files[0])
+	return timings
+
+if __name__ == "__main__":
+	for total_states in (2, 16, 256):
+		rows, threads, processes = benchmark(total_states=total_states)
+		print("%d states (%d-bit): row by row %.2fs, threads %.2fs (x%.1f), processes %.2fs (x%.1f)"
+			  % (total_states, bits_per_pixel(total_states), rows, threads, rows/threads, processes, rows/processes))
@@ -0,0 +1,162 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Boundary conditions of the grid, declared once and shared by the host and the CPU engine.
+	     A grid type names what the cells beyond the edges of the grid read and how many rows at the top and at the
+	     bottom are held (null rows, not computed and not extracted):
+	       TOROIDAL        wraps around in both directions.                                          (hardware)
+	       NULL            14 null rows at 0 on top and at the bottom, cells beyond the edges read 0. (hardware)
+	                       Any other grid type (label) is a null grid, as on the host.
+	       REFLECTIVE      cells beyond an edge mirror the grid: row -1 reads row 0, row -2 row 1.    (CPU engine)
+	       CONSTANT[:v]    cells beyond the edges read v (0 by default).                              (CPU engine)
+	     Every stage works with slices, or a single gather at the edges, and never changes the array it is given.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+from collections import namedtuple
+
+# Global Scope
+GRID_WIDTH = 1920
+GRID_HEIGHT = 1080
+RADIUS = 14
+"""
+mode: "wrap", "reflect" or "constant" (cells beyond the edges read value).
+null_rows: rows held at value on top and at the bottom. hardware: the board supports it.
+"""
+Boundary = namedtuple("Boundary", "name mode value null_rows hardware")
+BOUNDARIES = {
+	"TOROIDAL": Boundary("TOROIDAL", "wrap", 0, 0, True),
+	"NULL": Boundary("NULL", "constant", 0, RADIUS, True),
+	"REFLECTIVE": Boundary("REFLECTIVE", "reflect", 0, 0, False),
+	"CONSTANT": Boundary("CONSTANT", "constant", 0, 0, False),
+}
+
+# ============================== DECLARATION ============================== #
+
+"""
+Boundary of a grid type, e.g. "TOROIDAL" or "CONSTANT:3". A Boundary is returned as it is.
+As on the host, every other label (the hardware grid types of the dropdown) is a null grid: only the CPU engine names
+are taken explicitly.
+"""
+def boundary_of(grid_type):
+	if isinstance(grid_type, Boundary):
+		return grid_type
+	name, _, value = grid_type.partition(":")
+	if name not in BOUNDARIES:
+		return BOUNDARIES["NULL"]
+	boundary = BOUNDARIES[name]
+	if value:
+		if boundary.mode != "constant" or boundary.null_rows:
+			raise ValueError("Only CONSTANT grids take a value, not %s." % grid_type)
+		boundary = boundary._replace(value=int(value))
+	return boundary
+
+# Rows of the grid that are not extracted (0 for toroidal grids, 28 for null ones).
+def vertical_offset(grid_type):
+	return 2*boundary_of(grid_type).null_rows
+
+# The board only has toroidal and null grids.
+def check_hardware(grid_type):
+	boundary = boundary_of(grid_type)
+	if not boundary.hardware:
+		raise ValueError("%s grids are only supported by the CPU engine." % boundary.name)
+	return boundary
+
+# ============================== STAGES ============================== #
+
+"""
+Initial state as the engine (and the board) receives it: uint8, masked to cell_size bits if given, null rows at their
+value. The array given is never changed: it is returned as it is when nothing has to change (unless copy=True),
+else a copy is changed with slice assignments.
+"""
+def prepare_state(init_state, grid_type, cell_size=None, copy=False):
+	boundary = boundary_of(grid_type)
+	state = np.asarray(init_state, dtype=np.uint8)
+	null = boundary.null_rows
+	mask = np.uint8((1 << cell_size) - 1) if cell_size is not None and cell_size < 8 else None
+	changes = (mask is not None and bool((state > mask).any())) or \
+			  (null > 0 and bool((state[:null] != boundary.value).any() or (state[state.shape[0] - null:] != boundary.value).any()))
+	if not changes:
+		return state.copy() if copy else state
+	if isinstance(init_state, np.ndarray) and np.may_share_memory(state, init_state):
+		state = state.copy()
+	if mask is not None:
+		state &= mask
+	if null > 0:
+		state[:null] = boundary.value
+		state[state.shape[0] - null:] = boundary.value
+	return state
+
+# Indices of the grid (of size) that the indices read, -1 where they read the constant value.
+def source_indices(indices, size, boundary):
+	if boundary.mode == "wrap":
+		return indices % size
+	if boundary.mode == "reflect":
+		indices = np.where(indices < 0, -indices - 1, indices)
+		return np.where(indices >= size, 2*size - indices - 1, indices)
+	return np.where((indices >= 0) & (indices < size), indices, -1)
+
+"""
+Rows [r0, r1) and columns [c0, c1) of the state. Indices beyond the edges are allowed (halos) and read as the boundary
+says. Inside the grid it is a view of the state (do not change it); only the axes that cross an edge are gathered.
+"""
+def window(state, r0, r1, c0, c1, boundary):
+	rows, cols = state.shape
+	if boundary.mode == "constant":
+		out = np.full((r1 - r0, c1 - c0), boundary.value, dtype=state.dtype)
+		top, bottom, left, right = max(r0, 0), min(r1, rows), max(c0, 0), min(c1, cols)
+		if top < bottom and left < right:
+			out[top - r0:bottom - r0, left - c0:right - c0] = state[top:bottom, left:right]
+		return out
+	if 0 <= r0 and r1 <= rows:
+		part = state[r0:r1]
+	else:
+		part = state.take(source_indices(np.arange(r0, r1), rows, boundary), axis=0)
+	if 0 <= c0 and c1 <= cols:
+		return part[:, c0:c1]
+	return part.take(source_indices(np.arange(c0, c1), cols, boundary), axis=1)
+
+"""
+Cells of a window (global rows and columns) that lie beyond the edges or in the null rows, set again as the boundary
+says after a generation was computed in the window: the constant value, or the mirror of the cells of the grid in it.
+Wrapped cells are computed like the rest, so toroidal windows are returned as they are.
+"""
+def refill(tile, rows, cols, boundary, shape=(GRID_HEIGHT, GRID_WIDTH)):
+	if boundary.mode == "wrap":
+		return tile
+	if boundary.mode == "constant":
+		inside_rows = (rows >= boundary.null_rows) & (rows < shape[0] - boundary.null_rows)
+		inside = inside_rows[:, None] & ((cols >= 0) & (cols < shape[1]))[None, :]
+		return np.where(inside, tile, np.uint8(boundary.value))
+	return tile[np.ix_(source_indices(rows, shape[0], boundary) - rows[0], source_indices(cols, shape[1], boundary) - cols[0])]
+
+# ============================== BENCHMARK ============================== #
+
+"""
+Seconds to set the null rows of an initial state: a Python loop over every cell of the 28 rows, on a copy (the host
+used to do it in place, on the image on display), and prepare_state(). The results must be the same.
+"""
+def benchmark(grid_type="NULL", repeats=5):
+	import time
+	rng = np.random.default_rng(0)
+	image = rng.integers(0, 2, size=(GRID_HEIGHT, GRID_WIDTH), dtype=np.uint8)
+	null = boundary_of(grid_type).null_rows
+	start = time.perf_counter()
+	for _ in range(repeats):
+		looped = image.copy()
+		for i in list(range(0, null)) + list(range(GRID_HEIGHT - null, GRID_HEIGHT)):
+			for j in range(0, GRID_WIDTH):
+				looped[i][j] = 0
+	loops = (time.perf_counter() - start)/repeats
+	start = time.perf_counter()
+	for _ in range(repeats):
+		prepared = prepare_state(image, grid_type)
+	sliced = (time.perf_counter() - start)/repeats
+	if not np.array_equal(looped, prepared) or not image[:null].any():
+		raise ValueError("Prepared state does not match, or the image was changed.")
+	return loops, sliced
+
+if __name__ == "__main__":
+	loops, sliced = benchmark()
+	print("Null rows: loops %.1fms, prepare_state %.2fms (x%.0f)" % (1e3*loops, 1e3*sliced, loops/sliced))
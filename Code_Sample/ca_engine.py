@@ -0,0 +1,491 @@
+"""
+Engineer: Mylonakis Manolis
+Description: CPU reference model of the CA engine of the FPGA. Takes the same inputs as run_simulation()
+	     and returns the same list of extracted grids, without a board attached.
+	     Used when the board is busy and as a golden model for the hardware.
+
+	     Each generation, for every cell:
+	       1. sum = weighted sum of the 29x29 neighborhood (weights as stored in the weights' rows of the hardware).
+	       2. The sum (addr_sel=0) or the cell's state concatenated with the sum (addr_sel=1) addresses the BRAM LUT.
+	       3. If the address does not fit in the 14-bit BRAM address, the "otherwise" value is the next state.
+	     Boundaries: TOROIDAL grids wrap around in both directions. Otherwise, the upper-most and bottom-most 14 rows
+	     are held at 0 (and are not extracted), while cells beyond the left and right edges read as 0.
+	     The CPU engine also runs REFLECTIVE and CONSTANT grids (see boundary.py), which the board does not have.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import os
+import time
+from collections import deque
+# My Files
+from conv_planner import plan_convolution
+from ca_parallel import ParallelCAEngine
+from boundary import boundary_of, prepare_state, window, refill
+
+# Global Scope
+GRID_WIDTH = 1920 	# Grid's columns.
+GRID_HEIGHT = 1080	# Grid's rows.
+RADIUS = 14 		# Neighborhoods up to 29x29.
+NEIGH_SIZE = 2*RADIUS + 1
+BRAM_DEPTH = 16384  # 14-bit BRAM address.
+BRAM_ADDR_BITS = 14
+# Temporal blocking. Tiles of the grid are advanced several generations at once, while they are in cache.
+TILE_ROWS = 128		# Rows of a tile, without its halo.
+TILE_COLS = 512		# Columns of a tile, without its halo.
+MAX_BLOCK_DEPTH = 8  # Upper bound of the generations per tile.
+MAX_REDUNDANCY = 0.5 # Halos may add up to 50% of redundant cells to a tile.
+# Sparse stepping. Only tiles near the ones that changed in the previous generation are recomputed.
+SPARSE_TILE_ROWS = 32
+SPARSE_TILE_COLS = 64
+SPARSE_MAX_ACTIVE = 0.3 # Above this fraction of active tiles, a dense step is cheaper.
+# Cycle detection. Digests of the last CYCLE_WINDOW checkpoints are kept.
+CYCLE_WINDOW = 4096
+
+# Weights are packed 32/CELL_SIZE bits each in the weights' rows. 8-bit if CELL_SIZE=4, 4-bit if CELL_SIZE=8.
+def weight_bits(cell_size):
+	return 32//cell_size
+
+# The 841 weights as a 29x29 kernel, truncated as the hardware stores them.
+# Row 0 is the upper-most row of the neighborhood (y=14), column 0 the left-most one (x=-14).
+def neighborhood_kernel(final_neighborhood, cell_size):
+	kernel = np.asarray(final_neighborhood, dtype=np.int64).reshape(NEIGH_SIZE, NEIGH_SIZE)
+	return (kernel & ((1 << weight_bits(cell_size)) - 1)).astype(np.int32)
+
+# Radius that the non-zero weights actually reach. 1 for Game of Life, even inside the 29x29 window.
+def kernel_reach(kernel):
+	rows, cols = np.nonzero(kernel)
+	if rows.size == 0:
+		return 0
+	return int(max(np.abs(rows - RADIUS).max(), np.abs(cols - RADIUS).max()))
+
+# Deepest temporal blocking whose halos (depth*reach on every side) keep the redundant cells of a tile under MAX_REDUNDANCY.
+def auto_block_depth(reach, tile_rows=TILE_ROWS, tile_cols=TILE_COLS):
+	depth = 1
+	while depth < MAX_BLOCK_DEPTH:
+		halo = 2*(depth + 1)*reach
+		if (tile_rows + halo)*(tile_cols + halo) > (1 + MAX_REDUNDANCY)*tile_rows*tile_cols:
+			break
+		depth += 1
+	return depth
+
+# ============================== CPU ENGINE ============================== #
+class CAEngine:
+	"""
+	Holds the configuration of one run (what the DESERIALIZER distributes in hardware) and advances 1080x1920 states.
+	States are uint8 arrays. For null grids, rows outside the vertical offset are always 0.
+	"""
+	def __init__(self, grid_type, cell_size, final_neighborhood, bram_values, others_value, addr_sel):
+		self.boundary = boundary_of(grid_type)
+		self.toroidal = self.boundary.mode == "wrap"
+		self.cell_size = cell_size
+		self.state_mask = (1 << cell_size) - 1
+		self.kernel = neighborhood_kernel(final_neighborhood, cell_size)
+		# Direct, separable, low-rank or FFT. Chosen once per kernel.
+		self.plan = plan_convolution(self.kernel)
+		# BRAM LUT. Missing addresses hold 0, as a BRAM after configuration.
+		self.lut = np.zeros(BRAM_DEPTH, dtype=np.uint8)
+		bram_values = np.asarray(bram_values, dtype=np.int64)[:BRAM_DEPTH]
+		self.lut[:bram_values.size] = bram_values & self.state_mask
+		self.others = int(others_value) & self.state_mask
+		self.addr_sel = int(addr_sel)
+		"""
+		The transition as a single lookup. Sums that do not fit in the address are clipped to 2^sum_bits,
+		and that extra column of the table holds the "otherwise" value. For addr_sel=1, each state has its own row.
+		"""
+		self.sum_bits = BRAM_ADDR_BITS if self.addr_sel == 0 else BRAM_ADDR_BITS - cell_size
+		if self.addr_sel == 0:
+			self.table = np.append(self.lut, np.uint8(self.others))
+		else:
+			rows = self.lut.reshape(1 << cell_size, 1 << self.sum_bits)
+			self.table = np.hstack([rows, np.full((rows.shape[0], 1), self.others, dtype=np.uint8)]).ravel()
+		# Smallest dtype that the neighborhood's sums can not overflow.
+		self.sum_dtype = np.int16 if int(np.abs(self.kernel).sum())*self.state_mask < 2**15 else np.int32
+		# Rows that are computed. The rest are null rows (null grids only).
+		self.row_start = self.boundary.null_rows
+		self.row_stop = GRID_HEIGHT - self.boundary.null_rows
+		# Temporal blocking. The kernel is cropped to its reach, so halos are as small as possible.
+		self.reach = kernel_reach(self.kernel)
+		self.tile_plan = plan_convolution(self.kernel[RADIUS - self.reach:RADIUS + self.reach + 1, RADIUS - self.reach:RADIUS + self.reach + 1])
+		self.block_depth = auto_block_depth(self.reach) # Generations per tile. 1 disables temporal blocking.
+		# Sparse stepping. Off by default, for rules that settle into mostly static regions.
+		self.sparse = False
+		self.active_tiles = None # Tiles to recompute in the next generation of the last returned state.
+		self.active_state = None # That state. The activity is only valid for it.
+		# Cycle detection. Random odd keys of the 128-bit digest, one pair per packed 64-bit word of the grid.
+		self.detect_cycles = True
+		self.digest_keys = np.random.default_rng(0).integers(0, 2**63, size=(2, GRID_HEIGHT*GRID_WIDTH//8), dtype=np.uint64) | np.uint64(1)
+		self.cycle = None # (generation, period) of the last run, if its state entered a cycle. Period 1 is a fixed point.
+
+	# Initial state as the hardware receives it. Values masked to CELL_SIZE bits, null rows set to 0. A new array.
+	def prepare(self, init_state):
+		return prepare_state(init_state, self.boundary, self.cell_size, copy=True)
+
+	# Rows [start, stop) of the state plus a halo of 14 cells on every side, according to the boundary conditions.
+	def block(self, state, start, stop):
+		return window(state, start - RADIUS, stop + RADIUS, -RADIUS, GRID_WIDTH + RADIUS, self.boundary).astype(self.sum_dtype)
+
+	# Weighted sum of the neighborhood of the cells in rows [start, stop), with the planned strategy.
+	def neighborhood_sum(self, state, start, stop):
+		return self.plan.correlate(self.block(state, start, stop))
+
+	# Transition rule. LUT or "otherwise" for every cell, given its state and its neighborhood's sum.
+	def transition(self, center, sums):
+		index = np.minimum(sums, 1 << self.sum_bits).astype(np.int32)
+		if self.addr_sel == 1:
+			# Central cell's state selects the row of the table, as the upper bits of the BRAM address.
+			index += center*np.int32((1 << self.sum_bits) + 1)
+		return self.table.take(index)
+
+	# Next generation of the rows [start, stop). Bands of the grid can be computed independently.
+	def step_rows(self, state, start, stop):
+		return self.transition(state[start:stop], self.neighborhood_sum(state, start, stop))
+
+	# Advance one generation.
+	def step(self, state):
+		next_state = np.zeros_like(state)
+		next_state[self.row_start:self.row_stop] = self.step_rows(state, self.row_start, self.row_stop)
+		return next_state
+
+	# Advance a number of generations.
+	def advance(self, state, generations):
+		if self.sparse:
+			return self.advance_sparse(state, generations)
+		if self.block_depth > 1:
+			return self.advance_blocked(state, generations, self.block_depth)
+		for _ in range(generations):
+			state = self.step(state)
+		return state
+
+	# ============= TEMPORAL BLOCKING ============= #
+
+	# Tile [r0, r1)x[c0, c1) of the state plus a halo on every side, with the global row/column of each cell.
+	def tile(self, state, r0, r1, c0, c1, halo):
+		rows = np.arange(r0 - halo, r1 + halo)
+		cols = np.arange(c0 - halo, c1 + halo)
+		return window(state, r0 - halo, r1 + halo, c0 - halo, c1 + halo, self.boundary), rows, cols
+
+	"""
+	Advance a tile depth generations. Each generation the tile shrinks by the reach on every side,
+	so a halo of depth*reach cells gives the exact result for the cells of the tile.
+	For other grids, cells of null rows and cells out of the grid are set again after every generation (0, the constant
+	or the mirror of the grid), as they are read from the whole grid.
+	"""
+	def advance_tile(self, tile, rows, cols, depth):
+		reach = self.reach
+		for _ in range(depth):
+			sums = self.tile_plan.correlate(tile.astype(self.sum_dtype))
+			rows, cols = rows[reach:rows.size - reach], cols[reach:cols.size - reach]
+			tile = self.transition(tile[reach:tile.shape[0] - reach, reach:tile.shape[1] - reach], sums)
+			# Only tiles at the borders of the grid have cells to set again.
+			if not self.toroidal and (rows[0] < self.row_start or rows[-1] >= self.row_stop or cols[0] < 0 or cols[-1] >= GRID_WIDTH):
+				tile = refill(tile, rows, cols, self.boundary)
+		return tile
+
+	# Advance a number of generations, depth generations per sweep of the tiles.
+	def advance_blocked(self, state, generations, depth):
+		while generations > 0:
+			depth = min(depth, generations)
+			halo = depth*self.reach
+			next_state = np.zeros_like(state)
+			for r0 in range(self.row_start, self.row_stop, TILE_ROWS):
+				r1 = min(r0 + TILE_ROWS, self.row_stop)
+				for c0 in range(0, GRID_WIDTH, TILE_COLS):
+					c1 = min(c0 + TILE_COLS, GRID_WIDTH)
+					tile, rows, cols = self.tile(state, r0, r1, c0, c1, halo)
+					next_state[r0:r1, c0:c1] = self.advance_tile(tile, rows, cols, depth)
+			state = next_state
+			generations -= depth
+		return state
+
+	# ============= SPARSE STEPPING ============= #
+
+	"""
+	If no cell within the reach of a tile changed in the last generation, the tile's inputs are the same as before,
+	so its next generation is its current one. Only the other (active) tiles are recomputed, all of them at once:
+	their windows are stacked into one block, so the cost per tile is only a few NumPy operations.
+	Tiles that were not recomputed did not change, so only recomputed tiles are compared with their previous generation.
+	The result is identical to the dense engine.
+	"""
+	def advance_sparse(self, state, generations):
+		tile_r0 = np.arange(self.row_start, self.row_stop, SPARSE_TILE_ROWS)
+		tile_c0 = np.arange(0, GRID_WIDTH, SPARSE_TILE_COLS)
+		tile_grid = (tile_r0.size, tile_c0.size)
+		# Without a history, everything is active.
+		active = self.active_tiles if state is self.active_state else np.ones(tile_grid, dtype=bool)
+		for _ in range(generations):
+			if active.mean() > SPARSE_MAX_ACTIVE:
+				next_state = self.step(state)
+				changed = state[self.row_start:self.row_stop] != next_state[self.row_start:self.row_stop]
+				changed = np.logical_or.reduceat(changed, tile_r0 - self.row_start, axis=0)
+				changed = np.logical_or.reduceat(changed, tile_c0, axis=1)
+				if changed.mean() > SPARSE_MAX_ACTIVE: # Still busy. The next generation is dense anyway.
+					active = np.ones(tile_grid, dtype=bool)
+				else:
+					tr, tc = np.nonzero(changed)
+					before = self.sparse_windows(state, tile_r0[tr], tile_c0[tc], 0)
+					after = self.sparse_windows(next_state, tile_r0[tr], tile_c0[tc], 0)
+					active = self.sparse_activity(tile_grid, tr, tc, tile_r0[tr], tile_c0[tc], before != after)
+			else:
+				tr, tc = np.nonzero(active)
+				windows = self.sparse_windows(state, tile_r0[tr], tile_c0[tc], self.reach)
+				before, after = self.sparse_step(windows)
+				next_state = state.copy()
+				for k, (r0, c0) in enumerate(zip(tile_r0[tr].tolist(), tile_c0[tc].tolist())):
+					r1, c1 = min(r0 + SPARSE_TILE_ROWS, self.row_stop), min(c0 + SPARSE_TILE_COLS, GRID_WIDTH)
+					next_state[r0:r1, c0:c1] = after[k, :r1 - r0, :c1 - c0]
+				active = self.sparse_activity(tile_grid, tr, tc, tile_r0[tr], tile_c0[tc], before != after)
+			state = next_state
+		self.active_tiles, self.active_state = active, state
+		return state
+
+	"""
+	Windows of the tiles starting at (r0, c0), plus a halo, stacked as (tiles, rows, cols).
+	Windows of the last tiles run past the computed rows and the grid. Those cells are not used.
+	"""
+	def sparse_windows(self, state, r0, c0, halo):
+		tail = (halo + SPARSE_TILE_ROWS, halo + SPARSE_TILE_COLS)
+		padded = window(state, -halo, GRID_HEIGHT + tail[0], -halo, GRID_WIDTH + tail[1], self.boundary)
+		return sliding_window_view(padded, (SPARSE_TILE_ROWS + 2*halo, SPARSE_TILE_COLS + 2*halo))[r0, c0]
+
+	# Next generation of stacked windows, as one tall block. Returns the tiles before and after.
+	def sparse_step(self, windows):
+		reach = self.reach
+		tiles, height, width = windows.shape
+		block = np.zeros((tiles*height + 2*reach, width), dtype=self.sum_dtype)
+		block[:tiles*height] = windows.reshape(tiles*height, width)
+		sums = self.tile_plan.correlate(block).reshape(tiles, height, width - 2*reach)[:, :SPARSE_TILE_ROWS]
+		before = windows[:, reach:reach + SPARSE_TILE_ROWS, reach:reach + SPARSE_TILE_COLS]
+		return before, self.transition(before, sums)
+
+	"""
+	Tiles to recompute in the next generation: the tiles (tr, tc) that changed and, when a change is within the reach
+	of an edge of the tile, the neighbouring tiles on that side. Every tile, even the last ones (1080 % 32 = 24 rows,
+	1052 % 32 = 28 rows), is at least RADIUS cells wide, so a change never reaches further than the adjacent tiles.
+	"""
+	def sparse_activity(self, tile_grid, tr, tc, r0, c0, changed):
+		reach = self.reach
+		heights = np.minimum(SPARSE_TILE_ROWS, self.row_stop - r0)[:, None]
+		widths = np.minimum(SPARSE_TILE_COLS, GRID_WIDTH - c0)[:, None]
+		# Changed rows/columns of each tile. Cells past its end are not part of it.
+		rows = changed.any(axis=2) & (np.arange(SPARSE_TILE_ROWS) < heights)
+		cols = changed.any(axis=1) & (np.arange(SPARSE_TILE_COLS) < widths)
+		sides = {-1: (rows[:, :reach].any(axis=1), cols[:, :reach].any(axis=1)),
+				 0: (rows.any(axis=1), cols.any(axis=1)),
+				 1: ((rows & (np.arange(SPARSE_TILE_ROWS) >= heights - reach)).any(axis=1),
+					 (cols & (np.arange(SPARSE_TILE_COLS) >= widths - reach)).any(axis=1))}
+		active = np.zeros(tile_grid, dtype=bool)
+		for dr in (-1, 0, 1):
+			for dc in (-1, 0, 1):
+				marked = sides[0][0] & sides[dr][0] & sides[dc][1]
+				rows_to, cols_to = tr[marked] + dr, tc[marked] + dc
+				if self.toroidal:
+					rows_to, cols_to = rows_to % tile_grid[0], cols_to % tile_grid[1]
+				else: # Null rows and cells out of the grid never change (or only mirror the tiles at the edges).
+					inside = (rows_to >= 0) & (rows_to < tile_grid[0]) & (cols_to >= 0) & (cols_to < tile_grid[1])
+					rows_to, cols_to = rows_to[inside], cols_to[inside]
+				active[rows_to, cols_to] = True
+		return active
+
+	# Extract the grid as the hardware reads it back. 1920x1080 or 1920x(1080-28).
+	def extract(self, state):
+		return state[self.row_start:self.row_stop].copy()
+
+	# ============= CYCLE DETECTION ============= #
+
+	"""
+	128-bit digest of a state. Cells of up to 4 bits are packed 16 per 64-bit word and the words are hashed
+	with two random polynomials (dot products modulo 2^64). About as costly as a single pass over the grid.
+	"""
+	def digest(self, state):
+		words = np.ascontiguousarray(state).reshape(-1).view(np.uint64)
+		if self.cell_size <= 4:
+			words = words[0::2] | (words[1::2] << np.uint64(4))
+		return np.dot(self.digest_keys[:, :words.size], words).tobytes()
+
+	# Smallest period of a state, looking up to span generations ahead. None if the state does not return (digest collision).
+	def find_period(self, state, span):
+		next_state = state
+		for period in range(1, span + 1):
+			next_state = self.step(next_state)
+			if np.array_equal(next_state, state):
+				return period
+		return None
+
+	# Extracted grids of the remaining extracts, from a state of a cycle at a generation. Only one period is computed.
+	# Yielded one by one. At most one period of extracts is held.
+	def orbit_extracts(self, state, generation, period, time_step, total_extracts):
+		offsets = [(k*time_step - generation) % period for k in range(generation//time_step + 1, total_extracts + 1)]
+		if not offsets:
+			return
+		orbit = {}
+		for offset in range(max(offsets) + 1):
+			if offset in offsets:
+				orbit[offset] = self.extract(state)
+			state = self.step(state)
+		for offset in offsets:
+			yield orbit[offset].copy()
+
+	"""
+	Run time_step generations, total_extracts times, with advance(state, generations). Yields every extracted grid
+	as soon as it is computed, so only one is held at a time.
+	The state is hashed every checkpoint generations (and at every extract). When a digest was already seen, the state
+	is in a cycle: its period is found by stepping until the state returns, and the remaining extracts are taken from
+	one period of it instead of being computed. Cycles are only resolved when that is cheaper than running on.
+	"""
+	def stream_detecting(self, state, advance, time_step, total_extracts, checkpoint):
+		self.cycle = None
+		seen = {}		# Digest: generation.
+		window = deque() # (digest, generation) of the last checkpoints.
+		generation, total = 0, time_step*total_extracts
+		while generation < total:
+			next_extract = (generation//time_step + 1)*time_step
+			generations = min(checkpoint, next_extract - generation)
+			state = advance(state, generations)
+			generation += generations
+			if generation == next_extract:
+				yield self.extract(state)
+			if not self.detect_cycles:
+				continue
+			digest = self.digest(state)
+			if digest in seen and 2*(generation - seen[digest]) < total - generation:
+				period = self.find_period(state, generation - seen[digest])
+				if period is not None:
+					self.cycle = (generation, period)
+					yield from self.orbit_extracts(state, generation, period, time_step, total_extracts)
+					break
+			seen[digest] = generation
+			window.append((digest, generation))
+			if len(window) > CYCLE_WINDOW:
+				digest, generation_seen = window.popleft()
+				if seen[digest] == generation_seen:
+					del seen[digest]
+
+	# Same as stream_detecting(). Returns the list of extracted grids.
+	def run_detecting(self, state, advance, time_step, total_extracts, checkpoint):
+		return list(self.stream_detecting(state, advance, time_step, total_extracts, checkpoint))
+
+	# Run time_step generations, total_extracts times. Yields the extracted grids.
+	# Checkpoints are every generation for sparse stepping, every sweep of the tiles for temporal blocking.
+	def stream(self, init_state, time_step, total_extracts):
+		checkpoint = 1 if self.sparse else self.block_depth
+		return self.stream_detecting(self.prepare(init_state), self.advance, time_step, total_extracts, checkpoint)
+
+	# Same as stream(). Returns the list of extracted grids.
+	def run(self, init_state, time_step, total_extracts):
+		return list(self.stream(init_state, time_step, total_extracts))
+
+
+"""
+Same inputs as run_simulation(), computed on the CPU. Yields every extracted grid as soon as it is computed.
+curr_prj is not used, no files are written. By default, one worker process per core computes a band of the grid.
+sparse=True recomputes only the tiles near changes instead, in this process. For grids that are mostly stable.
+"""
+def stream_simulation_cpu(curr_prj, init_state, grid_type, cell_size, final_neighborhood, time_step,
+						  bram_values, others_value, addr_sel, total_extracts, vertical_offset, workers=None, sparse=False):
+	# vertical_offset is 0 for toroidal grids and 28 otherwise. The engine derives it from the grid type.
+	engine = CAEngine(grid_type, cell_size, final_neighborhood, bram_values, others_value, addr_sel)
+	workers = 1 if sparse else workers or os.cpu_count()
+	engine.sparse = sparse
+	print("CPU engine: %s, %d worker(s)%s" % (engine.plan, workers, ", sparse" if sparse else ""))
+	if workers == 1:
+		yield from engine.stream(init_state, time_step, total_extracts)
+	else:
+		with ParallelCAEngine(engine, workers) as parallel:
+			yield from parallel.stream(init_state, time_step, total_extracts)
+	# Run summary.
+	if engine.cycle is not None:
+		generation, period = engine.cycle
+		if period == 1:
+			print("Fixed point detected at generation %d." % generation, end=" ")
+		else:
+			print("Cycle of period %d detected at generation %d." % (period, generation), end=" ")
+		print("The remaining extracts were taken from it, without computing the rest of the %d generations." % (time_step*total_extracts))
+
+"""
+Same inputs and output as run_simulation(), computed on the CPU (see stream_simulation_cpu()).
+With on_snapshot, every extracted grid is given to on_snapshot(index, grid) as soon as it is computed and is not kept:
+nothing is returned and only one grid is held at a time.
+"""
+def run_simulation_cpu(curr_prj, init_state, grid_type, cell_size, final_neighborhood, time_step,
+					   bram_values, others_value, addr_sel, total_extracts, vertical_offset, workers=None, sparse=False,
+					   on_snapshot=None):
+	snapshots = stream_simulation_cpu(curr_prj, init_state, grid_type, cell_size, final_neighborhood, time_step,
+									  bram_values, others_value, addr_sel, total_extracts, vertical_offset, workers, sparse)
+	if on_snapshot is None:
+		return list(snapshots)
+	for i, grid in enumerate(snapshots):
+		on_snapshot(i, grid)
+
+
+# ============================== BENCHMARK ============================== #
+
+# Generations per second with temporal blocking of each depth, on a random 1920x1080 state. Depth 1 is one generation per pass.
+def benchmark_temporal_blocking(engine, depths=(1, 2, 4, 8), generations=16):
+	rng = np.random.default_rng(0)
+	init_state = engine.prepare(rng.integers(0, 2, size=(GRID_HEIGHT, GRID_WIDTH)))
+	reference = None
+	results = []
+	for depth in depths:
+		start = time.perf_counter()
+		if depth == 1:
+			state = init_state
+			for _ in range(generations):
+				state = engine.step(state)
+		else:
+			state = engine.advance_blocked(init_state, generations, depth)
+		elapsed = time.perf_counter() - start
+		# Every depth must give exactly the same state.
+		if reference is None:
+			reference = state
+		elif not np.array_equal(reference, state):
+			raise ValueError("Temporal blocking with depth %d does not match one generation per pass." % depth)
+		results.append((depth, generations/elapsed))
+	return results
+
+"""
+Generations per second of the dense and the sparse engine, on an empty grid with a few random patches,
+after they settled for a number of generations. Also returns the mean fraction of active tiles.
+"""
+def benchmark_sparse(engine, generations=50, settle=200, patches=20, patch_size=24):
+	rng = np.random.default_rng(0)
+	init_state = np.zeros((GRID_HEIGHT, GRID_WIDTH), dtype=np.uint8)
+	for _ in range(patches):
+		r = rng.integers(engine.row_start, engine.row_stop - patch_size)
+		c = rng.integers(0, GRID_WIDTH - patch_size)
+		init_state[r:r + patch_size, c:c + patch_size] = rng.integers(0, 2, size=(patch_size, patch_size))
+	init_state = engine.advance(engine.prepare(init_state), settle)
+	results = []
+	for sparse in (False, True):
+		engine.sparse = sparse
+		start = time.perf_counter()
+		if sparse: # One generation per call, to sample the active tiles. The activity is kept between calls.
+			state, activity = init_state, 0
+			for _ in range(generations):
+				state = engine.advance(state, 1)
+				activity += engine.active_tiles.mean()
+		else:
+			state, activity = engine.advance(init_state, generations), generations
+		results.append((generations/(time.perf_counter() - start), state, activity/generations))
+	engine.sparse = False
+	if not np.array_equal(results[0][1], results[1][1]):
+		raise ValueError("Sparse stepping does not match the dense engine.")
+	return results[0][0], results[1][0], results[1][2]
+
+if __name__ == "__main__":
+	# Game of Life on a 29x29 window. Central cell's state and the sum of its 8 neighbours address the LUT.
+	kernel = np.zeros((NEIGH_SIZE, NEIGH_SIZE), dtype=int)
+	kernel[RADIUS-1:RADIUS+2, RADIUS-1:RADIUS+2] = 1
+	kernel[RADIUS, RADIUS] = 0
+	lut = [0]*BRAM_DEPTH
+	lut[3] = lut[(1 << 10) | 2] = lut[(1 << 10) | 3] = 1
+	for grid_type in ("TOROIDAL", "NULL"):
+		engine = CAEngine(grid_type, 4, kernel.ravel().tolist(), lut, 0, 1)
+		print("%s grid, reach %d, auto depth %d" % (grid_type, engine.reach, engine.block_depth))
+		results = benchmark_temporal_blocking(engine)
+		for depth, gens_per_sec in results:
+			print("  depth %2d: %7.2f gens/sec (x%.2f)" % (depth, gens_per_sec, gens_per_sec/results[0][1]))
+		dense, sparse, activity = benchmark_sparse(engine)
+		print("  sparse patches: dense %.2f gens/sec, sparse %.2f gens/sec (x%.2f), %.1f%% active tiles" % (dense, sparse, sparse/dense, 100*activity))
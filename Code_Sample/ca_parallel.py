@@ -0,0 +1,185 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Multi-core version of the CPU engine. The grid is split into horizontal bands, one per worker process.
+	     The state lives in two shared memory buffers (current/next generation). Every generation, each worker
+	     reads its band plus the 14-row halos of its neighbours from the current buffer (wrapping around for
+	     toroidal grids), writes its band into the next buffer and waits on a barrier for the rest.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+# Processes and shared memory
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+from queue import Empty
+import os
+import time
+
+# Global Scope
+CHECKPOINT = 8 # Generations per command of run(). The state is hashed between commands, for cycle detection.
+POLL = 1.0 # Seconds between checks that the workers are alive, while waiting for them.
+
+# ============================== WORKERS ============================== #
+
+# Loop of a worker. Computes rows [start, stop) for as many generations as each command asks.
+def band_worker(engine, names, shape, start, stop, commands, done, barrier):
+	shms = [shared_memory.SharedMemory(name=name) for name in names]
+	buffers = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf) for shm in shms]
+	src = dst = None
+	while True:
+		command = commands.get()
+		if command is None: # Close.
+			break
+		current, generations = command
+		try:
+			for g in range(generations):
+				src = buffers[(current + g) % 2]
+				dst = buffers[(current + g + 1) % 2]
+				dst[start:stop] = engine.step_rows(src, start, stop)
+				# Nobody reads the next generation before every band has been written.
+				barrier.wait()
+		except BrokenBarrierError: # Another worker died. The host gives up on the run.
+			break
+		done.put(start)
+	del buffers, src, dst
+	for shm in shms:
+		shm.close()
+
+# ============================== PARALLEL ENGINE ============================== #
+class ParallelCAEngine:
+	"""
+	Wraps a CAEngine. Same run() as CAEngine, computed by a number of worker processes.
+	Use it as a context manager, or call close(), to stop the workers and free the shared memory.
+	"""
+	def __init__(self, engine, workers=None, shape=(1080, 1920)):
+		self.engine = engine
+		rows = engine.row_stop - engine.row_start
+		self.workers = max(1, min(workers or os.cpu_count(), rows))
+		self.shape = shape
+		# Two buffers. Current and next generation.
+		size = int(np.prod(shape))
+		self.shms = [shared_memory.SharedMemory(create=True, size=size) for _ in range(2)]
+		self.buffers = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf) for shm in self.shms]
+		self.current = 0
+
+		# Equal bands of the computed rows.
+		bounds = np.linspace(engine.row_start, engine.row_stop, self.workers + 1).astype(int)
+		self.bands = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+		self.barrier = mp.Barrier(self.workers)
+		self.done = mp.Queue()
+		self.commands = []
+		self.processes = []
+		for start, stop in self.bands:
+			commands = mp.Queue()
+			process = mp.Process(target=band_worker, daemon=True,
+								 args=(engine, [shm.name for shm in self.shms], shape, start, stop, commands, self.done, self.barrier))
+			process.start()
+			self.commands.append(commands)
+			self.processes.append(process)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	# Stop the workers and free the shared memory.
+	def close(self):
+		for commands in self.commands:
+			commands.put(None)
+		for process in self.processes:
+			process.join(POLL)
+			if process.is_alive(): # Stuck after a failed advance().
+				process.terminate()
+				process.join()
+		self.commands, self.processes = [], []
+		self.buffers = []
+		for shm in self.shms:
+			shm.close()
+			shm.unlink()
+		self.shms = []
+
+	# Copy a state into both buffers. Null rows stay 0 in both of them.
+	def load(self, state):
+		for buffer in self.buffers:
+			buffer[:] = state
+		self.current = 0
+
+	"""
+	Advance the state in shared memory. If a worker dies meanwhile, the barrier is aborted so the others stop waiting
+	for it, and RuntimeError is raised. The state is then undefined and the engine can only be closed.
+	"""
+	def advance(self, generations):
+		if generations <= 0:
+			return
+		for commands in self.commands:
+			commands.put((self.current, generations))
+		finished = 0
+		while finished < len(self.processes):
+			try:
+				self.done.get(timeout=POLL)
+				finished += 1
+			except Empty:
+				dead = [process for process in self.processes if not process.is_alive()]
+				if dead:
+					self.barrier.abort()
+					raise RuntimeError("%d worker(s) exited during a run (exit code %s)." % (len(dead), dead[0].exitcode))
+		self.current = (self.current + generations) % 2
+
+	# Current state. A view of shared memory, valid until the next advance().
+	def state(self):
+		return self.buffers[self.current]
+
+	# Run time_step generations, total_extracts times. Yields the extracted grids.
+	# Stops early when the state enters a cycle, as CAEngine.stream() does.
+	def stream(self, init_state, time_step, total_extracts):
+		self.load(self.engine.prepare(init_state))
+		def advance(state, generations):
+			self.advance(generations)
+			return self.state()
+		return self.engine.stream_detecting(self.state(), advance, time_step, total_extracts, CHECKPOINT)
+
+	# Same as stream(). Returns the list of extracted grids.
+	def run(self, init_state, time_step, total_extracts):
+		return list(self.stream(init_state, time_step, total_extracts))
+
+# ============================== BENCHMARK ============================== #
+
+"""
+Generations per second for a number of workers, on a random 1920x1080 state.
+Scaling efficiency is speedup/workers, where speedup is relative to a single worker.
+Every run must give exactly the same state as the single-process engine.
+"""
+def benchmark_scaling(engine, workers_list=None, generations=20):
+	if workers_list is None:
+		workers_list = sorted({1, 2, 4, 8, 16, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+	rng = np.random.default_rng(0)
+	init_state = engine.prepare(rng.integers(0, 2, size=(1080, 1920)))
+	reference = engine.advance(init_state, generations)
+	results = []
+	for workers in workers_list:
+		with ParallelCAEngine(engine, workers) as parallel:
+			parallel.load(init_state)
+			start = time.perf_counter()
+			parallel.advance(generations)
+			elapsed = time.perf_counter() - start
+			if not np.array_equal(parallel.state(), reference):
+				raise ValueError("Parallel engine with %d workers does not match the single-process engine." % workers)
+		results.append((workers, generations/elapsed))
+	base = results[0][1] / results[0][0]
+	return [(workers, gens_per_sec, gens_per_sec/base/workers) for workers, gens_per_sec in results]
+
+if __name__ == "__main__":
+	from ca_engine import CAEngine, NEIGH_SIZE
+	# Game of Life on a 29x29 window. Central cell's state and the sum of its 8 neighbours address the LUT.
+	kernel = np.zeros((NEIGH_SIZE, NEIGH_SIZE), dtype=int)
+	kernel[13:16, 13:16] = 1
+	kernel[14, 14] = 0
+	lut = [0]*16384
+	lut[3] = lut[(1 << 10) | 2] = lut[(1 << 10) | 3] = 1
+	engine = CAEngine("TOROIDAL", 4, kernel.ravel().tolist(), lut, 0, 1)
+	print("Workers  Gens/sec  Efficiency")
+	for workers, gens_per_sec, efficiency in benchmark_scaling(engine):
+		print("%7d  %8.2f  %9.0f%%" % (workers, gens_per_sec, 100*efficiency))
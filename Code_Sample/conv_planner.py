@@ -0,0 +1,184 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Picks the cheapest exact integer strategy to compute the weighted neighborhood sums of the CPU engine.
+	     The kernel is inspected once (non-zero weights, rank, symmetry) and the plan is cached per kernel.
+	     Strategies:
+	       direct    : one pass over the grid per non-zero weight.
+	       separable : rank-1 kernel, outer(column, row). One horizontal and one vertical 1D pass.
+	       low-rank  : sum of a few separable terms (e.g. Cross, Hash).
+	       fft       : dense kernels of high rank. Exact after rounding, since sums are far below 2^52.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+from math import gcd
+from functools import lru_cache, reduce
+import time
+
+# Global Scope
+# Estimated cost of the FFT strategy, in passes over the grid (one pass = one multiply-add of the whole grid).
+# Measured with python conv_planner.py: direct takes 0.7-0.8s for the 841 passes of Moore (~0.9ms a pass),
+# forward and inverse real FFTs of a 1108x1948 block 0.25-0.35s, so the FFT is worth 300 to 400 passes.
+# The low-rank plans of von Neumann, Circular and L2/Euclidean (220-250 passes) are faster than the FFT.
+FFT_COST = 400
+# Kernels that need more separable terms than this are not decomposed.
+MAX_TERMS = 29
+
+# ============================== PLAN ============================== #
+class ConvolutionPlan:
+	"""
+	How to correlate a padded block with the kernel. correlate(block) returns the sums of the "valid" window:
+	out[i, j] = sum over (r, c) of kernel[r, c] * block[i + r, j + c], for a block padded by the radius on every side.
+	Sums are accumulated in the dtype of the block. The caller picks one that cannot overflow.
+	"""
+	def __init__(self, kernel, strategy, terms, cost):
+		self.kernel = kernel			 # 29x29 int32 kernel.
+		self.strategy = strategy 		 # "direct", "separable", "low-rank" or "fft".
+		self.terms = terms 				 # List of (column, row) vectors for separable/low-rank.
+		self.cost = cost 				 # Estimated passes over the grid.
+		self.nonzeros = int(np.count_nonzero(kernel))
+		self.rank = int(np.linalg.matrix_rank(kernel)) if self.nonzeros else 0
+		self.symmetric = bool(np.array_equal(kernel, kernel[::-1, ::-1]))
+		self.fft_kernels = {} 			 # FFT of the kernel per block shape.
+
+	def __repr__(self):
+		return "ConvolutionPlan(%s, cost=%d, nonzeros=%d, rank=%d, symmetric=%s)" % (self.strategy, self.cost, self.nonzeros, self.rank, self.symmetric)
+
+	def correlate(self, block):
+		if self.strategy == "fft":
+			return self.correlate_fft(block)
+		if self.strategy == "direct":
+			return self.correlate_direct(block)
+		return self.correlate_terms(block)
+
+	# One pass per non-zero weight.
+	def correlate_direct(self, block):
+		k_rows, k_cols = self.kernel.shape
+		rows, cols = block.shape[0] - k_rows + 1, block.shape[1] - k_cols + 1
+		sums = np.zeros((rows, cols), dtype=block.dtype)
+		for r, c in zip(*np.nonzero(self.kernel)):
+			add_weighted(sums, self.kernel[r, c], block[r:r + rows, c:c + cols])
+		return sums
+
+	# Sum of separable terms. Horizontal 1D pass with the row vector, then vertical with the column vector.
+	def correlate_terms(self, block):
+		k_rows, k_cols = self.kernel.shape
+		rows, cols = block.shape[0] - k_rows + 1, block.shape[1] - k_cols + 1
+		sums = np.zeros((rows, cols), dtype=block.dtype)
+		horizontal = np.empty((block.shape[0], cols), dtype=block.dtype)
+		for column, row in self.terms:
+			horizontal.fill(0)
+			for c in np.nonzero(row)[0]:
+				add_weighted(horizontal, row[c], block[:, c:c + cols])
+			for r in np.nonzero(column)[0]:
+				add_weighted(sums, column[r], horizontal[r:r + rows])
+		return sums
+
+	# Correlation as a product in the frequency domain. The "valid" part of a circular convolution is exact.
+	def correlate_fft(self, block):
+		k_rows, k_cols = self.kernel.shape
+		rows, cols = block.shape[0] - k_rows + 1, block.shape[1] - k_cols + 1
+		if block.shape not in self.fft_kernels:
+			# Correlation is convolution with the flipped kernel.
+			flipped = self.kernel if self.symmetric else self.kernel[::-1, ::-1]
+			self.fft_kernels[block.shape] = np.fft.rfft2(flipped, s=block.shape)
+		product = np.fft.rfft2(block) * self.fft_kernels[block.shape]
+		full = np.fft.irfft2(product, s=block.shape)
+		return np.rint(full[k_rows - 1:k_rows - 1 + rows, k_cols - 1:k_cols - 1 + cols]).astype(block.dtype)
+
+# sums += weight*values, without a temporary array for unit weights.
+def add_weighted(sums, weight, values):
+	if weight == 1:
+		sums += values
+	else:
+		sums += weight*values
+
+# ============================== PLANNER ============================== #
+
+"""
+Exact integer decomposition into separable terms. Rows are grouped by their primitive pattern
+(divided by the gcd of their entries, first non-zero entry positive). Each group is one term:
+outer(multipliers of the rows, pattern). A rank-1 kernel always gives one term.
+"""
+def separable_terms(kernel):
+	patterns = {}
+	for r in range(kernel.shape[0]):
+		row = kernel[r]
+		nonzero = np.nonzero(row)[0]
+		if nonzero.size == 0:
+			continue
+		divisor = reduce(gcd, (abs(int(w)) for w in row[nonzero]))
+		if row[nonzero[0]] < 0:
+			divisor = -divisor
+		pattern = row // divisor
+		key = pattern.tobytes()
+		if key not in patterns:
+			patterns[key] = (np.zeros(kernel.shape[0], dtype=np.int32), pattern.astype(np.int32))
+		patterns[key][0][r] = divisor
+	return list(patterns.values())
+
+# Passes over the grid for a list of terms.
+def terms_cost(terms):
+	return sum(np.count_nonzero(column) + np.count_nonzero(row) for column, row in terms)
+
+# Choose the strategy with the lowest estimated cost.
+def make_plan(kernel):
+	kernel = np.asarray(kernel, dtype=np.int32)
+	candidates = [("direct", [], int(np.count_nonzero(kernel)))]
+
+	# Group the rows or the columns, whichever gives the cheaper terms.
+	row_terms = separable_terms(kernel)
+	col_terms = [(row, column) for column, row in separable_terms(kernel.T)]
+	terms = min(row_terms, col_terms, key=terms_cost)
+	if 0 < len(terms) <= MAX_TERMS:
+		candidates.append(("separable" if len(terms) == 1 else "low-rank", terms, terms_cost(terms)))
+
+	candidates.append(("fft", [], FFT_COST))
+	strategy, terms, cost = min(candidates, key=lambda candidate: candidate[2])
+	return ConvolutionPlan(kernel, strategy, terms, cost)
+
+# Plans are cached per kernel. The key is the content of the kernel.
+@lru_cache(maxsize=64)
+def cached_plan(kernel_bytes, shape):
+	return make_plan(np.frombuffer(kernel_bytes, dtype=np.int32).reshape(shape))
+
+def plan_convolution(kernel):
+	kernel = np.ascontiguousarray(kernel, dtype=np.int32)
+	return cached_plan(kernel.tobytes(), kernel.shape)
+
+# ============================== BENCHMARK ============================== #
+
+# Time every strategy for a kernel on a 1920x1080 grid. Returns {strategy: seconds}.
+def benchmark(kernel, cell_size=4, repeats=1):
+	kernel = np.asarray(kernel, dtype=np.int32)
+	rng = np.random.default_rng(0)
+	radius = kernel.shape[0]//2
+	block = rng.integers(0, 1 << cell_size, size=(1080 + 2*radius, 1920 + 2*radius)).astype(np.int32)
+	plan = make_plan(kernel)
+	reference = None
+	timings = {}
+	for strategy in ("direct", "separable", "fft"):
+		terms = separable_terms(kernel)
+		candidate = ConvolutionPlan(kernel, "low-rank" if strategy == "separable" and len(terms) > 1 else strategy, terms, 0)
+		start = time.perf_counter()
+		for _ in range(repeats):
+			sums = candidate.correlate(block)
+		timings[candidate.strategy] = (time.perf_counter() - start)/repeats
+		# Every strategy must give exactly the same sums.
+		if reference is None:
+			reference = sums
+		elif not np.array_equal(reference, sums):
+			raise ValueError("Strategy %s does not match the direct sums." % candidate.strategy)
+	return plan, timings
+
+if __name__ == "__main__":
+	from neighborhood import NeighborhoodModel, pattern_names
+	model = NeighborhoodModel()
+	for neigh_type in pattern_names():
+		model.neigh_type = neigh_type
+		model.draw_neighborhood()
+		plan, timings = benchmark(model.weights)
+		# FFT_COST as measured: the FFT time in passes, a pass being the direct time per non-zero weight.
+		fft_passes = timings["fft"]/(timings["direct"]/plan.nonzeros)
+		print("%-15s %-60s %s, fft ~ %d passes" % (neigh_type, plan, ", ".join("%s %.3fs" % item for item in timings.items()), fft_passes))
@@ -0,0 +1,516 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Bit-accurate software model of the DESERIALIZER FSM (RESET/TAG/LENGTH/VALUE_REPEATED/VALUE_OPTIONAL,
+	     TRIMMED_DIAMETER/TRIMMED_WEIGHTS, RUN_COUNT/RUN_VALUE/RUN_EXPAND).
+	     Takes the byte stream of the UART and gives the same outputs as the hardware: FIFO bytes, rows of weights,
+	     BRAM writes (address/data), total_gens, otherwise and addr_sel. Quirks of the hardware are kept, e.g.:
+	       - LENGTH counts values, not bytes. Its last byte (if it is the 4th or later) only sets bit 21.
+	       - The field ends on the stop byte of its LENGTH-th value. The last value may take 2 bytes, as the others.
+	       - A value keeps the 7 bits of its last continuation byte and the 7 bits of its stop byte (up to 14 bits).
+	       - A LENGTH of 0 keeps the FSM in VALUE_REPEATED until a reset.
+	       - Trimmed weights (0x42) ignore LENGTH: the field ends when the 29x29 window is complete. A diameter of
+	         NEIGHBORHOOD_SIZE or more is the whole window, an even one is off-centre, 0 is a window of zeros.
+	       - Compressed grids (0x3a runs, 0x4a sparse) end after LENGTH cells, even in the middle of a pair.
+	         Counts keep 21 bits (3 bytes), values 14 bits, as the other varints.
+	     Bytes are assumed to arrive at the rate of the UART, many clock cycles apart, as they do on the board:
+	     the zeros of trimmed weights and the cells of a pair (RUN_EXPAND) are out before the next byte.
+	     feed() decodes the repeated fields and the pairs of compressed grids with NumPy, all at once.
+	     feed(..., fast=False) steps the FSM byte by byte. Both give the same outputs and can be mixed, chunk by chunk.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+import time
+# My Files
+from serializer import (Serializer, sample_grids, MAX_VARINT_BYTES, TAG_TIME_STEP, TAG_WEIGHTS, TAG_BRAM, TAG_OTHERS, TAG_ADDR_SEL, TAG_GRID,
+						TAG_WEIGHTS_TRIMMED, TAG_GRID_RUNS, TAG_GRID_SPARSE)
+from neighborhood import pad_neighborhood
+
+# Global Scope
+# States of the FSM.
+RESET, TAG, LENGTH, VALUE_REPEATED, VALUE_OPTIONAL = "RESET", "TAG", "LENGTH", "VALUE_REPEATED", "VALUE_OPTIONAL"
+TRIMMED_DIAMETER, TRIMMED_WEIGHTS = "TRIMMED_DIAMETER", "TRIMMED_WEIGHTS"
+RUN_COUNT, RUN_VALUE = "RUN_COUNT", "RUN_VALUE"
+# data_kind of each tag. 1: grid, 2: weights, 3: time step, 4: BRAM, 5: others, 6: addr_sel, 7: trimmed weights,
+# 8: grid runs, 9: sparse grid.
+(KIND_GRID, KIND_WEIGHTS, KIND_TIME_STEP, KIND_BRAM, KIND_OTHERS, KIND_ADDR_SEL, KIND_WEIGHTS_TRIMMED,
+ KIND_GRID_RUNS, KIND_GRID_SPARSE) = range(1, 10)
+TAG_KINDS = {TAG_GRID: KIND_GRID, TAG_WEIGHTS: KIND_WEIGHTS, TAG_TIME_STEP: KIND_TIME_STEP,
+			 TAG_BRAM: KIND_BRAM, TAG_OTHERS: KIND_OTHERS, TAG_ADDR_SEL: KIND_ADDR_SEL, TAG_WEIGHTS_TRIMMED: KIND_WEIGHTS_TRIMMED,
+			 TAG_GRID_RUNS: KIND_GRID_RUNS, TAG_GRID_SPARSE: KIND_GRID_SPARSE}
+GRID_KINDS = (KIND_GRID, KIND_GRID_RUNS, KIND_GRID_SPARSE) # To the FIFO.
+LENGTH_KINDS = GRID_KINDS + (KIND_WEIGHTS, KIND_BRAM, KIND_WEIGHTS_TRIMMED)
+LENGTH_BITS = 22 # tag_length(21 downto 0)
+BRAM_DEPTH = 16384
+
+# ============================== MODEL ============================== #
+class DeserializerModel:
+	"""
+	Registers of the FSM and of its outputs. Outputs are collected as they are produced:
+	  fifo()       : bytes written to the FIFO.
+	  weight_rows(): one row of NEIGHBORHOOD_SIZE weights per valid_weights_row, slot 0 first.
+	  bram_writes(): (addresses, data) of every BRAM write, in order.
+	  total_gens, otherwise, addr_sel : last registered values. None until one is received.
+	"""
+	def __init__(self, cell_size=4, neighborhood_size=29):
+		self.cell_size = cell_size
+		self.neighborhood_size = neighborhood_size
+		self.cell_mask = (1 << cell_size) - 1
+		self.weight_mask = (1 << min(8, 32//cell_size)) - 1 # signal_weight(7 downto 0), then (32/CELL_SIZE-1 downto 0).
+		self.weights_register = np.zeros(neighborhood_size, dtype=np.int64) # weights_row.
+		self.total_gens = None
+		self.otherwise = None
+		self.addr_sel = None
+		self.fifo_chunks = []
+		self.fifo_count = 0 # Bytes written to the FIFO so far.
+		self.row_chunks = []
+		self.bram_addr_chunks = []
+		self.bram_data_chunks = []
+		self.reset()
+
+	# rst = '1' and the RESET state. Output registers keep their values, as in hardware.
+	def reset(self):
+		self.state = TAG
+		self.clear_counters()
+		self.data_out = 0
+
+	# What RESET and TAG clear.
+	def clear_counters(self):
+		self.tag_length = 0
+		self.bytes_counter = 0
+		self.total_bytes_received = 0 # Counts values, despite its name.
+		self.data_kind = 0
+		self.weights_counter = self.neighborhood_size - 1
+		self.write_address = BRAM_DEPTH - 1
+		self.trim_position = 0 # trim_y*NEIGHBORHOOD_SIZE + trim_x.
+		self.trim_first = 0
+		self.trim_last = self.neighborhood_size - 1
+		self.run_count = 0 # run_count(20 downto 0)
+		self.run_value = 0 # run_value(13 downto 0)
+
+	# ============= OUTPUTS ============= #
+
+	def fifo(self):
+		return np.concatenate(self.fifo_chunks).astype(np.uint8) if self.fifo_chunks else np.zeros(0, dtype=np.uint8)
+
+	def weight_rows(self):
+		return np.concatenate(self.row_chunks) if self.row_chunks else np.zeros((0, self.neighborhood_size), dtype=np.int64)
+
+	def bram_writes(self):
+		if not self.bram_addr_chunks:
+			return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+		return np.concatenate(self.bram_addr_chunks), np.concatenate(self.bram_data_chunks)
+
+	# Everything the hardware outputs, to compare two models.
+	def outputs(self):
+		addresses, data = self.bram_writes()
+		return (self.fifo().tobytes(), self.weight_rows().tobytes(), addresses.tobytes(), data.tobytes(),
+				self.total_gens, self.otherwise, self.addr_sel, self.weights_register.tobytes())
+
+	"""
+	Values of the current field that became valid (signal_data_out_valid), in order, sent to the outputs of data_kind.
+	repeated: weights_counter and write_address advance once per value (only in VALUE_REPEATED).
+	"""
+	def emit(self, values, repeated):
+		values = np.asarray(values)
+		kind = self.data_kind
+		if repeated:
+			n = self.neighborhood_size
+			first_slot = (self.weights_counter + 1) % n
+			self.weights_counter = (self.weights_counter + values.size) % n
+			addresses = (self.write_address + 1 + np.arange(values.size)) % BRAM_DEPTH
+			self.write_address = int(addresses[-1])
+		if kind in GRID_KINDS:
+			self.fifo_chunks.append((values & 0xff).astype(np.uint8))
+			self.fifo_count += values.size
+		elif kind in (KIND_WEIGHTS, KIND_WEIGHTS_TRIMMED):
+			# Registered slot by slot. A row is out when its last slot is written.
+			weights = np.concatenate([self.weights_register[:first_slot], values.astype(np.int64) & self.weight_mask])
+			rows = weights.size//n
+			if rows:
+				self.row_chunks.append(weights[:rows*n].reshape(rows, n))
+				self.weights_register[:] = weights[(rows - 1)*n:rows*n]
+			tail = weights[rows*n:]
+			self.weights_register[:tail.size] = tail
+		elif kind == KIND_TIME_STEP:
+			self.total_gens = int(values[-1])
+		elif kind == KIND_BRAM:
+			self.bram_addr_chunks.append(addresses)
+			self.bram_data_chunks.append(values.astype(np.int64) & self.cell_mask)
+		elif kind == KIND_OTHERS:
+			self.otherwise = int(values[-1]) & self.cell_mask
+		elif kind == KIND_ADDR_SEL:
+			# signal_addr_sel is an integer range 0 to 1. Only its LSB is kept.
+			self.addr_sel = int(values[-1]) & 1
+
+	# ============= FSM ============= #
+
+	# Stop byte of a value. bytes_counter = 1 if the previous byte of the value had the continuation bit.
+	def stop_byte(self, byte):
+		if self.bytes_counter == 1:
+			self.data_out = (self.data_out & 0x7f) | ((byte & 0x7f) << 7)
+		else:
+			self.data_out = byte & 0x7f
+
+	# Position (trim_y, trim_x) of the 29x29 window inside the trimmed block.
+	def trim_inside(self, position):
+		y, x = divmod(position, self.neighborhood_size)
+		return self.trim_first <= y <= self.trim_last and self.trim_first <= x <= self.trim_last
+
+	"""
+	Positions outside the trimmed block, from trim_position on, up to the next one inside. One zero weight per clock,
+	all of them before the next byte arrives. Back to TAG when the window is complete.
+	"""
+	def trim_padding(self):
+		end = self.trim_position
+		while end < self.neighborhood_size**2 and not self.trim_inside(end):
+			end += 1
+		if end > self.trim_position:
+			self.data_out = 0
+			self.emit(np.zeros(end - self.trim_position, dtype=np.int64), True)
+			self.trim_position = end
+		if self.trim_position == self.neighborhood_size**2:
+			self.state = TAG
+
+	"""
+	RUN_EXPAND: the cells of a pair, one per clock, all of them before the next byte arrives. Runs are count cells of
+	the value, sparse pairs count zeros and then the value. Stops at LENGTH cells. Back to TAG when the grid is complete.
+	"""
+	def run_expand(self):
+		room = max(self.tag_length - self.total_bytes_received, 0)
+		if self.data_kind == KIND_GRID_RUNS:
+			cells = np.full(min(self.run_count, room), self.run_value, dtype=np.int64)
+		else:
+			cells = np.zeros(min(self.run_count + 1, room), dtype=np.int64)
+			if self.run_count < room:
+				cells[-1] = self.run_value
+		self.run_count -= min(self.run_count, room)
+		if cells.size:
+			self.data_out = int(cells[-1])
+			self.total_bytes_received += cells.size
+			self.emit(cells, False)
+		self.state = TAG if self.total_bytes_received >= self.tag_length else RUN_COUNT
+
+	# One byte, one transition of the FSM.
+	def step(self, byte):
+		if self.state == TAG:
+			self.clear_counters()
+			if byte in TAG_KINDS:
+				self.data_kind = TAG_KINDS[byte]
+				self.state = LENGTH if self.data_kind in LENGTH_KINDS else VALUE_OPTIONAL
+		elif self.state == LENGTH:
+			if byte & 0x80:
+				# Bytes past the 3rd one fall out of tag_length(21 downto 0).
+				self.tag_length |= ((byte & 0x7f) << 7*self.bytes_counter) & ((1 << LENGTH_BITS) - 1)
+				self.bytes_counter += 1
+			else:
+				if self.bytes_counter >= 3:
+					self.tag_length = (self.tag_length & ~(1 << 21)) | ((byte & 1) << 21)
+				else:
+					self.tag_length |= (byte & 0x7f) << 7*self.bytes_counter
+				self.bytes_counter = 0
+				if self.data_kind == KIND_WEIGHTS_TRIMMED:
+					self.state = TRIMMED_DIAMETER
+				elif self.data_kind in (KIND_GRID_RUNS, KIND_GRID_SPARSE):
+					self.state = RUN_COUNT
+				else:
+					self.state = VALUE_REPEATED
+		elif self.state == VALUE_REPEATED:
+			if self.total_bytes_received == self.tag_length - 1:
+				# Last value. The field ends on its stop byte.
+				if byte & 0x80:
+					self.data_out = (self.data_out & ~0x7f) | (byte & 0x7f)
+					self.bytes_counter = 1
+				else:
+					self.stop_byte(byte)
+					self.bytes_counter = 0
+					self.emit([self.data_out], True)
+					self.state = TAG
+			elif self.total_bytes_received < self.tag_length - 1:
+				if byte & 0x80:
+					self.data_out = (self.data_out & ~0x7f) | (byte & 0x7f)
+					self.bytes_counter = 1
+				else:
+					self.stop_byte(byte)
+					self.bytes_counter = 0
+					self.total_bytes_received += 1
+					self.emit([self.data_out], True)
+			# Otherwise (LENGTH = 0), stuck until a reset.
+		elif self.state == VALUE_OPTIONAL:
+			if byte & 0x80:
+				self.data_out = (self.data_out & ~0x7f) | (byte & 0x7f)
+				self.bytes_counter = 1
+			else:
+				self.stop_byte(byte)
+				self.bytes_counter = 0
+				self.emit([self.data_out], False)
+				self.state = TAG
+		elif self.state == TRIMMED_DIAMETER:
+			diameter = byte & 0x7f
+			n = self.neighborhood_size
+			if diameter >= n:
+				self.trim_first, self.trim_last = 0, n - 1
+			else:
+				self.trim_first, self.trim_last = (n - diameter)//2, (n + diameter)//2 - 1
+			self.state = TRIMMED_WEIGHTS
+			self.trim_padding()
+		elif self.state == TRIMMED_WEIGHTS:
+			if byte & 0x80:
+				self.data_out = (self.data_out & ~0x7f) | (byte & 0x7f)
+				self.bytes_counter = 1
+			else:
+				self.stop_byte(byte)
+				self.bytes_counter = 0
+				self.emit([self.data_out], True)
+				self.trim_position += 1
+				self.trim_padding()
+		elif self.state == RUN_COUNT:
+			# Up to 3 bytes (21 bits). Later bytes of the same count are ignored.
+			if self.bytes_counter < 3:
+				shift = 7*self.bytes_counter
+				self.run_count = (self.run_count & ~(0x7f << shift)) | ((byte & 0x7f) << shift)
+			if byte & 0x80:
+				self.bytes_counter = min(self.bytes_counter + 1, 3)
+			else:
+				self.bytes_counter = 0
+				self.state = RUN_VALUE
+		elif self.state == RUN_VALUE:
+			if byte & 0x80:
+				self.run_value = (self.run_value & ~0x7f) | (byte & 0x7f)
+				self.bytes_counter = 1
+			else:
+				if self.bytes_counter == 1:
+					self.run_value = (self.run_value & 0x7f) | ((byte & 0x7f) << 7)
+				else:
+					self.run_value = byte & 0x7f
+				self.bytes_counter = 0
+				self.run_expand()
+
+	"""
+	The complete values of a repeated field in data[i:], all at once. Called at a value boundary (bytes_counter = 0).
+	The k-th value ends at the k-th stop byte. Its upper 7 bits come from the stop byte and, if the byte before it is
+	a continuation byte of the same value, its lower 7 bits from that byte. Returns the index after the last value.
+	"""
+	def fast_values(self, data, i):
+		remaining = self.tag_length - 1 - self.total_bytes_received # Values before the last one.
+		# Common case, no continuation bytes: every byte is a value.
+		run = data[i:i + remaining]
+		if run.size == remaining and int(run.max()) < 0x80:
+			self.data_out = int(run[-1])
+			self.total_bytes_received += remaining
+			self.emit(run, True)
+			return i + remaining
+		# Look for the stop bytes in a window, grown until it holds enough of them.
+		window = remaining + 16
+		while True:
+			stops = np.flatnonzero(data[i:i + window] < 0x80)
+			if stops.size >= remaining or i + window >= data.size:
+				break
+			window *= 2
+		stops = stops[:remaining] + i
+		if stops.size == 0:
+			return i
+		previous = data[np.maximum(stops - 1, 0)]
+		continued = (stops > i) & (previous >= 0x80)
+		low = data[stops].astype(np.int64) & 0x7f
+		values = np.where(continued, (previous.astype(np.int64) & 0x7f) | (low << 7), low)
+		self.data_out = int(values[-1])
+		self.total_bytes_received += values.size
+		self.emit(values, True)
+		return int(stops[-1]) + 1
+
+	"""
+	The complete pairs of a compressed grid in data[i:], all at once. Called at a pair boundary (RUN_COUNT,
+	bytes_counter = 0). Varints end at stop bytes and alternate count, value. A count keeps its first 3 bytes (21 bits),
+	a value its last 2 (14 bits), as in RUN_COUNT and RUN_VALUE. Pairs are expanded up to the one that completes the
+	grid (back to TAG). A pair that would cross LENGTH is left to step(). Returns the index after the last pair.
+	"""
+	def fast_pairs(self, data, i):
+		room = max(self.tag_length - self.total_bytes_received, 0)
+		window = data[i:i + 2*MAX_VARINT_BYTES*(room + 1)]
+		stops = np.flatnonzero(window < 0x80)
+		pairs = stops.size//2
+		if pairs == 0:
+			return i
+		stops = stops[:2*pairs]
+		starts = np.concatenate([[0], stops[:-1] + 1])
+		sizes = stops - starts + 1
+		low = window[stops].astype(np.int64) & 0x7f
+		# Count: bytes 0, 1 and 2 of the varint. Value: the byte before the stop byte and the stop byte.
+		byte = lambda k: np.where(sizes > k, window[np.minimum(starts + k, window.size - 1)].astype(np.int64) & 0x7f, 0)
+		counts = (byte(0) | (byte(1) << 7) | (byte(2) << 14))[0::2]
+		previous = window[np.maximum(stops - 1, 0)].astype(np.int64) & 0x7f
+		values = np.where(sizes > 1, previous | (low << 7), low)[1::2]
+		cells = counts if self.data_kind == KIND_GRID_RUNS else counts + 1
+		ends = np.cumsum(cells)
+		last = int(np.searchsorted(ends, room)) # First pair that reaches LENGTH.
+		done = last < pairs and ends[last] == room
+		pairs = last + 1 if done else min(last, pairs)
+		if pairs == 0:
+			return i
+		counts, values = counts[:pairs], values[:pairs]
+		if self.data_kind == KIND_GRID_RUNS:
+			expanded = np.repeat(values, counts)
+		else:
+			expanded = np.zeros(int(ends[pairs - 1]), dtype=np.int64)
+			expanded[ends[:pairs] - 1] = values
+		if expanded.size:
+			self.data_out = int(expanded[-1])
+			self.total_bytes_received += expanded.size
+			self.emit(expanded, False)
+		self.run_value = int(values[-1])
+		self.run_count = 0
+		self.state = TAG if done else RUN_COUNT
+		return i + int(stops[2*pairs - 1]) + 1
+
+	"""
+	Feed bytes to the FSM. fast=False steps it byte by byte. Returns the number of bytes consumed:
+	all of them, unless fifo_limit is given and fifo_count reaches it first (e.g. when a whole grid is in).
+	"""
+	def feed(self, data, fast=True, fifo_limit=None):
+		data = np.frombuffer(bytes(data), dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+		i = 0
+		while i < data.size:
+			if fifo_limit is not None and self.fifo_count >= fifo_limit:
+				break
+			if (fast and self.state == VALUE_REPEATED and self.bytes_counter == 0
+					and self.total_bytes_received < self.tag_length - 1):
+				j = self.fast_values(data, i)
+				if j > i:
+					i = j
+					continue
+			if fast and self.state == RUN_COUNT and self.bytes_counter == 0:
+				j = self.fast_pairs(data, i)
+				if j > i:
+					i = j
+					continue
+			self.step(int(data[i]))
+			i += 1
+		return i
+
+# Decode a whole stream, from reset. Returns the model with its outputs.
+def deserialize(data, cell_size=4, neighborhood_size=29, fast=True):
+	model = DeserializerModel(cell_size, neighborhood_size)
+	model.feed(data, fast)
+	return model
+
+# ============================== TESTING ============================== #
+
+"""
+Serialize a run, deserialize it with the model and compare with what the hardware should receive.
+Returns a list of the outputs that differ (empty if the run went through).
+"""
+def round_trip(time_step, final_neighborhood, bram_values, others_value, addr_sel, grid, cell_size=4,
+			   neighborhood_size=29, count_values=True, trim_weights=False, compress_grid=False, fast=True):
+	grid = np.asarray(grid)
+	payload = Serializer(grid.size, count_values, trim_weights, compress_grid).serialize(time_step, final_neighborhood,
+																						 bram_values, others_value, addr_sel, grid)
+	model = deserialize(payload, cell_size, neighborhood_size, fast)
+	cell_mask = (1 << cell_size) - 1
+	weights = np.asarray(final_neighborhood, dtype=np.int64) & model.weight_mask
+	rows = weights.size//neighborhood_size
+	expected = {"fifo": (model.fifo(), np.asarray(grid, dtype=np.int64).ravel() & 0xff),
+				"weights": (model.weight_rows(), weights[:rows*neighborhood_size].reshape(rows, neighborhood_size)),
+				"bram": (model.bram_writes()[1], np.asarray(bram_values, dtype=np.int64) & cell_mask),
+				"total_gens": (model.total_gens, time_step),
+				"otherwise": (model.otherwise, others_value & cell_mask),
+				"addr_sel": (model.addr_sel, addr_sel)}
+	return [name for name, (got, want) in expected.items() if not np.array_equal(got, want)]
+
+# round_trip() that raises if any output differs. Returns what label describes, to print.
+def check_round_trip(label, *run, **options):
+	failed = round_trip(*run, **options)
+	if failed:
+		raise ValueError("Round trip, %s: %s differ from what was serialized." % (label, ", ".join(failed)))
+	return label
+
+"""
+Random runs (cell size, trimmed weights, compressed grids, sizes), decoded vectorized or byte by byte. The outputs
+must be what was serialized. The last weight, LUT value and grid cell are often 128 or more (2-byte varints), which
+8-bit cells keep. Returns the number of runs.
+"""
+def fuzz_round_trips(runs=200, seed=0):
+	rng = np.random.default_rng(seed)
+	for r in range(runs):
+		cell_size = int(rng.choice([4, 8]))
+		trim_weights = bool(rng.integers(0, 2))
+		weights = pad_neighborhood(rng.integers(0, 256, size=(2*int(rng.integers(0, 15)) + 1,)*2)).ravel() if trim_weights else \
+				  rng.integers(0, 256, size=int(rng.integers(1, 100)))
+		bram_values = rng.integers(0, 1 << cell_size, size=int(rng.integers(1, 300)))
+		grid = rng.integers(0, 1 << cell_size, size=int(rng.integers(1, 3000)))
+		grid[rng.random(grid.size) < rng.random()] = 0
+		for values in (weights, bram_values, grid):
+			if rng.integers(0, 2) and (cell_size == 8 or values is weights): # Weights are masked by the FSM, not the serializer.
+				values[-1] = rng.integers(128, 256)
+		check_round_trip("fuzzed run %d" % r, int(rng.integers(0, 1 << 14)), weights, bram_values, int(rng.integers(0, 1 << cell_size)),
+						 int(rng.integers(0, 2)), grid, cell_size=cell_size, trim_weights=trim_weights,
+						 compress_grid=bool(rng.integers(0, 2)), fast=bool(rng.integers(0, 4)))
+	return runs
+
+"""
+Random streams (serialized runs with random byte flips, truncations and garbage), fed in random chunks.
+The vectorized decode must give exactly the outputs of the byte by byte FSM. Returns the number of streams.
+"""
+def fuzz(streams=200, seed=0):
+	rng = np.random.default_rng(seed)
+	for s in range(streams):
+		cell_size = int(rng.choice([4, 8]))
+		grid = rng.integers(0, 1 << cell_size, size=int(rng.integers(0, 3000)))
+		grid[rng.random(grid.size) < rng.random()] = 0 # From dense to mostly zeros, for the compressed grids.
+		trim_weights = bool(rng.integers(0, 2))
+		weights = pad_neighborhood(rng.integers(0, 256, size=(2*int(rng.integers(0, 15)) + 1,)*2)).ravel() if trim_weights else \
+				  rng.integers(0, 256, size=int(rng.integers(0, 100)))
+		payload = bytearray(Serializer(grid.size, bool(rng.integers(0, 2)), trim_weights, bool(rng.integers(0, 2)),
+									   int(rng.integers(1, 300))).serialize(
+			int(rng.integers(0, 1 << 14)), weights,
+			rng.integers(0, 1 << cell_size, size=int(rng.integers(0, 300))), int(rng.integers(0, 16)), int(rng.integers(0, 3)), grid))
+		for _ in range(int(rng.integers(0, 6))):
+			payload[int(rng.integers(0, len(payload)))] = int(rng.integers(0, 256))
+		payload = bytes(payload[:int(rng.integers(0, len(payload) + 1))]) + rng.integers(0, 256, size=int(rng.integers(0, 20)), dtype=np.uint8).tobytes()
+		reference = deserialize(payload, cell_size, fast=False)
+		model = DeserializerModel(cell_size)
+		cuts = np.sort(rng.integers(0, len(payload) + 1, size=3))
+		for start, stop in zip([0, *cuts], [*cuts, len(payload)]):
+			model.feed(payload[start:stop], fast=bool(rng.integers(0, 4)))
+		if model.outputs() != reference.outputs() or model.state != reference.state:
+			raise ValueError("Stream %d: the vectorized decode does not match the FSM." % s)
+	return streams
+
+# Decode throughput in MB/s of a full 1920x1080 run, vectorized and byte by byte (on a slice of it).
+def benchmark(cell_size=4):
+	rng = np.random.default_rng(0)
+	grid = rng.integers(0, 1 << cell_size, size=(1080, 1920))
+	payload = bytes(Serializer(count_values=True).serialize(1000, rng.integers(0, 256, size=841),
+															rng.integers(0, 1 << cell_size, size=16384), 3, 1, grid))
+	start = time.perf_counter()
+	deserialize(payload, cell_size)
+	fast = len(payload)/(time.perf_counter() - start)/1e6
+	part = payload[:200000]
+	start = time.perf_counter()
+	deserialize(part, cell_size, fast=False)
+	slow = len(part)/(time.perf_counter() - start)/1e6
+	return len(payload), fast, slow
+
+if __name__ == "__main__":
+	rng = np.random.default_rng(1)
+	for cell_size in (4, 8):
+		size, fast, slow = benchmark(cell_size)
+		print("Cell size %d: %d bytes, vectorized %.1f MB/s, byte by byte %.2f MB/s" % (cell_size, size, fast, slow))
+		run = (1000, rng.integers(0, 256, size=841), rng.integers(0, 1 << cell_size, size=16384), 3, 1,
+			   rng.integers(0, 1 << cell_size, size=(1080, 1920)))
+		print("  round trip, %s: OK" % check_round_trip("LENGTH in values", *run, cell_size=cell_size))
+		# A LENGTH in bytes (protobuf) is only the number of values when every value is below 128.
+		seven_bits = [np.asarray(values) & 0x7f for values in run[1:3]]
+		print("  round trip, %s: OK" % check_round_trip("LENGTH in bytes, values below 128", run[0], *seven_bits, *run[3:5],
+														 np.asarray(run[5]) & 0x7f, cell_size=cell_size, count_values=False))
+		for diameter in (1, 3, 9, 29):
+			weights = pad_neighborhood(rng.integers(0, 256, size=(diameter, diameter))).ravel()
+			label = check_round_trip("trimmed %dx%d weights" % (diameter, diameter), run[0], weights, *run[2:], cell_size=cell_size, trim_weights=True)
+			print("  round trip, %s: OK" % label)
+		for name, grid in sample_grids(cell_size).items():
+			start = time.perf_counter()
+			label = check_round_trip("compressed %s" % name, *run[:5], grid, cell_size=cell_size, compress_grid=True)
+			print("  round trip, %s: OK (%.2fs)" % (label, time.perf_counter() - start))
+	print("Fuzzed %d streams: vectorized decode matches the FSM." % fuzz())
+	print("Fuzzed %d runs: the outputs are what was serialized." % fuzz_round_trips())
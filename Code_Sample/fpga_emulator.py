@@ -0,0 +1,388 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Stand-in for the board, for end to end runs without an FPGA.
+	     It opens a pseudo-terminal (or a Unix socket) like the UART of the board. Incoming bytes go through the
+	     model of the DESERIALIZER. When a whole grid has been received, the CA is run by the CPU engine with the
+	     registers of the model (weights, BRAM LUT, otherwise, addr_sel, total_gens) and a snapshot is streamed back
+	     every total_gens generations, in the readback format, until new bytes arrive or the host disconnects.
+	     Both directions can be throttled to a real UART baud rate (8N1, 10 bits per byte), and the time of every
+	     run is split into upload, compute and readback.
+	     Grid type and cell size are properties of the bitstream, so they are given to the board when it is created.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+# My Files
+from deserializer_model import DeserializerModel
+from ca_engine import CAEngine, GRID_WIDTH, GRID_HEIGHT, NEIGH_SIZE
+from readback import pack_cells, SnapshotStore
+from serializer import Serializer, device_serializer
+from boundary import check_hardware
+# OS
+import os
+import pty
+import tty
+import termios
+import select
+import socket
+import errno
+from threading import Thread, Event
+import time
+
+# Global Scope
+READ_CHUNK = 65536 	 # Bytes per read of the UART.
+WRITE_CHUNK = 4096	 # Bytes per write of the readback. Incoming bytes are checked between chunks.
+BITS_PER_BYTE = 10	 # Start bit, 8 data bits, stop bit.
+GRID_CELLS = GRID_WIDTH*GRID_HEIGHT
+
+# ============================== THROTTLE ============================== #
+class UartThrottle:
+	"""
+	Paces a direction of the line to baud/10 bytes per second. wait(n) sleeps until n more bytes would have been
+	transmitted. reserve(n) only books the line for them, for bytes that are transmitted while the board is busy.
+	baud=None does not throttle.
+	"""
+	def __init__(self, baud=None):
+		self.bytes_per_sec = baud/BITS_PER_BYTE if baud else None
+		self.free_at = time.perf_counter() # When the line is free again.
+
+	def reserve(self, nbytes):
+		if self.bytes_per_sec is not None:
+			self.free_at = max(self.free_at, time.perf_counter()) + nbytes/self.bytes_per_sec
+
+	def wait(self, nbytes=0):
+		self.reserve(nbytes)
+		if self.bytes_per_sec is not None and self.free_at > time.perf_counter():
+			time.sleep(self.free_at - time.perf_counter())
+
+# ============================== BOARD ============================== #
+class EmulatedBoard:
+	"""
+	Open it with open_pty() or open_socket(path), then start() serves the host in a background thread.
+	Registers (weights, LUT, otherwise, addr_sel, total_gens) are kept between runs, as in hardware.
+	timings holds a dict per run: upload, compute and readback seconds and the number of snapshots sent.
+	"""
+	def __init__(self, grid_type="TOROIDAL", cell_size=4, baud=None, max_snapshots=None, verbose=True):
+		check_hardware(grid_type) # As the board, toroidal or null grids only.
+		self.grid_type = grid_type
+		self.cell_size = cell_size
+		self.baud = baud
+		# Snapshots per run. None streams until the host sends or disconnects. Otherwise, bytes that arrive during
+		# the readback (the upload of the next run, since the UART is full duplex) are kept for after the run.
+		self.max_snapshots = max_snapshots
+		self.verbose = verbose
+		self.model = DeserializerModel(cell_size, NEIGH_SIZE)
+		self.lut = np.zeros(16384, dtype=np.int64) # BRAM contents.
+		self.fifo_count = 0						   # Grid cells in the FIFO.
+		self.pending = []						   # Bytes received during a run.
+		self.upload_start = None
+		self.timings = []
+		self.path = None
+		self.fd = None 			# pty master or connected socket.
+		self.server = None 		# Listening socket, for open_socket().
+		self.connection = None
+		self.stopped = Event()
+		self.thread = None
+
+	# ============= CONNECTION ============= #
+
+	# Open a pseudo-terminal in raw mode. The host opens self.path (e.g. /dev/pts/3) as it opens the UART.
+	def open_pty(self):
+		self.fd, slave = pty.openpty()
+		tty.setraw(slave)
+		self.path = os.ttyname(slave)
+		os.close(slave)
+		return self.path
+
+	# Listen on a Unix socket. One host connection at a time.
+	def open_socket(self, path):
+		if os.path.exists(path):
+			os.unlink(path)
+		self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.server.bind(path)
+		self.server.listen(1)
+		self.path = path
+		return path
+
+	def start(self):
+		self.thread = Thread(target=self.serve, daemon=True)
+		self.thread.start()
+		return self
+
+	def close(self):
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join()
+		for closing in (self.connection, self.server):
+			if closing is not None:
+				closing.close()
+		if self.server is None and self.fd is not None:
+			os.close(self.fd)
+		if self.server is not None and os.path.exists(self.path):
+			os.unlink(self.path)
+		self.fd = self.server = self.connection = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	# Wait for a host on the socket. Returns False if the board is stopped first.
+	def accept(self):
+		while not self.stopped.is_set():
+			if select.select([self.server], [], [], 0.1)[0]:
+				self.connection, _ = self.server.accept()
+				self.fd = self.connection.fileno()
+				return True
+		return False
+
+	# The host went away (socket closed, or no process holds the pty slave).
+	def disconnected(self):
+		if self.connection is not None:
+			self.connection.close()
+			self.connection = None
+			self.fd = None
+		else:
+			time.sleep(0.05) # The pty stays, wait for the host to open it again.
+
+	# Bytes from the host. b"" if there are none yet, None if the host is gone.
+	def receive(self, timeout):
+		if not select.select([self.fd], [], [], timeout)[0]:
+			return b""
+		try:
+			data = os.read(self.fd, READ_CHUNK)
+		except OSError as error:
+			if error.errno == errno.EIO: # No slave open.
+				return None
+			raise
+		return data if data else None
+
+	# ============= SERVING ============= #
+
+	# Main loop of the board.
+	def serve(self):
+		self.rx = UartThrottle(self.baud)
+		while not self.stopped.is_set():
+			if self.pending: # Already booked on the line.
+				data = self.pending.pop(0)
+				self.rx.wait()
+			else:
+				if self.fd is None and not self.accept():
+					break
+				data = self.receive(0.1)
+				if data is None:
+					self.disconnected()
+					continue
+				if not data:
+					continue
+				self.rx.wait(len(data))
+			if self.upload_start is None:
+				self.upload_start = time.perf_counter()
+			rest = self.load(data)
+			if self.fifo_count >= GRID_CELLS:
+				if rest:
+					self.pending.insert(0, rest) # Next run's bytes. Not part of this configuration.
+				self.run()
+
+	"""
+	Feed received bytes to the DESERIALIZER and keep the BRAM and the FIFO count up to date.
+	Stops as soon as a whole grid is in the FIFO and returns the bytes after it.
+	"""
+	def load(self, data):
+		used = self.model.feed(data, fifo_limit=self.model.fifo_count + GRID_CELLS - self.fifo_count)
+		addresses, values = self.model.bram_writes()
+		if addresses.size:
+			self.lut[addresses] = values
+			self.model.bram_addr_chunks, self.model.bram_data_chunks = [], []
+		self.fifo_count = sum(chunk.size for chunk in self.model.fifo_chunks)
+		return data[used:]
+
+	# Take the grid out of the FIFO. Cells beyond it stay for the next run.
+	def pop_grid(self):
+		fifo = self.model.fifo()
+		self.model.fifo_chunks = [fifo[GRID_CELLS:]] if fifo.size > GRID_CELLS else []
+		self.fifo_count = fifo.size - GRID_CELLS
+		return fifo[:GRID_CELLS].reshape(GRID_HEIGHT, GRID_WIDTH)
+
+	"""
+	A run. Configuration from the registers, initial state from the FIFO. One snapshot per total_gens generations
+	is computed and written back, until max_snapshots, new bytes from the host, or a disconnection.
+	"""
+	def run(self):
+		upload = time.perf_counter() - self.upload_start
+		self.upload_start = None
+		grid = self.pop_grid()
+		rows = self.model.weight_rows()
+		weights = rows[-NEIGH_SIZE:].ravel() if rows.shape[0] >= NEIGH_SIZE else np.zeros(NEIGH_SIZE*NEIGH_SIZE, dtype=np.int64)
+		engine = CAEngine(self.grid_type, self.cell_size, weights.tolist(), self.lut,
+						  self.model.otherwise or 0, self.model.addr_sel or 0)
+		time_step = self.model.total_gens or 0
+		state = engine.prepare(grid)
+		tx = UartThrottle(self.baud)
+		timing = {"upload": upload, "compute": 0.0, "readback": 0.0, "snapshots": 0}
+		self.timings.append(timing)
+		while self.max_snapshots is None or timing["snapshots"] < self.max_snapshots:
+			start = time.perf_counter()
+			state = engine.advance(state, time_step)
+			snapshot = pack_cells(engine.extract(state), self.cell_size)
+			timing["compute"] += time.perf_counter() - start
+			start = time.perf_counter()
+			sent = self.send(snapshot, tx)
+			timing["readback"] += time.perf_counter() - start
+			if not sent:
+				break
+			timing["snapshots"] += 1
+		if self.verbose:
+			print("Board: upload %.3fs, compute %.3fs, readback %.3fs, %d snapshot(s) of %d generations." %
+				  (timing["upload"], timing["compute"], timing["readback"], timing["snapshots"], time_step))
+
+	"""
+	Write a snapshot, chunk by chunk. Returns False if the host went away meanwhile, or if it sent something
+	while the board streams snapshots without a limit.
+	"""
+	def send(self, data, tx):
+		view = memoryview(data)
+		while view.nbytes and not self.stopped.is_set():
+			readable, writable, _ = select.select([self.fd], [self.fd], [], 0.1)
+			if readable:
+				if self.max_snapshots is None:
+					return False # New bytes (or a hangup). The run is over.
+				received = self.receive(0)
+				if received is None:
+					return False
+				if self.upload_start is None:
+					self.upload_start = time.perf_counter()
+				self.rx.reserve(len(received))
+				self.pending.append(received)
+			if not writable:
+				continue
+			try:
+				written = os.write(self.fd, view[:WRITE_CHUNK])
+			except OSError:
+				return False
+			tx.wait(written)
+			view = view[written:]
+		return view.nbytes == 0
+
+# ============================== HOST ============================== #
+
+# Open the board's device as the host opens the UART: raw mode, nothing left over from a previous run.
+def open_device(path):
+	if path.startswith("/dev/"):
+		fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+		tty.setraw(fd)
+		termios.tcflush(fd, termios.TCIOFLUSH)
+		return fd, None
+	connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	connection.connect(path)
+	return connection.fileno(), connection
+
+# Fill a writable buffer from a file descriptor. Bytes are received in place (os.readv), not copied from chunks.
+def read_into(fd, buffer):
+	view = memoryview(buffer).cast("B")
+	received = 0
+	while received < view.nbytes:
+		count = os.readv(fd, [view[received:]])
+		if not count:
+			raise ConnectionError("Board closed the connection after %d of %d bytes." % (received, view.nbytes))
+		received += count
+	return buffer
+
+# Read exactly nbytes from a file descriptor.
+def read_exactly(fd, nbytes):
+	return read_into(fd, bytearray(nbytes))
+
+"""
+A run on a board at path (the pty or the Unix socket of an EmulatedBoard, or any device that speaks the same protocol).
+Same inputs as run_simulation(). Yields every extracted grid as soon as it is received and prints how long the
+upload and each snapshot took on the host side.
+Snapshots are decoded into store (a SnapshotStore of the run) and yielded as views of it if it is given. Otherwise each
+one is yielded as a new array, and only one is held at a time.
+delta=True only uploads the sections the board does not hold yet (see serializer.DeltaSerializer).
+compress_grid=False always sends the grid plain (0x32). verbose=False prints nothing.
+"""
+def stream_on_device(path, init_state, grid_type, cell_size, final_neighborhood, time_step,
+					 bram_values, others_value, addr_sel, total_extracts, delta=False, store=None, compress_grid=True, verbose=True):
+	check_hardware(grid_type)
+	serializer = device_serializer(path) if delta else Serializer(count_values=True, trim_weights=True, compress_grid=compress_grid)
+	# The device is opened first: once serialize() has run, a delta serializer believes the board holds the payload.
+	fd, connection = open_device(path)
+	try:
+		payload = serializer.serialize(time_step, final_neighborhood, bram_values, others_value, addr_sel,
+									   np.asarray(init_state, dtype=np.uint8))
+		if verbose and delta and serializer.skipped:
+			print("Host: board holds the %s already." % ", ".join(serializer.skipped))
+		start = time.perf_counter()
+		view = memoryview(payload)
+		while view.nbytes:
+			view = view[os.write(fd, view):]
+		uploaded = time.perf_counter()
+		if verbose:
+			print("Host: uploaded %d bytes in %.3fs." % (len(payload), uploaded - start))
+		scratch = SnapshotStore(grid_type, cell_size, 1) if store is None else None
+		for i in range(total_extracts):
+			if store is None:
+				grid = scratch.decode(0, read_into(fd, scratch.receive_buffer(0))).copy()
+			else:
+				grid = store.decode(i, read_into(fd, store.receive_buffer(i)))
+			if verbose:
+				print("Host: snapshot %d after %.3fs." % (i + 1, time.perf_counter() - uploaded))
+			yield grid
+	except BaseException:
+		if delta:
+			serializer.forget() # Unknown what the board got.
+		raise
+	finally:
+		if connection is not None:
+			connection.close()
+		else:
+			os.close(fd)
+
+"""
+Same inputs and output as run_simulation(), on the board at path (see stream_on_device()).
+Snapshots are received and decoded into one SnapshotStore, mapped to a .npy file at memmap_path if given.
+With on_snapshot, every extracted grid is given to on_snapshot(index, grid) as soon as it is received and is not kept:
+nothing is returned and only one grid is held at a time. compress_grid and verbose as in stream_on_device().
+"""
+def run_on_device(path, init_state, grid_type, cell_size, final_neighborhood, time_step,
+				  bram_values, others_value, addr_sel, total_extracts, memmap_path=None, delta=False, on_snapshot=None,
+				  compress_grid=True, verbose=True):
+	run = (path, init_state, grid_type, cell_size, final_neighborhood, time_step, bram_values, others_value, addr_sel, total_extracts, delta)
+	options = {"compress_grid": compress_grid, "verbose": verbose}
+	if on_snapshot is not None:
+		for i, grid in enumerate(stream_on_device(*run, **options)):
+			on_snapshot(i, grid)
+		return
+	store = SnapshotStore(grid_type, cell_size, total_extracts, memmap_path)
+	for _ in stream_on_device(*run, store=store, **options):
+		pass
+	store.flush()
+	return store.grids()
+
+# Same inputs and output as run_simulation(), on an emulated board over a pty. curr_prj is not used.
+# on_snapshot as in run_on_device().
+def run_simulation_emulated(curr_prj, init_state, grid_type, cell_size, final_neighborhood, time_step,
+							bram_values, others_value, addr_sel, total_extracts, vertical_offset, baud=None, on_snapshot=None):
+	with EmulatedBoard(grid_type, cell_size, baud, max_snapshots=total_extracts) as board:
+		board.open_pty()
+		board.start()
+		return run_on_device(board.path, init_state, grid_type, cell_size, final_neighborhood, time_step,
+							 bram_values, others_value, addr_sel, total_extracts, on_snapshot=on_snapshot)
+
+if __name__ == "__main__":
+	import sys
+	# python fpga_emulator.py [TOROIDAL|NULL] [cell_size] [baud] [socket path]
+	grid_type = sys.argv[1] if len(sys.argv) > 1 else "TOROIDAL"
+	cell_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+	baud = int(sys.argv[3]) if len(sys.argv) > 3 and int(sys.argv[3]) > 0 else None
+	board = EmulatedBoard(grid_type, cell_size, baud)
+	path = board.open_socket(sys.argv[4]) if len(sys.argv) > 4 else board.open_pty()
+	print("Emulated board (%s, %d-bit cells, %s) on %s" % (grid_type, cell_size, "%d baud" % baud if baud else "unthrottled", path))
+	board.start()
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		board.close()
@@ -0,0 +1,175 @@
+"""
+Engineer: Mylonakis Manolis
+Description: 29x29 grid editor of the weights, drawn on a single Canvas.
+	     It replaces the 841 Entry widgets (and their StringVars/traces). Cells are plain canvas items
+	     and only one floating Entry exists, placed over the cell that is being edited.
+"""
+
+# ============================== IMPORTS ============================== #
+# My Files
+from neighborhood import * # GRID_SIZE, TOTAL_ENTRIES, CELL_*
+# GUI
+from tkinter import *
+from tkinter import font as tkfont
+
+# Global Scope
+# Background colour of each class of cells.
+CELL_COLORS = {CELL_NORMAL: "#0090FF", # Blue
+			   CELL_CENTER: "#50FFA0", # Green
+			   CELL_ZERO: "#D0D0FF",   # Light pink
+			   CELL_INVALID: "#FF6040"} # Red
+DISABLED_COLOR = "#D9D9D9"			 # Background of disabled cells, as a disabled Entry.
+DISABLED_TEXT_COLOR = "#A3A3A3"	 	 # Text of disabled cells.
+CELL_FONT = ('Romans', 10, 'bold')
+
+# ============================== GRID EDITOR ============================== #
+class WeightsGrid(Canvas):
+	"""
+	Displays a NeighborhoodModel. Each cell is a rectangle and a text item, created once.
+	refresh() compares the model with what is already drawn and reconfigures only the cells that differ.
+	Clicking an active cell opens the floating entry on it. <Return>/<Tab>/arrows commit and move, <Escape> cancels.
+	on_edit(row, col) is called after the user changed a cell.
+	"""
+	def __init__(self, parent, model, on_edit=None):
+		self.model = model
+		self.on_edit = on_edit
+		self.font = tkfont.Font(family=CELL_FONT[0], size=CELL_FONT[1], weight=CELL_FONT[2])
+		# Cell size: 3 digits plus a small margin, like the old entries (width=3).
+		self.cell_w = self.font.measure("000") + 10
+		self.cell_h = self.font.metrics("linespace") + 8
+		super().__init__(parent, width=GRID_SIZE*self.cell_w+1, height=GRID_SIZE*self.cell_h+1, highlightthickness=0)
+
+		# What each cell currently displays. Only differences are sent to Tk.
+		self.texts = ["1"]*TOTAL_ENTRIES
+		self.states = ["normal"]*TOTAL_ENTRIES
+		self.colors = [CELL_COLORS[CELL_NORMAL]]*TOTAL_ENTRIES
+		self.rect_ids = []
+		self.text_ids = []
+		self.enabled = True # False when no project is open. Nothing can be edited.
+
+		# Draw cells.
+		for i in range(TOTAL_ENTRIES):
+			row, col = divmod(i, GRID_SIZE)
+			x1, y1 = col*self.cell_w, row*self.cell_h
+			self.rect_ids.append(self.create_rectangle(x1, y1, x1+self.cell_w, y1+self.cell_h, fill=self.colors[i], outline="#FFFFFF", width=2))
+			self.text_ids.append(self.create_text(x1+self.cell_w/2, y1+self.cell_h/2, text=self.texts[i], font=self.font))
+
+		# The floating entry. Lives in a canvas window item, hidden until a cell is clicked.
+		self.edit_var = StringVar()
+		self.edit_entry = Entry(self, width=3, borderwidth=2, font=self.font, justify=CENTER, textvariable=self.edit_var)
+		self.edit_window = self.create_window(0, 0, window=self.edit_entry, anchor="nw", width=self.cell_w, height=self.cell_h, state="hidden")
+		self.edit_cell = None # (row, col) being edited.
+		# Wrong input is painted red while typing.
+		self.edit_var.trace("w", lambda *_: self.edit_entry.config(bg=CELL_COLORS[CELL_NORMAL if self.edit_var.get().isdigit() else CELL_INVALID]))
+
+		# Bindings.
+		self.bind("<Button-1>", self.cell_clicked)
+		self.edit_entry.bind("<Return>", lambda event: self.move_edit(1, 0))
+		self.edit_entry.bind("<Tab>", lambda event: self.move_edit(0, 1))
+		self.edit_entry.bind("<Shift-Tab>", lambda event: self.move_edit(0, -1))
+		self.edit_entry.bind("<Up>", lambda event: self.move_edit(-1, 0))
+		self.edit_entry.bind("<Down>", lambda event: self.move_edit(1, 0))
+		self.edit_entry.bind("<Escape>", lambda event: self.end_edit(commit=False))
+		self.edit_entry.bind("<FocusOut>", lambda event: self.end_edit(commit=True))
+
+	# ============= DRAWING ============= #
+
+	"""
+	Draw the model. Disabled cells show 0, cells with wrong input keep their text.
+	Returns True if any cell changed.
+	"""
+	def refresh(self):
+		values = self.model.weights.ravel().tolist()
+		active = self.model.active.ravel().tolist()
+		invalid = self.model.invalid.ravel().tolist()
+		classes = self.model.cell_classes().ravel().tolist()
+		changed = False
+		self.enabled = True
+
+		for i in range(TOTAL_ENTRIES):
+			text = self.texts[i] if invalid[i] else "%d" % values[i]
+			state = "normal" if active[i] else "disabled"
+			color = CELL_COLORS[classes[i]] if active[i] else DISABLED_COLOR
+			changed |= self.draw_cell(i, text, state, color)
+		return changed
+
+	# Empty and disable every cell. When all projects have been closed.
+	def clear(self):
+		self.end_edit(commit=False)
+		self.enabled = False
+		for i in range(TOTAL_ENTRIES):
+			self.draw_cell(i, "", "disabled", DISABLED_COLOR)
+
+	# Reconfigure the items of cell i, if needed. Returns True if something changed.
+	def draw_cell(self, i, text, state, color):
+		if text == self.texts[i] and state == self.states[i] and color == self.colors[i]:
+			return False
+		if text != self.texts[i] or state != self.states[i]:
+			self.itemconfigure(self.text_ids[i], text=text, fill="#000000" if state == "normal" else DISABLED_TEXT_COLOR)
+			self.texts[i] = text
+			self.states[i] = state
+		if color != self.colors[i]:
+			self.itemconfigure(self.rect_ids[i], fill=color)
+			self.colors[i] = color
+		return True
+
+	# ============= EDITING ============= #
+
+	# Open the floating entry on the clicked cell. Canvas clicks do not move the focus, so the cell being edited
+	# (if any) is committed here: its <FocusOut> does not fire.
+	def cell_clicked(self, event):
+		self.end_edit(commit=True)
+		row = int(self.canvasy(event.y)//self.cell_h)
+		col = int(self.canvasx(event.x)//self.cell_w)
+		if 0 <= row < GRID_SIZE and 0 <= col < GRID_SIZE:
+			self.begin_edit(row, col)
+
+	def begin_edit(self, row, col):
+		self.end_edit(commit=True) # The cell being edited keeps what was typed.
+		i = row*GRID_SIZE + col
+		if not self.enabled or self.states[i] == "disabled":
+			return
+		self.edit_cell = (row, col)
+		self.edit_var.set(self.texts[i])
+		self.coords(self.edit_window, col*self.cell_w, row*self.cell_h)
+		self.itemconfigure(self.edit_window, state="normal")
+		self.edit_entry.focus_set()
+		self.edit_entry.select_range(0, END)
+
+	# Close the floating entry. If commit, store its text in the model and redraw the cell.
+	def end_edit(self, commit=True):
+		if self.edit_cell is None:
+			return
+		row, col = self.edit_cell
+		self.edit_cell = None
+		self.itemconfigure(self.edit_window, state="hidden")
+		i = row*GRID_SIZE + col
+		text = self.edit_var.get().strip()
+		if not commit or text == self.texts[i]:
+			return
+		self.model.set_entry_text(row, col, text)
+		# The cell keeps what the user typed, even if it is wrong input.
+		self.texts[i] = text
+		self.itemconfigure(self.text_ids[i], text=text)
+		color = CELL_COLORS[self.model.cell_classes()[row, col]]
+		if color != self.colors[i]:
+			self.itemconfigure(self.rect_ids[i], fill=color)
+			self.colors[i] = color
+		if self.on_edit is not None:
+			self.on_edit(row, col)
+
+	# Commit and open the entry on the next active cell towards (drow, dcol), if any.
+	def move_edit(self, drow, dcol):
+		if self.edit_cell is None:
+			return "break"
+		row, col = self.edit_cell
+		self.end_edit(commit=True)
+		row, col = row + drow, col + dcol
+		while 0 <= row < GRID_SIZE and 0 <= col < GRID_SIZE:
+			if self.states[row*GRID_SIZE + col] == "normal":
+				self.begin_edit(row, col)
+				break
+			row, col = row + drow, col + dcol
+		else:
+			self.focus_set()
+		return "break" # Do not let Tab move the focus elsewhere.
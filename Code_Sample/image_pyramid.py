@@ -0,0 +1,188 @@
+"""
+Engineer: Mylonakis Manolis
+Description: GUI-independent model of the image viewer: images of a project decoded on demand, tile by tile.
+	     An image is only its path (or an archive and a snapshot) until a part of it is displayed. Tiles are
+	     TILE_SIZE x TILE_SIZE palette indices. Level 0 is the full resolution; every level above halves it, and
+	     its tiles are built from the four tiles below (the maximum of every 2x2 cells, so that a single live cell
+	     stays visible when zoomed out). Decoded tiles of every level are kept in one LRU bounded in bytes, so memory
+	     does not grow with the number of images, only with what was displayed recently.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+from collections import OrderedDict
+# My Files
+from bmp_writer import bmp_info, read_bmp, gray_palette
+
+# Global Scope
+TILE_SIZE = 256
+CACHE_BYTES = 64 << 20 # Decoded tiles kept, over all images and levels.
+
+# ============================== SOURCES ============================== #
+class BmpSource:
+	"""
+	A BMP of the project. Its headers are read the first time they are needed, its pixels one region at a time.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.key = path
+		self._info = None
+
+	@property
+	def info(self):
+		if self._info is None:
+			self._info = bmp_info(self.path)
+		return self._info
+
+	@property
+	def shape(self):
+		return self.info.height, self.info.width
+
+	@property
+	def palette(self):
+		return self.info.palette
+
+	def region(self, row_start, row_stop, col_start, col_stop):
+		return read_bmp(self.path, row_start, row_stop, col_start, col_stop, self.info)
+
+class ArchiveSource:
+	"""
+	Snapshot i of a SnapshotArchive, shown as its BMP would be (with the null rows of non toroidal grids).
+	"""
+	def __init__(self, archive, i):
+		self.archive = archive
+		self.i = i
+		self.key = (archive.path, i)
+		self.top = archive.meta["vertical_offset"]//2
+		self.shape = (archive.rows + archive.meta["vertical_offset"], archive.meta["width"])
+		self.palette = gray_palette(archive.meta["total_states"])
+
+	def region(self, row_start, row_stop, col_start, col_stop):
+		tile = np.zeros((row_stop - row_start, col_stop - col_start), dtype=np.uint8)
+		start, stop = max(row_start - self.top, 0), min(row_stop - self.top, self.archive.rows)
+		if start < stop:
+			tile[start + self.top - row_start:stop + self.top - row_start] = self.archive.region(self.i, start, stop, col_start, col_stop)
+		return tile
+
+# ============================== PYRAMID ============================== #
+
+# Maximum of every 2x2 cells. Odd rows or columns are paired with 0s.
+def reduce_max(tile):
+	rows, cols = tile.shape
+	if rows % 2 or cols % 2:
+		tile = np.pad(tile, ((0, rows % 2), (0, cols % 2)))
+	return tile.reshape(tile.shape[0]//2, 2, tile.shape[1]//2, 2).max(axis=(1, 3))
+
+# Rows and columns of an image at a level.
+def level_shape(shape, level):
+	return tuple(-(-size >> level) if level else size for size in shape)
+
+class TileCache:
+	"""
+	LRU of decoded tiles, keyed by (source key, level, tile row, tile column), at most max_bytes of them.
+	tile() returns a tile (TILE_SIZE x TILE_SIZE, smaller at the right and bottom edges) and decodes it if needed.
+	"""
+	def __init__(self, max_bytes=CACHE_BYTES, tile_size=TILE_SIZE):
+		self.max_bytes = max_bytes
+		self.tile_size = tile_size
+		self.tiles = OrderedDict()
+		self.bytes = 0
+		self.hits = self.misses = 0
+
+	def tile(self, source, level, ty, tx):
+		key = (source.key, level, ty, tx)
+		tile = self.tiles.get(key)
+		if tile is not None:
+			self.tiles.move_to_end(key)
+			self.hits += 1
+			return tile
+		self.misses += 1
+		size = self.tile_size
+		rows, cols = level_shape(source.shape, level)
+		if level == 0:
+			tile = source.region(ty*size, min((ty + 1)*size, rows), tx*size, min((tx + 1)*size, cols))
+		else:
+			# The four tiles below, as one 2*TILE_SIZE square (smaller at the edges), halved.
+			below = level_shape(source.shape, level - 1)
+			children = [[self.tile(source, level - 1, 2*ty + dy, 2*tx + dx) for dx in (0, 1) if (2*tx + dx)*size < below[1]]
+						for dy in (0, 1) if (2*ty + dy)*size < below[0]]
+			tile = reduce_max(np.block(children))
+		self.insert(key, tile)
+		return tile
+
+	def insert(self, key, tile):
+		self.tiles[key] = tile
+		self.bytes += tile.nbytes
+		while self.bytes > self.max_bytes and len(self.tiles) > 1:
+			_, evicted = self.tiles.popitem(last=False)
+			self.bytes -= evicted.nbytes
+
+	# Drop the tiles of a source, e.g. when its file changed or was removed.
+	def forget(self, source):
+		for key in [key for key in self.tiles if key[0] == source.key]:
+			self.bytes -= self.tiles.pop(key).nbytes
+
+	def clear(self):
+		self.tiles.clear()
+		self.bytes = 0
+
+	"""
+	Palette indices of the rectangle [row_start, row_stop) x [col_start, col_stop) of an image at a level,
+	put together from its tiles. Only the tiles that overlap it are decoded.
+	"""
+	def view(self, source, level, row_start, row_stop, col_start, col_stop):
+		rows, cols = level_shape(source.shape, level)
+		row_start, row_stop = max(row_start, 0), min(row_stop, rows)
+		col_start, col_stop = max(col_start, 0), min(col_stop, cols)
+		out = np.zeros((max(row_stop - row_start, 0), max(col_stop - col_start, 0)), dtype=np.uint8)
+		size = self.tile_size
+		for ty in range(row_start//size, -(-row_stop//size)):
+			for tx in range(col_start//size, -(-col_stop//size)):
+				tile = self.tile(source, level, ty, tx)
+				r0, c0 = ty*size, tx*size
+				r1, c1 = max(r0, row_start), max(c0, col_start)
+				r2, c2 = min(r0 + tile.shape[0], row_stop), min(c0 + tile.shape[1], col_stop)
+				out[r1 - row_start:r2 - row_start, c1 - col_start:c2 - col_start] = tile[r1 - r0:r2 - r0, c1 - c0:c2 - c0]
+		return out
+
+# Levels of an image, the top one fitting in a single tile.
+def total_levels(shape, tile_size=TILE_SIZE):
+	level = 0
+	while max(level_shape(shape, level)) > tile_size:
+		level += 1
+	return level + 1
+
+# ============================== BENCHMARK ============================== #
+
+"""
+Memory of a project of total_images BMPs: every image decoded at full resolution (as the viewer did when it opened
+them), against registering them and browsing them all at the top level and one 800x600 view at full resolution.
+Returns the MB held by both and the tiles' hit rate over a second pass.
+"""
+def benchmark(total_images=200, max_bytes=CACHE_BYTES):
+	import tempfile, os
+	from bmp_writer import BmpWriter
+	rng = np.random.default_rng(0)
+	with tempfile.TemporaryDirectory() as directory:
+		paths = [os.path.join(directory, "result_%dGENS.bmp" % (i + 1)) for i in range(total_images)]
+		grid = (rng.random((1052, 1920)) < 0.05).astype(np.uint8)
+		with BmpWriter(28, 2) as writer:
+			for path in paths:
+				writer.submit(grid, path)
+		eager = total_images*1080*1920/1e6
+		cache = TileCache(max_bytes)
+		sources = [BmpSource(path) for path in paths]
+		for _ in range(2):
+			cache.hits = cache.misses = 0
+			for source in sources:
+				top = total_levels(source.shape) - 1
+				cache.view(source, top, 0, TILE_SIZE, 0, TILE_SIZE)
+				if not np.array_equal(cache.view(source, 0, 200, 800, 300, 1100), read_bmp(source.path, 200, 800, 300, 1100)):
+					raise ValueError("View of %s does not match the BMP." % source.path)
+		return eager, cache.bytes/1e6, cache.hits/(cache.hits + cache.misses)
+
+if __name__ == "__main__":
+	for total_images in (50, 200):
+		eager, lazy, hit_rate = benchmark(total_images)
+		print("%d images: eager %.0f MB, tiles %.0f MB (hit rate %.0f%% on a second pass)" % (total_images, eager, lazy, 100*hit_rate))
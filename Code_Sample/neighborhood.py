@@ -0,0 +1,377 @@
+"""
+Engineer: Mylonakis Manolis
+Description: GUI-independent model of the CA neighborhood. Holds the 29x29 weights,
+	     the active (editable) entries, the diameter and the central point as NumPy arrays.
+	     The Weights frame is only a view of this model, while batch jobs without a display
+	     can use it directly to build the 841 coefficients.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+# Memoization of the drawn patterns.
+from functools import lru_cache
+
+# Global Scope
+GRID_SIZE = 29							  # The neighborhood window will always be 29x29.
+MAX_RADIUS = (GRID_SIZE-1)//2			  # 14
+TOTAL_ENTRIES = GRID_SIZE*GRID_SIZE		  # 841
+
+# Each entry corresponds to a (x,y) coordinate on x'x|y'y axis.
+# Horizontal scan of the entries: y from 14 down to -14, x from -14 up to 14.
+Y_COORDS, X_COORDS = np.mgrid[MAX_RADIUS:-MAX_RADIUS-1:-1, -MAX_RADIUS:MAX_RADIUS+1]
+# Square-shaped distance of each entry from (0,0).
+SQUARE_DISTANCE = np.maximum(np.abs(X_COORDS), np.abs(Y_COORDS))
+
+# Classes of cells. The view maps each one to a background colour.
+CELL_NORMAL = 0  # Non-zero weight.
+CELL_CENTER = 1  # Central point.
+CELL_ZERO = 2    # Zero weight.
+CELL_INVALID = 3 # Wrong input.
+
+# ============================== NEIGHBORHOOD TYPES ============================== #
+"""
+Every neighborhood type is a function of the coordinate grids (x, y), the central point (x0, y0) and the radius r.
+It returns a boolean 29x29 mask of the entries that belong to the neighborhood, as a single NumPy expression.
+If is weighted, entries of the mask take a value according to their square-shaped distance from the central point,
+unless the type has been registered with its own weights function of (x, y, x0, y0).
+New types are added with register_pattern(), without touching draw_neighborhood().
+"""
+PATTERNS = {} 		  # Name --> Mask function.
+WEIGHTED_PATTERNS = {} # Name --> Weights function, if it is not the default one.
+
+# Add a neighborhood type. Can also be used as a decorator: @register_pattern("Name")
+def register_pattern(name, func=None, weights=None):
+	if func is None:
+		return lambda func: register_pattern(name, func, weights)
+	PATTERNS[name] = func
+	if weights is not None:
+		WEIGHTED_PATTERNS[name] = weights
+	else:
+		WEIGHTED_PATTERNS.pop(name, None)
+	# Cached masks of a replaced type are not valid anymore.
+	pattern_values.cache_clear()
+	return func
+
+# Names of the registered types, in registration order. Used by the drop down menu.
+def pattern_names():
+	return tuple(PATTERNS)
+
+# Default weights. Square-shaped distance from the central point, plus 1.
+def distance_weights(x, y, x0, y0):
+	return np.maximum(np.abs(x-x0), np.abs(y-y0)) + 1
+
+"""
+Values of the whole 29x29 window for a type, i.e. weights in the mask and 0s elsewhere.
+Results are kept in a bounded LRU cache, since toggling "Add Weights", "Shift central point" or the diameter
+revisits the same few keys. Returned arrays are read-only because they are shared between calls.
+"""
+@lru_cache(maxsize=256)
+def pattern_values(neigh_type, diameter, center, is_weighted):
+	x0, y0 = center
+	radius = (diameter-1)//2
+	# If central point has been shifted, the radius is r/2.
+	r = radius/2 if x0 != 0 else radius
+	region = PATTERNS[neigh_type](X_COORDS, Y_COORDS, x0, y0, r)
+	# Moore returns a scalar True. Broadcast it to the whole window.
+	region = np.broadcast_to(region, X_COORDS.shape)
+	if is_weighted:
+		values = WEIGHTED_PATTERNS.get(neigh_type, distance_weights)(X_COORDS, Y_COORDS, x0, y0)
+	else:
+		values = 1
+	values = np.where(region, values, 0).astype(np.int64)
+	values.setflags(write=False)
+	return values
+
+# Square-shaped region.
+@register_pattern("Moore")
+def pattern_Moore(x, y, x0, y0, r):
+	return True
+
+# Diamond-shaped region.
+@register_pattern("von Neumann")
+def pattern_vonNeumann(x, y, x0, y0, r):
+	return np.abs(x-x0) + np.abs(y-y0) <= r
+
+# Circle: x^2 + y^2 = r^2. Area in circle: x^2 + y^2 <= r^2
+# We have discrete values (not Real) so we use x^2 + y^2 <= r^2+1
+@register_pattern("Circular")
+def pattern_Circular(x, y, x0, y0, r):
+	return (x-x0)**2 + (y-y0)**2 <= r*r + 1
+
+# For Euclidean x^2 + y^2 <= r^2
+@register_pattern("L2/Euclidean")
+def pattern_L2Euclidean(x, y, x0, y0, r):
+	return (x-x0)**2 + (y-y0)**2 <= r*r
+
+# Checkerboards. The first entry of the horizontal scan (index 0) is even.
+# Since 29 is odd, the parity of the index is the parity of x+y.
+@register_pattern("Cherckerboard")
+def pattern_Cherckerboard(x, y, x0, y0, r):
+	return (x+y) % 2 == 1
+
+@register_pattern("Cherckerboard'")
+def pattern_Cherckerboard_odd(x, y, x0, y0, r):
+	return (x+y) % 2 == 0
+
+# 2 Horizontal and 2 Vertical Lines on either side of central cell.
+@register_pattern("Hash")
+def pattern_Hash(x, y, x0, y0, r):
+	return (np.abs(x-x0) == 1) | (np.abs(y-y0) == 1)
+
+@register_pattern("Cross")
+def pattern_Cross(x, y, x0, y0, r):
+	return (x == x0) | (y == y0)
+
+# Think of it like y= ax + y0, where a is the gradient and y0 is where the line cuts the Y-Axis.
+@register_pattern("Saltire")
+def pattern_Saltire(x, y, x0, y0, r):
+	return (y == x + 2*y0) | (y == -x)
+
+# Star is weighted according to the distance from (0,0), even if the central point has been shifted.
+@register_pattern("Star", weights=lambda x, y, x0, y0: SQUARE_DISTANCE + 1)
+def pattern_Star(x, y, x0, y0, r):
+	return pattern_Saltire(x, y, x0, y0, r) | pattern_Cross(x, y, x0, y0, r)
+
+# ============================== TRIMMING ============================== #
+
+# Block of diameter x diameter entries around the center of the 29x29 window.
+def center_block(weights, diameter):
+	first = MAX_RADIUS - (diameter-1)//2
+	return np.asarray(weights).reshape(GRID_SIZE, GRID_SIZE)[first:first+diameter, first:first+diameter]
+
+# Smallest (odd) diameter that holds every non-zero weight of the 841, and its block. 1 if every weight is 0.
+def trim_neighborhood(weights):
+	weights = np.asarray(weights).reshape(GRID_SIZE, GRID_SIZE)
+	nonzero = weights != 0
+	diameter = 2*int(SQUARE_DISTANCE[nonzero].max()) + 1 if nonzero.any() else 1
+	return diameter, center_block(weights, diameter)
+
+# A diameter x diameter block (odd diameter) back to the 29x29 window, wrapped-around with 0s.
+def pad_neighborhood(block):
+	block = np.asarray(block, dtype=np.int64)
+	weights = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.int64)
+	first = MAX_RADIUS - (block.shape[0]-1)//2
+	weights[first:first+block.shape[0], first:first+block.shape[1]] = block
+	return weights
+
+"""
+Diameter, block of weights and invalid entries from the lines of a .config: NEIGHBORHOOD:DIAMETER, then one line per
+row of the block, as large as its first row (diameter x diameter, or 29x29 in older files).
+Older files hold the entries as the user typed them: a weight that is not a digit (or is missing) is 0 and marked
+invalid, and the diameter is None if it is not a valid one.
+"""
+def parse_config_lines(neighborhood):
+	text = neighborhood[0].strip().partition(':')[2].strip()
+	diameter = int(text) if text.isdigit() and NeighborhoodModel.is_valid_diameter(int(text)) else None
+	rows = [line.rstrip("\r\n").split(" ") for line in neighborhood[1:]]
+	size = min(len(rows[0]) if rows else 1, GRID_SIZE) | 1 # Odd, to have a center.
+	rows = rows[:size]
+	if len(rows) == size and all(len(row) == size for row in rows) and "".join(map("".join, rows)).isdigit():
+		return diameter, np.array(rows, dtype=np.int64), np.zeros((size, size), dtype=bool)
+	block = np.zeros((size, size), dtype=np.int64)
+	invalid = np.ones((size, size), dtype=bool)
+	for r, row in enumerate(rows):
+		for c, text in enumerate(row[:size]):
+			if text.isdigit():
+				block[r, c] = int(text)
+				invalid[r, c] = False
+	return diameter, block, invalid
+
+# ============================== NEIGHBORHOOD MODEL ============================== #
+class NeighborhoodModel:
+	"""
+	Stores the state that used to live only in the 841 weight entries.
+	Arrays are indexed as [row, column] of the 29x29 window, where row 0 is y=14 and column 0 is x=-14.
+	"""
+	def __init__(self):
+		self.weights = np.ones((GRID_SIZE, GRID_SIZE), dtype=np.int64) # Value of each entry.
+		self.active = np.ones((GRID_SIZE, GRID_SIZE), dtype=bool)	   # Entries that the user may edit.
+		self.invalid = np.zeros((GRID_SIZE, GRID_SIZE), dtype=bool)    # Entries with wrong input (not a digit).
+		self.diameter = GRID_SIZE 		 # Diameter that has been set.
+		self.radius = MAX_RADIUS  		 # Radius that has been set.
+		self.x0, self.y0 = (0, 0) 		 # Central point of the entries.
+		self.neigh_type = "Moore" 		 # Type of neighborhood.
+		self.is_weighted = 0 	 		 # If is weighted is set to 1.
+		self.is_mirror_enabled = False   # Indicates whether Mirror mode is enabled or not.
+		self.is_center_shifted = 0 		 # Central point has been shifted to the center of the 2nd quadrant.
+
+	# Every entry active and equal to 1. A 29x29 Moore neighborhood.
+	def reset(self):
+		self.weights.fill(1)
+		self.active.fill(True)
+		self.invalid.fill(False)
+		self.diameter = GRID_SIZE
+		self.radius = MAX_RADIUS
+		self.x0, self.y0 = (0, 0)
+		self.is_mirror_enabled = False
+		self.is_center_shifted = 0
+
+	# ============= DIAMETER / ACTIVE ENTRIES ============= #
+
+	# Check if diameter is an odd number in range [3,29].
+	@staticmethod
+	def is_valid_diameter(diameter):
+		return 3 <= diameter <= GRID_SIZE and diameter%2 == 1
+
+	# Set a new diameter. Returns False if it is invalid.
+	def set_diameter(self, diameter):
+		if not self.is_valid_diameter(diameter):
+			return False
+		self.diameter = diameter
+		self.radius = (diameter-1)//2
+		# "Shift central point" is only allowed for even radius during mirror mode.
+		if not self.can_shift_center():
+			self.is_center_shifted = 0
+		self.update_center()
+		# Active and disable entries according to radius or mirror mode.
+		self.update_active_entries()
+		self.draw_neighborhood()
+		return True
+
+	# Enables and disables entries according to the diameter.
+	# Every entry is set to 0. Disabled entries always hold 0.
+	def update_active_entries(self):
+		self.active = SQUARE_DISTANCE <= self.radius
+		# If mirror mode is enabled, keep active only the entries in the 2nd quadrant.
+		if self.is_mirror_enabled:
+			self.active &= (X_COORDS <= 0) & (Y_COORDS >= 0)
+		self.weights.fill(0)
+		self.invalid.fill(False)
+
+	# ============= CENTRAL POINT ============= #
+
+	# Only if Mirror Mode is enabled and radius is an even number.
+	def can_shift_center(self):
+		return self.is_mirror_enabled and self.radius%2 == 0
+
+	# Shift the central point to the center of the second quadrant, or back to (0,0).
+	def shift_center(self, is_checked):
+		self.is_center_shifted = int(bool(is_checked)) if self.can_shift_center() else 0
+		self.update_center()
+		self.draw_neighborhood()
+
+	def update_center(self):
+		if self.is_center_shifted:
+			self.x0, self.y0 = (-self.radius//2, self.radius//2)
+		else:
+			self.x0, self.y0 = (0, 0)
+
+	# Row and column of the central point in the 29x29 window.
+	def center_index(self):
+		return (MAX_RADIUS - self.y0, MAX_RADIUS + self.x0)
+
+	# ============= DRAW ============= #
+
+	# Draws the neighborhood according to its type, weights, etc. Only active entries are written.
+	def draw_neighborhood(self):
+		if self.neigh_type not in PATTERNS:
+			return
+		values = pattern_values(self.neigh_type, self.diameter, (self.x0, self.y0), self.is_weighted)
+		np.copyto(self.weights, values, where=self.active)
+		self.invalid[self.active] = False
+
+	# ============= ADD OPERATION ============= #
+
+	# Add a number to every active entry, except non-zeros or zeros if requested.
+	def add_to_every_entry(self, to_add, except_non_zeros=False, except_zeros=False):
+		mask = self.active & ~self.invalid
+		if except_non_zeros:
+			mask &= self.weights == 0
+		if except_zeros:
+			mask &= self.weights != 0
+		self.weights[mask] += to_add
+
+	# ============= MIRROR MODE ============= #
+
+	# Keep active only the entries that belong in the 2nd quadrant. The rest are set to 0.
+	def enable_mirror_mode(self):
+		self.is_mirror_enabled = True
+		outside = (X_COORDS > 0) | (Y_COORDS < 0)
+		self.weights[outside] = 0
+		self.invalid[outside] = False
+		self.active &= ~outside
+
+	"""
+	Reflections(Q=quandrant):
+	2nd Q --> 1st Q : x1=-x2, y1= y2
+	2nd Q --> 3rd Q : x3= x2, y3=-y2
+	2nd Q --> 4th Q : x4=-x2, y4=-y2
+	All of them map (x,y) to (-|x|,|y|) of the 2nd quadrant, so one fancy-indexing gather does the job.
+	"""
+	def mirror_the_entries(self):
+		self.is_mirror_enabled = False
+		self.is_center_shifted = 0
+		in_radius = SQUARE_DISTANCE <= self.radius
+		rows = MAX_RADIUS - np.abs(Y_COORDS)
+		cols = MAX_RADIUS - np.abs(X_COORDS)
+		self.weights = np.where(in_radius, self.weights[rows, cols], self.weights)
+		self.invalid = np.where(in_radius, self.invalid[rows, cols], self.invalid)
+		self.active |= in_radius
+		# Update new center.
+		self.x0, self.y0 = (0, 0)
+
+	# ============= ENTRIES INPUT ============= #
+
+	# User typed in entry (row, col). Returns True if the input is a valid weight.
+	def set_entry_text(self, row, col, text):
+		if text.isdigit():
+			self.weights[row, col] = int(text)
+			self.invalid[row, col] = False
+			return True
+		self.invalid[row, col] = True
+		return False
+
+	# Check the value of every entry and classify it. The view paints each class with a colour.
+	def cell_classes(self):
+		classes = np.full((GRID_SIZE, GRID_SIZE), CELL_NORMAL, dtype=np.int8)
+		classes[self.weights == 0] = CELL_ZERO
+		classes[self.center_index()] = CELL_CENTER
+		classes[self.invalid] = CELL_INVALID
+		return classes
+
+	# Final form of the neighborhood. Always 841 integers in horizontal scan order.
+	def final_neighborhood(self):
+		return self.weights.ravel().tolist()
+
+	# ============= CONFIG FILES ============= #
+
+	"""
+	Lines of NEIGHBORHOOD:DIAMETER followed by the diameter x diameter block around the center, one line per row.
+	Disabled entries always hold 0, so nothing outside the block is lost. (The block grows if weights lie outside it.)
+	"""
+	def to_config_lines(self):
+		diameter, block = self.config_block()
+		lines = ["NEIGHBORHOOD:%d\n" % diameter]
+		lines += [" ".join(map(str, row)) + "\n" for row in block.tolist()]
+		return lines
+
+	# The diameter that has been set and the block of weights that is stored (a copy).
+	def config_block(self):
+		diameter = max(self.diameter, trim_neighborhood(self.weights)[0])
+		return self.diameter, center_block(self.weights, diameter).copy()
+
+	"""
+	Import weights from the lines of a .config file (see parse_config_lines()). Entries that were not a weight are 0
+	and marked invalid. A diameter that is not valid falls back to the default.
+	"""
+	def from_config_lines(self, neighborhood):
+		diameter, block, invalid = parse_config_lines(neighborhood)
+		self.set_weights(GRID_SIZE if diameter is None else diameter, block, invalid)
+
+	"""
+	Diameter and block of weights of a config (see config_block()). The block is wrapped-around with 0s.
+	invalid: entries of the block to mark invalid (same shape), if any.
+	"""
+	def set_weights(self, diameter, block, invalid=None):
+		if self.is_valid_diameter(diameter):
+			self.diameter = diameter
+			self.radius = (diameter-1)//2
+		self.is_mirror_enabled = False
+		self.is_center_shifted = 0
+		self.x0, self.y0 = (0, 0)
+		self.weights = pad_neighborhood(block)
+		self.active = SQUARE_DISTANCE <= self.radius
+		self.invalid.fill(False)
+		if invalid is not None:
+			self.invalid[:] = pad_neighborhood(invalid) != 0
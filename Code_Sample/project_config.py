@@ -0,0 +1,217 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Configurations of a project (number of states, grid type, transition rule, weights and the BRAM LUT
+	     of the rule), in the text .config file and in a binary twin next to it (.bconfig, same name).
+	     The binary file is a fixed header (sizes and scalars) followed by the strings, the block of weights and
+	     the LUT as raw bytes. It is built in memory and written at once, and read without parsing any text.
+	     Older projects only have the .config: it is parsed once and migrated to a .bconfig on the spot.
+	     ConfigCache keeps the configurations of the projects used recently, so switching back to a project
+	     restores them without reading a file.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+from collections import OrderedDict
+# My Files
+from neighborhood import pad_neighborhood, parse_config_lines, GRID_SIZE
+# OS
+import struct
+import os
+import time
+
+# Global Scope
+HEADER_LINE = "*** PLEASE DO NOT EDIT. This file is auto-generated by the tool. ***\n"
+RULE_END = "_END_"
+MAGIC = b"CACONF01"
+# Diameter, block size, bytes of states, grid type and rule, LUT entries, others value and addr_sel (-1: no LUT).
+HEADER = struct.Struct("<8sIIIIIIii")
+CACHED_PROJECTS = 8
+
+# ============================== CONFIGURATION ============================== #
+class ProjectConfig:
+	"""
+	One project's configurations. states and grid_type are kept as the user typed them, rule is the text of the
+	transition rule and block the diameter x diameter weights around the center (29x29 in older files).
+	lut, others_value and addr_sel are the BRAM LUT of the rule, None until the rule has been checked.
+	invalid marks the entries of the block that were not a weight in an older .config (they are 0). It is not stored.
+	"""
+	def __init__(self, states, grid_type, rule, diameter, block, lut=None, others_value=None, addr_sel=None, invalid=None):
+		self.states = states
+		self.grid_type = grid_type
+		self.rule = rule
+		self.diameter = diameter
+		self.block = np.asarray(block, dtype=np.int64)
+		self.lut = None if lut is None else np.asarray(lut, dtype=np.uint8)
+		self.others_value = others_value
+		self.addr_sel = addr_sel
+		self.invalid = invalid
+
+	# 29x29 weights.
+	def weights(self):
+		return pad_neighborhood(self.block)
+
+	# ============= TEXT ============= #
+
+	# Lines of the .config file, as the Weights frame has always written them.
+	def text_lines(self):
+		lines = [HEADER_LINE, "States:%s\n" % self.states, "Grid_Type:%s\n" % self.grid_type, "# Transition Rule\n"]
+		lines.append(self.rule + "\n" + RULE_END + "\n")
+		lines.append("NEIGHBORHOOD:%d\n" % self.diameter)
+		lines += [" ".join(map(str, row)) + "\n" for row in self.block.tolist()]
+		return lines
+
+	# Lenient, as older files hold the entries as the user typed them (see parse_config_lines()).
+	# A diameter that is not valid falls back to the default.
+	@classmethod
+	def from_text_lines(cls, lines):
+		states = lines[1].strip().partition(':')[2]
+		grid_type = lines[2].strip().partition(':')[2]
+		end = next(i for i, line in enumerate(lines) if line.strip() == RULE_END)
+		rule = "".join(lines[4:end]).strip()
+		diameter, block, invalid = parse_config_lines(lines[end + 1:])
+		return cls(states, grid_type, rule, GRID_SIZE if diameter is None else diameter, block, invalid=invalid if invalid.any() else None)
+
+	# ============= BINARY ============= #
+
+	def to_bytes(self):
+		strings = [text.encode() for text in (self.states, self.grid_type, self.rule)]
+		lut = b"" if self.lut is None else self.lut.tobytes()
+		others_value, addr_sel = (-1, -1) if self.lut is None else (self.others_value, self.addr_sel)
+		header = HEADER.pack(MAGIC, self.diameter, self.block.shape[0], *map(len, strings), len(lut), others_value, addr_sel)
+		return b"".join([header] + strings + [self.block.astype("<i8").tobytes(), lut])
+
+	@classmethod
+	def from_bytes(cls, data):
+		magic, diameter, size, *lengths, lut_size, others_value, addr_sel = HEADER.unpack_from(data)
+		if magic != MAGIC:
+			raise ValueError("Not a binary config (or a newer format).")
+		offset = HEADER.size
+		strings = []
+		for length in lengths:
+			strings.append(bytes(data[offset:offset + length]).decode())
+			offset += length
+		block = np.frombuffer(data, dtype="<i8", count=size*size, offset=offset).reshape(size, size)
+		offset += block.nbytes
+		lut = np.frombuffer(data, dtype=np.uint8, count=lut_size, offset=offset) if lut_size else None
+		if lut is None:
+			others_value = addr_sel = None
+		return cls(*strings, diameter, block, lut, others_value, addr_sel)
+
+# ============================== FILES ============================== #
+
+# The binary twin of a .config file.
+def binary_path(config_file):
+	return os.path.splitext(config_file)[0] + ".bconfig"
+
+# Write both files. Each one is built in memory and written with a single call.
+def save_config(config_file, config):
+	with open(config_file, "w") as file:
+		file.write("".join(config.text_lines()))
+	with open(binary_path(config_file), "wb") as file:
+		file.write(config.to_bytes())
+
+"""
+Configurations of a project. The .bconfig is read if it is not older than the .config; otherwise (older projects, or
+a .config changed by hand) the .config is parsed and the .bconfig is written from it, keeping the LUT it already had.
+"""
+def load_config(config_file):
+	binary = binary_path(config_file)
+	previous = None
+	if os.path.exists(binary):
+		with open(binary, "rb") as file:
+			previous = ProjectConfig.from_bytes(file.read())
+		if os.path.getmtime(binary) >= os.path.getmtime(config_file):
+			return previous
+	with open(config_file) as file:
+		config = ProjectConfig.from_text_lines(file.readlines())
+	if previous is not None and previous.rule == config.rule:
+		config.lut, config.others_value, config.addr_sel = previous.lut, previous.others_value, previous.addr_sel
+	with open(binary, "wb") as file:
+		file.write(config.to_bytes())
+	return config
+
+# ============================== CACHE ============================== #
+class ConfigCache:
+	"""
+	LRU of the configurations of the last maxsize projects, by .config path. get() reads a project only when it is
+	not cached. save() writes the files and caches what was written. Cached configurations are shared: copy the
+	arrays before changing them.
+	"""
+	def __init__(self, maxsize=CACHED_PROJECTS):
+		self.maxsize = maxsize
+		self.configs = OrderedDict()
+
+	def get(self, config_file):
+		config = self.configs.get(config_file)
+		if config is None:
+			config = load_config(config_file)
+		self.put(config_file, config)
+		return config
+
+	def put(self, config_file, config):
+		self.configs[config_file] = config
+		self.configs.move_to_end(config_file)
+		while len(self.configs) > self.maxsize:
+			self.configs.popitem(last=False)
+
+	# Write a project's configurations. The LUT of the cached ones is kept as long as the rule is the same.
+	def save(self, config_file, config):
+		previous = self.configs.get(config_file)
+		if config.lut is None and previous is not None and previous.rule == config.rule:
+			config.lut, config.others_value, config.addr_sel = previous.lut, previous.others_value, previous.addr_sel
+		save_config(config_file, config)
+		self.put(config_file, config)
+
+	# The LUT of the rule of a project, once the rule has been checked. Only the .bconfig is written again.
+	def set_lut(self, config_file, lut, others_value, addr_sel):
+		config = self.get(config_file)
+		config.lut, config.others_value, config.addr_sel = np.asarray(lut, dtype=np.uint8), others_value, addr_sel
+		with open(binary_path(config_file), "wb") as file:
+			file.write(config.to_bytes())
+
+	def forget(self, config_file):
+		self.configs.pop(config_file, None)
+
+# ============================== BENCHMARK ============================== #
+
+"""
+Seconds per project switch for a 29x29 neighborhood: parsing the .config (as before), reading the .bconfig, and the cache.
+"""
+def benchmark(switches=200):
+	import tempfile
+	from neighborhood import NeighborhoodModel
+	model = NeighborhoodModel()
+	model.weights[:] = np.arange(841).reshape(29, 29) % 7
+	diameter, block = model.config_block()
+	config = ProjectConfig("2", "TOROIDAL", "if state == 1 and 2 <= sum <= 3: 1\nelif sum == 3: 1\nelse: 0",
+						   diameter, block, np.zeros(16384, dtype=np.uint8), 0, 1)
+	timings = []
+	with tempfile.TemporaryDirectory() as directory:
+		config_file = os.path.join(directory, "project.config")
+		save_config(config_file, config)
+		def parse():
+			with open(config_file) as file:
+				lines = file.readlines()
+			model.from_config_lines(lines[next(i for i, line in enumerate(lines) if line.startswith("NEIGHBORHOOD")):])
+		def read_binary():
+			with open(binary_path(config_file), "rb") as file:
+				loaded = ProjectConfig.from_bytes(file.read())
+			model.set_weights(loaded.diameter, loaded.block)
+		cache = ConfigCache()
+		cache.get(config_file)
+		def cached():
+			loaded = cache.get(config_file)
+			model.set_weights(loaded.diameter, loaded.block)
+		for switch in (parse, read_binary, cached):
+			start = time.perf_counter()
+			for _ in range(switches):
+				switch()
+			timings.append((time.perf_counter() - start)/switches)
+			if not np.array_equal(model.weights, config.weights()):
+				raise ValueError("Weights of %s do not match." % switch.__name__)
+	return timings
+
+if __name__ == "__main__":
+	parse, read_binary, cached = benchmark()
+	print("Project switch: parse .config %.0fus, read .bconfig %.0fus, cached %.1fus" % (1e6*parse, 1e6*read_binary, 1e6*cached))
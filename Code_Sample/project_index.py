@@ -0,0 +1,169 @@
+"""
+Engineer: Mylonakis Manolis
+Description: GUI-independent model of the project tree: the files of every project and the BMP paths of the
+	     selected one, kept up to date incrementally. add_files() inserts only the new names (a set per project
+	     tells what is known already) and emits one change event with them to every listener, e.g. the Treeview
+	     of the project tree (TreeviewSync) or the image viewer (TiledViewer.project_changed). Nothing is
+	     rebuilt, so a run that adds N results costs O(N), whatever the size of the project.
+"""
+
+# ============================== IMPORTS ============================== #
+from collections import namedtuple
+import os
+import time
+
+# Global Scope
+"""
+kind: "project_added", "project_removed", "added" or "removed".
+names: the files (project file names), paths: their full paths, in the order they were added.
+"""
+ProjectEvent = namedtuple("ProjectEvent", "kind project names paths")
+
+# ============================== MODEL ============================== #
+class ProjectIndex:
+	"""
+	tree_elements maps every project (its directory) to the names of its files, as the project tree keeps them.
+	list_bmp_paths are the full paths of the BMPs of the selected project. subscribe(listener) calls listener(event)
+	after every change.
+	"""
+	def __init__(self):
+		self.tree_elements = {}	# Project: names of its files, in order.
+		self.known = {}			# Project: set of the names, for O(1) lookups.
+		self.bmp_paths = {}		# Project: full paths of its BMPs, in order.
+		self.selected_prj = None
+		self.listeners = []
+
+	@property
+	def list_bmp_paths(self):
+		return self.bmp_paths.get(self.selected_prj, [])
+
+	def subscribe(self, listener):
+		self.listeners.append(listener)
+
+	def unsubscribe(self, listener):
+		self.listeners.remove(listener)
+
+	def emit(self, kind, project, names):
+		event = ProjectEvent(kind, project, names, [project + '/' + name for name in names])
+		for listener in list(self.listeners):
+			listener(event)
+
+	# ============= PROJECTS ============= #
+
+	def add_project(self, project, names=()):
+		if project in self.tree_elements:
+			return self.add_files(project, names)
+		self.tree_elements[project] = []
+		self.known[project] = set()
+		self.bmp_paths[project] = []
+		self.emit("project_added", project, [])
+		return self.add_files(project, names)
+
+	def remove_project(self, project):
+		if project not in self.tree_elements:
+			return
+		del self.tree_elements[project], self.known[project], self.bmp_paths[project]
+		self.emit("project_removed", project, [])
+		if self.selected_prj == project:
+			self.selected_prj = None
+
+	def select(self, project):
+		self.selected_prj = project
+
+	# ============= FILES ============= #
+
+	# Insert the names that the project does not have yet. Returns them; one "added" event lists them all.
+	def add_files(self, project, names):
+		known = self.known[project]
+		new = []
+		for name in names:
+			if name not in known:
+				known.add(name)
+				new.append(name)
+		if not new:
+			return new
+		self.tree_elements[project].extend(new)
+		self.bmp_paths[project].extend(project + '/' + name for name in new if name.endswith(".bmp"))
+		self.emit("added", project, new)
+		return new
+
+	def remove_files(self, project, names):
+		known = self.known[project]
+		gone = [name for name in dict.fromkeys(names) if name in known]
+		if not gone:
+			return gone
+		known.difference_update(gone)
+		self.tree_elements[project] = [name for name in self.tree_elements[project] if name in known]
+		removed = {project + '/' + name for name in gone}
+		self.bmp_paths[project] = [path for path in self.bmp_paths[project] if path not in removed]
+		self.emit("removed", project, gone)
+		return gone
+
+	# Bring a project in line with its directory, e.g. when it is opened. Only the differences are emitted.
+	def scan(self, project):
+		names = sorted(entry.name for entry in os.scandir(project) if entry.is_file())
+		self.add_project(project)
+		present = set(names)
+		self.remove_files(project, [name for name in self.tree_elements[project] if name not in present])
+		self.add_files(project, names)
+
+# ============================== LISTENERS ============================== #
+class TreeviewSync:
+	"""
+	Keeps a ttk.Treeview in line with a ProjectIndex: one top-level node per project, one child per file.
+	Events only insert or delete the nodes they name.
+	"""
+	def __init__(self, tree, index):
+		self.tree = tree
+		self.nodes = {}	# Project: its node.
+		self.files = {}	# (project, name): its node.
+		index.subscribe(self)
+		for project, names in index.tree_elements.items():
+			self(ProjectEvent("project_added", project, [], []))
+			self(ProjectEvent("added", project, names, []))
+
+	def __call__(self, event):
+		if event.kind == "project_added":
+			self.nodes[event.project] = self.tree.insert("", "end", text=event.project.split("/")[-1], open=False)
+		elif event.kind == "project_removed":
+			self.tree.delete(self.nodes.pop(event.project))
+			self.files = {key: node for key, node in self.files.items() if key[0] != event.project}
+		elif event.kind == "added":
+			parent = self.nodes[event.project]
+			for name in event.names:
+				self.files[(event.project, name)] = self.tree.insert(parent, "end", text=name)
+		elif event.kind == "removed":
+			self.tree.delete(*[self.files.pop((event.project, name)) for name in event.names])
+
+# ============================== BENCHMARK ============================== #
+
+"""
+Seconds to take in the results of a run of new_files snapshots in a project of total_files files: rebuilding the
+names and the paths of the project from its directory (as the project tree did after every run), and add_files().
+"""
+def benchmark(total_files=5000, new_files=20):
+	import tempfile
+	with tempfile.TemporaryDirectory() as project:
+		index = ProjectIndex()
+		names = ["init_result_%dGENS.bmp" % (i + 1) for i in range(total_files + new_files)]
+		for name in names:
+			open(os.path.join(project, name), "wb").close()
+		index.add_project(project, names[:total_files])
+		index.select(project)
+		events = []
+		index.subscribe(events.append)
+		start = time.perf_counter()
+		tree_elements = sorted(os.listdir(project))
+		list_bmp_paths = [project + '/' + name for name in tree_elements if name.endswith(".bmp")]
+		rebuild = time.perf_counter() - start
+		start = time.perf_counter()
+		index.add_files(project, names[total_files:])
+		incremental = time.perf_counter() - start
+		if len(events) != 1 or len(events[0].names) != new_files or sorted(index.list_bmp_paths) != sorted(list_bmp_paths):
+			raise ValueError("Incremental index does not match the directory.")
+	return rebuild, incremental
+
+if __name__ == "__main__":
+	for total_files in (1000, 10000):
+		rebuild, incremental = benchmark(total_files)
+		print("%d files: rebuild %.2fms, incremental %.3fms" % (total_files, 1e3*rebuild, 1e3*incremental))
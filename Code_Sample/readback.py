@@ -0,0 +1,148 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Readback format of the snapshots that the board streams back over UART.
+	     One snapshot is the extracted grid (1080 rows if TOROIDAL, else 1080-28), row by row, 1920 cells per row,
+	     with 8/CELL_SIZE cells per byte. The first cell of a byte is in its most significant bits (high nibble
+	     first for 4-bit cells, as in 4-bit BMPs). No header, snapshots follow each other.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+from functools import lru_cache
+import time
+# My Files
+from boundary import vertical_offset
+
+# Global Scope
+SNAPSHOT_WIDTH = 1920
+GRID_HEIGHT = 1080
+WORD_TYPES = {1: np.uint8, 2: np.uint16, 4: np.uint32, 8: np.uint64} # Word of the cells of a byte.
+
+# ============================== FORMAT ============================== #
+
+def cells_per_byte(cell_size):
+	return max(1, 8//cell_size)
+
+def snapshot_rows(grid_type):
+	return GRID_HEIGHT - vertical_offset(grid_type) # Null rows are not extracted.
+
+# Bytes of one snapshot.
+def snapshot_bytes(grid_type, cell_size):
+	return snapshot_rows(grid_type)*SNAPSHOT_WIDTH//cells_per_byte(cell_size)
+
+# Grid (rows x 1920 cells) to the bytes of a snapshot.
+def pack_cells(grid, cell_size):
+	grid = np.asarray(grid, dtype=np.uint8)
+	per_byte = cells_per_byte(cell_size)
+	if per_byte == 1:
+		return grid.tobytes()
+	cells = grid.reshape(-1, per_byte) & np.uint8((1 << cell_size) - 1)
+	packed = np.zeros(cells.shape[0], dtype=np.uint8)
+	for k in range(per_byte):
+		packed |= cells[:, k] << np.uint8(8 - cell_size*(k + 1))
+	return packed.tobytes()
+
+"""
+Cells of every possible byte, as one word of 8/CELL_SIZE bytes laid out in memory as the cells are in the grid.
+Unpacking is then a single lookup per byte, written contiguously. E.g. 0x3A is (3, 10), the uint16 0x0A03.
+"""
+@lru_cache(maxsize=None)
+def unpack_table(cell_size):
+	per_byte = cells_per_byte(cell_size)
+	values = np.arange(256, dtype=np.uint8)
+	cells = np.stack([(values >> np.uint8(8 - cell_size*(k + 1))) & np.uint8((1 << cell_size) - 1) for k in range(per_byte)], axis=1)
+	return np.ascontiguousarray(cells).view(WORD_TYPES[per_byte]).ravel()
+
+"""
+Bytes of a snapshot (bytes, bytearray, memoryview or uint8 array) into a contiguous grid of rows x 1920 cells (out).
+The bytes are viewed with np.frombuffer, not copied, and written straight into out, with no temporaries.
+4-bit cells: out is seen as little-endian uint16, one per byte. byte*0x1001 is byte | (low nibble << 12) in 16 bits,
+so shifted right by 4 it is the high nibble in the first byte and the low nibble in the second. Two passes, in place.
+Other sizes: one lookup per byte in unpack_table().
+"""
+def unpack_into(data, cell_size, out):
+	packed = np.frombuffer(data, dtype=np.uint8)
+	per_byte = cells_per_byte(cell_size)
+	if per_byte == 1:
+		out.reshape(-1)[:] = packed
+	elif per_byte == 2:
+		words = out.reshape(-1).view("<u2")
+		np.multiply(packed, np.uint16(0x1001), out=words, dtype=np.uint16)
+		np.right_shift(words, np.uint16(4), out=words)
+	else:
+		np.take(unpack_table(cell_size), packed, out=out.reshape(-1).view(WORD_TYPES[per_byte]), mode="clip")
+	return out
+
+# Bytes of a snapshot to a new grid of rows x 1920 cells.
+def unpack_cells(data, cell_size, rows):
+	return unpack_into(data, cell_size, np.empty((rows, SNAPSHOT_WIDTH), dtype=np.uint8))
+
+# ============================== SNAPSHOT STORE ============================== #
+class SnapshotStore:
+	"""
+	Memory for all the snapshots of a run, allocated once: a (total_extracts, rows, 1920) uint8 array, or a .npy file
+	mapped in memory if path is given (np.load(path, mmap_mode="r") opens it later).
+	decode(i, data) unpacks received bytes into snapshot i. receive_buffer(i) is where to receive the bytes of
+	snapshot i: the snapshot itself for 8-bit cells (nothing to decode), else a packed buffer reused by every snapshot.
+	grids() are views of the store, one per snapshot, as the list of extracted grids of a run.
+	"""
+	def __init__(self, grid_type, cell_size, total_extracts, path=None):
+		self.cell_size = cell_size
+		self.rows = snapshot_rows(grid_type)
+		self.size = snapshot_bytes(grid_type, cell_size)
+		shape = (total_extracts, self.rows, SNAPSHOT_WIDTH)
+		if path is None:
+			self.array = np.empty(shape, dtype=np.uint8)
+		else:
+			self.array = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape)
+		self.packed = bytearray(self.size) if cells_per_byte(cell_size) > 1 else None
+
+	def receive_buffer(self, i):
+		if self.packed is None:
+			return memoryview(self.array[i].reshape(-1))
+		return memoryview(self.packed)
+
+	def decode(self, i, data):
+		# Received in place already.
+		if self.packed is None and isinstance(data, memoryview) and np.shares_memory(np.frombuffer(data, dtype=np.uint8), self.array[i]):
+			return self.array[i]
+		return unpack_into(data, self.cell_size, self.array[i])
+
+	def grids(self):
+		return list(self.array)
+
+	def flush(self):
+		if isinstance(self.array, np.memmap):
+			self.array.flush()
+
+# ============================== BENCHMARK ============================== #
+
+# Decoding MB/s of packed snapshots: a new array per snapshot with temporaries (as before), and into a SnapshotStore.
+def benchmark(grid_type="NULL", cell_size=4, total_extracts=20):
+	rng = np.random.default_rng(0)
+	grid = rng.integers(0, 1 << cell_size, size=(snapshot_rows(grid_type), SNAPSHOT_WIDTH), dtype=np.uint8)
+	data = pack_cells(grid, cell_size)
+	per_byte = cells_per_byte(cell_size)
+	def unpack_with_temporaries(data):
+		packed = np.frombuffer(data, dtype=np.uint8)
+		cells = np.empty((packed.size, per_byte), dtype=np.uint8)
+		for k in range(per_byte):
+			cells[:, k] = (packed >> np.uint8(8 - cell_size*(k + 1))) & np.uint8((1 << cell_size) - 1)
+		return cells.reshape(grid.shape)
+	start = time.perf_counter()
+	grids = [unpack_with_temporaries(data) for _ in range(total_extracts)]
+	before = len(data)*total_extracts/(time.perf_counter() - start)/1e6
+	store = SnapshotStore(grid_type, cell_size, total_extracts)
+	start = time.perf_counter()
+	for i in range(total_extracts):
+		store.decode(i, data)
+	after = len(data)*total_extracts/(time.perf_counter() - start)/1e6
+	if not all(np.array_equal(a, grid) for a in grids + store.grids()):
+		raise ValueError("Decoded snapshots do not match the grid.")
+	return before, after
+
+if __name__ == "__main__":
+	for cell_size in (4, 8):
+		before, after = benchmark(cell_size=cell_size)
+		print("Cell size %d: new arrays %.0f MB/s, preallocated store %.0f MB/s" % (cell_size, before, after))
@@ -0,0 +1,383 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Host side serializer of a run, in the TLV (protobuf) format of the DESERIALIZER.
+	     Fields are written in protobuf's order (by field number):
+	       0x08 time step (varint), 0x12 weights (packed), 0x1a BRAM LUT (packed),
+	       0x20 others (varint), 0x28 addr_sel (varint), 0x32 grid (packed).
+	     0x42 (trimmed weights, packed) replaces 0x12 with the diameter and the diameter x diameter block only.
+	     0x3a (runs) and 0x4a (sparse) replace 0x32 with a compressed grid, when it is smaller.
+	     Packed fields are encoded with NumPy, all values at once, straight into one preallocated bytearray.
+	     No loop over the cells in Python and no protobuf runtime.
+	     DeltaSerializer keeps a record of what a device holds and leaves out the sections it already has.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+import hashlib
+import time
+# My Files
+from neighborhood import trim_neighborhood, TOTAL_ENTRIES
+
+# Global Scope
+# Tags of the DESERIALIZER. (field number << 3) | wire type. 0 is varint, 2 is length delimited.
+TAG_TIME_STEP = 0x08
+TAG_WEIGHTS = 0x12
+TAG_BRAM = 0x1a
+TAG_OTHERS = 0x20
+TAG_ADDR_SEL = 0x28
+TAG_GRID = 0x32
+TAG_WEIGHTS_TRIMMED = 0x42 # Field 8. Diameter, then the diameter x diameter block. Expanded to 29x29 by the FSM.
+TAG_GRID_RUNS = 0x3a 	   # Field 7. (count, value) pairs: count cells of value.
+TAG_GRID_SPARSE = 0x4a 	   # Field 9. (zeros, value) pairs: zeros cells of 0, then one cell of value.
+# Most cells the FSM writes to the FIFO from one pair, one per clock, before the next byte can arrive:
+# a byte of UART is 10 bits, 8,680 clocks of 100MHz at 115,200 baud. Lower it for faster UARTs.
+GRID_MAX_RUN = 4096
+# A compressed grid is only sent if it is at least this much smaller than the plain one (0x32). Pairs cost more to
+# decode than plain values, e.g. runs of a random soup save 0.06% of the bytes: not worth leaving 0x32.
+GRID_MIN_SAVING = 0.05
+# The FSM reads the last value of a packed field (0x12, 0x1a, 0x32) up to its stop byte, as the other values.
+# Older bitstreams took the first byte of the last value as all of it, so a last value of 128 or more was corrupted and
+# its stop byte was parsed as a tag. For them, set it to False: such payloads are refused with a ValueError.
+LAST_VARINT = True
+GRID_CELLS = 1920*1080
+MAX_VARINT_BYTES = 5 # Up to 32-bit values.
+SECTION_NAMES = {TAG_TIME_STEP: "time step", TAG_WEIGHTS: "weights", TAG_BRAM: "LUT", TAG_OTHERS: "others", TAG_ADDR_SEL: "addr_sel"}
+DEVICE_RECORDS = {} # DeltaSerializer of every device path.
+
+# ============================== VARINTS ============================== #
+
+# Little-endian base 128 encoding of a single value. 7 bits per byte, MSB set on every byte but the last.
+def encode_varint(value):
+	out = bytearray()
+	while value >= 0x80:
+		out.append((value & 0x7f) | 0x80)
+		value >>= 7
+	out.append(value)
+	return bytes(out)
+
+"""
+Varints of all values, as one uint8 array.
+If every value is below 128, each value is its own byte and the values are returned as they are (as uint8).
+Otherwise, byte k of every value is computed at once, for each k, into a (values, bytes) matrix. The bytes that
+exist (byte 0 always, byte k if the value is at least 2^(7k)) are then kept, in order, with a single boolean mask.
+"""
+def encode_varints(values):
+	values = np.asarray(values).ravel()
+	largest = int(values.max()) if values.size else 0
+	if largest < 0x80:
+		return values.astype(np.uint8, copy=False)
+	dtype = np.uint16 if largest < 1 << 16 else np.uint32
+	values = values.astype(dtype, copy=False)
+	total_bytes = 1
+	while total_bytes < MAX_VARINT_BYTES and largest >= 1 << 7*total_bytes:
+		total_bytes += 1
+	matrix = np.empty((values.size, total_bytes), dtype=np.uint8)
+	keep = np.empty((values.size, total_bytes), dtype=bool)
+	for k in range(total_bytes):
+		follows = values >= dtype(1 << 7*(k + 1)) if 7*(k + 1) < 8*values.itemsize else np.zeros(values.size, dtype=bool)
+		# 7 bits of the value, plus the continuation bit if another byte follows.
+		matrix[:, k] = ((values >> dtype(7*k)) & 0x7f) | (follows.view(np.uint8) << 7)
+		keep[:, k] = True if k == 0 else values >= dtype(1 << 7*k)
+	return matrix[keep]
+
+# ============================== GRID PAIRS ============================== #
+
+"""
+Groups of sizes cells, each one ending with a cell of values, to pairs of at most max_run cells.
+A group becomes ceil(size/max_run) pairs, all of max_run cells but the last one. Returns the pairs, interleaved.
+Runs: (count, value), every pair of a group holds its value. Sparse: (zeros, value), the zeros before the last cell
+of the pair, only the last pair of a group holds the value, the others end with a 0 cell.
+"""
+def split_pairs(sizes, values, max_run, sparse):
+	pieces = (sizes + max_run - 1)//max_run
+	last = np.cumsum(pieces) - 1
+	counts = np.full(int(pieces.sum()), max_run, dtype=np.int64)
+	counts[last] = sizes - (pieces - 1)*max_run
+	if sparse:
+		counts -= 1
+		pair_values = np.zeros(counts.size, dtype=np.int64)
+		pair_values[last] = values
+	else:
+		pair_values = np.repeat(values, pieces)
+	return np.stack([counts, pair_values], axis=1).ravel()
+
+# Runs of equal cells, as (count, value) pairs.
+def run_pairs(cells, max_run=GRID_MAX_RUN):
+	cells = np.asarray(cells).ravel()
+	starts = np.flatnonzero(np.concatenate([[True], cells[1:] != cells[:-1]]))
+	sizes = np.diff(np.append(starts, cells.size))
+	return split_pairs(sizes, cells[starts].astype(np.int64), max_run, False)
+
+# Non-zero cells, as (zeros, value) pairs. The zeros at the end are closed by the last cell, a 0.
+def sparse_pairs(cells, max_run=GRID_MAX_RUN):
+	cells = np.asarray(cells).ravel()
+	positions = np.flatnonzero(cells)
+	if positions.size == 0 or positions[-1] != cells.size - 1:
+		positions = np.append(positions, cells.size - 1)
+	sizes = np.diff(np.concatenate([[-1], positions])) # Zeros before each cell, and the cell.
+	return split_pairs(sizes, cells[positions].astype(np.int64), max_run, True)
+
+# ============================== SERIALIZER ============================== #
+class Serializer:
+	"""
+	Serializes runs into a bytearray allocated once, as large as the worst case (every cell a 2-byte varint).
+	serialize() returns a memoryview of the written bytes, valid until the next call.
+
+	The LENGTH of a packed field is in bytes, as protobuf defines it. The FSM of the DESERIALIZER, however, counts
+	values: its counter only advances when a value ends. Both are the same as long as every value is below 128.
+	count_values=True (the default) writes the number of values instead, which is what the FSM expects for larger values.
+	count_values=False follows protobuf, for other decoders. The FSM only parses it when every value is below 128.
+	trim_weights=True sends the 841 weights as trimmed weights (0x42), e.g. 10 values instead of 841 for a 3x3 Moore.
+	compress_grid=True sends the grid as runs (0x3a) or sparse (0x4a) if either one is smaller. Their LENGTH is the
+	number of cells, whatever count_values is. grid_tag is the tag of the last grid written.
+	last_varint=False refuses a packed field whose last value takes more than one byte (see LAST_VARINT).
+	"""
+	def __init__(self, grid_cells=GRID_CELLS, count_values=True, trim_weights=False, compress_grid=False, max_run=GRID_MAX_RUN,
+				 last_varint=LAST_VARINT):
+		self.count_values = count_values
+		self.last_varint = last_varint
+		self.trim_weights = trim_weights
+		self.compress_grid = compress_grid
+		self.max_run = max_run
+		self.grid_tag = TAG_GRID
+		self.buffer = bytearray()
+		self.reserve(grid_cells)
+
+	# Grid, weights and LUT at 2 bytes per value, plus tags, lengths and the optional fields.
+	def reserve(self, grid_cells):
+		if 2*(grid_cells + 841 + 16384) + 64 > len(self.buffer):
+			self.buffer = bytearray(2*(grid_cells + 841 + 16384) + 64)
+			self.out = np.frombuffer(self.buffer, dtype=np.uint8)
+
+	# The FSM must be able to read the last value of a packed field (see LAST_VARINT).
+	def check_last(self, tag, values):
+		if not self.last_varint and values.size and int(values[-1]) >= 0x80:
+			raise ValueError("The last value of field 0x%02x is %d: the FSM only reads one byte of it." % (tag, int(values[-1])))
+
+	# Tag, length and packed values. Returns the offset after the field.
+	def write_packed(self, offset, tag, values):
+		values = np.asarray(values).ravel()
+		self.check_last(tag, values)
+		data = encode_varints(values)
+		header = bytes([tag]) + encode_varint(values.size if self.count_values else data.size)
+		self.out[offset:offset + len(header)] = np.frombuffer(header, dtype=np.uint8)
+		offset += len(header)
+		self.out[offset:offset + data.size] = data
+		return offset + data.size
+
+	# Weights, trimmed to the smallest block around the center that holds them if trim_weights is set.
+	def write_weights(self, offset, final_neighborhood):
+		values = np.asarray(final_neighborhood).ravel()
+		if not self.trim_weights or values.size != TOTAL_ENTRIES:
+			return self.write_packed(offset, TAG_WEIGHTS, values)
+		diameter, block = trim_neighborhood(values)
+		return self.write_packed(offset, TAG_WEIGHTS_TRIMMED, np.concatenate([[diameter], block.ravel()]))
+
+	# Compressed grid: tag, number of cells and the varints of the pairs. Returns the offset after the field.
+	def write_pairs(self, offset, tag, cells, data):
+		header = bytes([tag]) + encode_varint(cells)
+		self.out[offset:offset + len(header)] = np.frombuffer(header, dtype=np.uint8)
+		offset += len(header)
+		self.out[offset:offset + data.size] = data
+		return offset + data.size
+
+	"""
+	The grid in the smallest of the three encodings. Runs and sparse pairs are only built if they can be smaller than
+	the plain grid by GRID_MIN_SAVING: each pair takes at least 2 bytes.
+	"""
+	def write_grid(self, offset, grid):
+		cells = np.asarray(grid).ravel()
+		self.grid_tag = TAG_GRID
+		if not self.compress_grid or cells.size == 0:
+			return self.write_packed(offset, TAG_GRID, cells)
+		best = encode_varints(cells)
+		limit = best.size*(1 - GRID_MIN_SAVING)
+		if 2*(np.count_nonzero(cells[1:] != cells[:-1]) + 1) < limit:
+			data = encode_varints(run_pairs(cells, self.max_run))
+			if data.size < min(best.size, limit):
+				best, self.grid_tag = data, TAG_GRID_RUNS
+		if 2*np.count_nonzero(cells) < min(best.size, limit):
+			data = encode_varints(sparse_pairs(cells, self.max_run))
+			if data.size < min(best.size, limit):
+				best, self.grid_tag = data, TAG_GRID_SPARSE
+		if self.grid_tag == TAG_GRID:
+			self.check_last(TAG_GRID, cells)
+			header = bytes([TAG_GRID]) + encode_varint(cells.size if self.count_values else best.size)
+			self.out[offset:offset + len(header)] = np.frombuffer(header, dtype=np.uint8)
+			offset += len(header)
+			self.out[offset:offset + best.size] = best
+			return offset + best.size
+		return self.write_pairs(offset, self.grid_tag, cells.size, best)
+
+	# Tag and a single varint. Returns the offset after the field.
+	def write_optional(self, offset, tag, value):
+		field = bytes([tag]) + encode_varint(int(value))
+		self.out[offset:offset + len(field)] = np.frombuffer(field, dtype=np.uint8)
+		return offset + len(field)
+
+	"""
+	The whole run: time step, the 841 weights, the 16,384 entries of the LUT, the otherwise value, the address select
+	and the grid (row by row). Every field is sent, even if it is 0, since the hardware keeps the previous values.
+	"""
+	def serialize(self, time_step, final_neighborhood, bram_values, others_value, addr_sel, grid):
+		grid = np.asarray(grid)
+		self.reserve(grid.size)
+		offset = self.write_optional(0, TAG_TIME_STEP, time_step)
+		offset = self.write_weights(offset, final_neighborhood)
+		offset = self.write_packed(offset, TAG_BRAM, bram_values)
+		offset = self.write_optional(offset, TAG_OTHERS, others_value)
+		offset = self.write_optional(offset, TAG_ADDR_SEL, addr_sel)
+		offset = self.write_grid(offset, grid)
+		return memoryview(self.buffer)[:offset]
+
+class DeltaSerializer(Serializer):
+	"""
+	Serializer for one device, with a record (a content hash per section) of what the board holds since the last run.
+	The DESERIALIZER handles every tag on its own and the registers and the BRAM keep their values, so a section that
+	has not changed is left out: changing only the weights sends the weights and the grid.
+	The grid is always sent. It is not stored on the board: it goes through the FIFO into the CA and its arrival
+	starts the run.
+	The record assumes every payload reaches the board. Call forget() if an upload fails or the board is reset
+	(or reprogrammed): the next payload is then complete.
+	"""
+	def __init__(self, grid_cells=GRID_CELLS, count_values=True, trim_weights=True, compress_grid=True):
+		super().__init__(grid_cells, count_values, trim_weights, compress_grid)
+		self.held = {} 		# Tag to the hash of its values on the board.
+		self.skipped = [] 	# Names of the sections left out of the last payload.
+
+	def forget(self):
+		self.held = {}
+
+	# True if the board does not hold these values for tag yet. Records them as held.
+	def changed(self, tag, values):
+		digest = hashlib.blake2b(np.ascontiguousarray(values, dtype=np.int64).tobytes(), digest_size=16).digest()
+		if self.held.get(tag) == digest:
+			self.skipped.append(SECTION_NAMES[tag])
+			return False
+		self.held[tag] = digest
+		return True
+
+	# Same as Serializer.serialize(), without the sections the board holds already.
+	def serialize(self, time_step, final_neighborhood, bram_values, others_value, addr_sel, grid):
+		grid = np.asarray(grid)
+		self.reserve(grid.size)
+		self.skipped = []
+		offset = 0
+		if self.changed(TAG_TIME_STEP, time_step):
+			offset = self.write_optional(offset, TAG_TIME_STEP, time_step)
+		if self.changed(TAG_WEIGHTS, final_neighborhood):
+			offset = self.write_weights(offset, final_neighborhood)
+		if self.changed(TAG_BRAM, bram_values):
+			offset = self.write_packed(offset, TAG_BRAM, bram_values)
+		if self.changed(TAG_OTHERS, others_value):
+			offset = self.write_optional(offset, TAG_OTHERS, others_value)
+		if self.changed(TAG_ADDR_SEL, addr_sel):
+			offset = self.write_optional(offset, TAG_ADDR_SEL, addr_sel)
+		offset = self.write_grid(offset, grid)
+		return memoryview(self.buffer)[:offset]
+
+# Record of the device at path (a tty or a socket), created on first use.
+def device_serializer(path):
+	if path not in DEVICE_RECORDS:
+		DEVICE_RECORDS[path] = DeltaSerializer()
+	return DEVICE_RECORDS[path]
+
+# One-off serialization. Returns bytes.
+def serialize_run(time_step, final_neighborhood, bram_values, others_value, addr_sel, grid, count_values=True):
+	grid = np.asarray(grid)
+	return bytes(Serializer(grid.size, count_values).serialize(time_step, final_neighborhood, bram_values, others_value, addr_sel, grid))
+
+# ============================== BENCHMARK ============================== #
+
+# Per value, in Python. Only used to check the vectorized serializer.
+def serialize_run_reference(time_step, final_neighborhood, bram_values, others_value, addr_sel, grid, count_values=True):
+	def packed(tag, values):
+		values = [int(v) for v in np.asarray(values).ravel()]
+		data = b"".join(encode_varint(v) for v in values)
+		return bytes([tag]) + encode_varint(len(values) if count_values else len(data)) + data
+	return (bytes([TAG_TIME_STEP]) + encode_varint(time_step) + packed(TAG_WEIGHTS, final_neighborhood)
+			+ packed(TAG_BRAM, bram_values) + bytes([TAG_OTHERS]) + encode_varint(others_value)
+			+ bytes([TAG_ADDR_SEL]) + encode_varint(addr_sel) + packed(TAG_GRID, grid))
+
+"""
+Throughput in MB/s (of serialized bytes) of a full 1920x1080 run, for 4-bit cells (1-byte varints)
+and 8-bit cells (1 or 2-byte varints). The output is checked against the per-value reference on a smaller grid.
+"""
+def benchmark(repeats=5):
+	rng = np.random.default_rng(0)
+	serializer = Serializer()
+	results = []
+	for cell_size in (4, 8):
+		weights = rng.integers(0, 1 << (32//cell_size), size=841)
+		bram = rng.integers(0, 1 << cell_size, size=16384)
+		grid = rng.integers(0, 1 << cell_size, size=(1080, 1920), dtype=np.uint8)
+		small = grid[:64, :64]
+		for count_values in (False, True):
+			check = serialize_run(1000, weights, bram, 3, 1, small, count_values)
+			if check != serialize_run_reference(1000, weights, bram, 3, 1, small, count_values):
+				raise ValueError("Serializer does not match the reference (cell size %d)." % cell_size)
+		start = time.perf_counter()
+		for _ in range(repeats):
+			payload = serializer.serialize(1000, weights, bram, 3, 1, grid)
+		elapsed = (time.perf_counter() - start)/repeats
+		results.append((cell_size, len(payload), len(payload)/elapsed/1e6))
+	return results
+
+"""
+Bytes uploaded per run in a weight-tuning session: the same grid, LUT and registers, new weights every run.
+Returns the bytes of a complete payload and of a delta payload, for 4-bit cells.
+"""
+def benchmark_delta(runs=5):
+	rng = np.random.default_rng(0)
+	bram = rng.integers(0, 16, size=16384)
+	grid = rng.integers(0, 16, size=(1080, 1920), dtype=np.uint8)
+	full = Serializer(count_values=True)
+	delta = DeltaSerializer()
+	sizes = [0, 0]
+	for run in range(runs):
+		weights = rng.integers(0, 256, size=841)
+		sizes[0] += len(full.serialize(1000, weights, bram, 3, 1, grid))
+		sizes[1] += len(delta.serialize(1000, weights, bram, 3, 1, grid))
+	return sizes[0]//runs, sizes[1]//runs
+
+# Initial states like the ones loaded from BMPs: mostly 0s with a few patterns, a soup, filled shapes, noise.
+def sample_grids(cell_size=4, seed=0):
+	rng = np.random.default_rng(seed)
+	grids = {"empty": np.zeros((1080, 1920), dtype=np.uint8)}
+	gliders = np.zeros((1080, 1920), dtype=np.uint8)
+	for y, x in zip(rng.integers(0, 1077, 100), rng.integers(0, 1917, 100)):
+		gliders[y:y + 3, x:x + 3] = [[0, 1, 0], [0, 0, 1], [1, 1, 1]]
+	grids["100 gliders"] = gliders
+	soup = np.zeros((1080, 1920), dtype=np.uint8)
+	soup[412:668, 832:1088] = rng.integers(0, 2, size=(256, 256))
+	grids["256x256 soup"] = soup
+	y, x = np.mgrid[:1080, :1920]
+	radius = np.hypot(y - 540, x - 960)
+	grids["disk and ring"] = np.where(radius < 300, 1, np.where(radius < 320, (1 << cell_size) - 1, 0)).astype(np.uint8)
+	grids["noise"] = rng.integers(0, 1 << cell_size, size=(1080, 1920), dtype=np.uint8)
+	return grids
+
+"""
+Bytes on the wire of the grid of every sample: plain (0x32), runs (0x3a) and sparse (0x4a), and which one the
+serializer picks. Returns (name, plain, runs, sparse, picked tag, milliseconds to serialize) per sample.
+"""
+def benchmark_grid(cell_size=4):
+	serializer = Serializer(count_values=True, compress_grid=True)
+	results = []
+	for name, grid in sample_grids(cell_size).items():
+		start = time.perf_counter()
+		serializer.serialize(1000, [1]*841, [0]*16384, 0, 1, grid)
+		elapsed = time.perf_counter() - start
+		sizes = [encode_varints(grid).size, encode_varints(run_pairs(grid)).size, encode_varints(sparse_pairs(grid)).size]
+		results.append((name, *sizes, serializer.grid_tag, 1000*elapsed))
+	return results
+
+if __name__ == "__main__":
+	for cell_size, size, mb_per_sec in benchmark():
+		print("Cell size %d: %8d bytes, %7.1f MB/s" % (cell_size, size, mb_per_sec))
+	full, delta = benchmark_delta()
+	print("Weight tuning: %d bytes per run, %d with delta uploads" % (full, delta))
+	print("Grid bytes on the wire (4-bit cells):")
+	for name, plain, runs, sparse, tag, milliseconds in benchmark_grid():
+		print("  %-14s plain %8d, runs %8d, sparse %8d -> 0x%02x, %5.1f ms" % (name, plain, runs, sparse, tag, milliseconds))
@@ -0,0 +1,252 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Archive of the extracted grids of a run, in one file, instead of one BMP per snapshot.
+	     Consecutive generations are nearly identical, so the first snapshot (and every KEYFRAME_INTERVAL-th) is stored
+	     in full and the rest as the XOR with the snapshot before, which is mostly 0s. Snapshots are packed as in the
+	     readback format (8/CELL_SIZE cells per byte) and split in bands of BAND_ROWS rows, each band compressed on its
+	     own (zlib or lzma). An index of every chunk is kept at the end of the file, so a snapshot, or a few rows of it,
+	     is decoded from its keyframe without reading the rest of the file. The file is read through mmap.
+
+	     Layout: MAGIC, chunks, index (uint64 offset and length per snapshot and band), metadata (JSON),
+	     trailer (uint64 offset of the index, uint32 length of the metadata, MAGIC).
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+import struct
+import json
+# Compression
+import zlib
+import lzma
+# My Files
+from readback import pack_cells, unpack_cells, snapshot_rows, SNAPSHOT_WIDTH
+from bmp_writer import write_bmp, read_bmp
+from boundary import vertical_offset
+# OS
+import mmap
+import os
+import time
+
+# Global Scope
+MAGIC = b"CASNAP01"
+TRAILER = struct.Struct("<QI8s")
+BAND_ROWS = 64 			# Rows per chunk.
+KEYFRAME_INTERVAL = 32 	# Snapshots stored in full. The rest are deltas, decoded from the keyframe before them.
+CODECS = {
+	"zlib": (lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress),
+	"lzma": (lambda data, level: lzma.compress(data, preset=6 if level is None else level), lzma.decompress),
+}
+
+# ============================== WRITER ============================== #
+class ArchiveWriter:
+	"""
+	Writes the snapshots of a run, one append(grid) per extract, in order. time_step, vertical_offset and total_states
+	are kept with them, for the generation numbers and the BMP export. Use it as a context manager, or close() it:
+	the index is only written then. on_snapshot(i, grid) can be given to the runners directly.
+	"""
+	def __init__(self, path, grid_type, cell_size, time_step=1, total_states=None, band_rows=BAND_ROWS,
+				 keyframe_interval=KEYFRAME_INTERVAL, codec="zlib", level=None):
+		self.rows = snapshot_rows(grid_type)
+		self.meta = {"grid_type": grid_type, "cell_size": cell_size, "rows": self.rows, "width": SNAPSHOT_WIDTH,
+					 "time_step": time_step, "vertical_offset": vertical_offset(grid_type),
+					 "total_states": total_states or 1 << cell_size, "band_rows": band_rows,
+					 "keyframe_interval": keyframe_interval, "codec": codec, "snapshots": 0}
+		self.compress = CODECS[codec][0]
+		self.level = level
+		self.bands = [(start, min(start + band_rows, self.rows)) for start in range(0, self.rows, band_rows)]
+		self.index = []
+		self.previous = None
+		self.file = open(path, "wb")
+		self.file.write(MAGIC)
+		self.offset = len(MAGIC)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def append(self, grid):
+		packed = np.frombuffer(pack_cells(grid, self.meta["cell_size"]), dtype=np.uint8).reshape(self.rows, -1)
+		keyframe = self.meta["snapshots"] % self.meta["keyframe_interval"] == 0
+		chunks = []
+		for start, stop in self.bands:
+			band = packed[start:stop] if keyframe else packed[start:stop] ^ self.previous[start:stop]
+			chunk = self.compress(band, self.level)
+			self.file.write(chunk)
+			chunks.append((self.offset, len(chunk)))
+			self.offset += len(chunk)
+		self.index.append(chunks)
+		self.previous = packed
+		self.meta["snapshots"] += 1
+
+	def on_snapshot(self, i, grid):
+		if i != self.meta["snapshots"]:
+			raise ValueError("Snapshot %d out of order, expected %d." % (i, self.meta["snapshots"]))
+		self.append(grid)
+
+	def close(self):
+		if self.file.closed:
+			return
+		index = np.array(self.index, dtype=np.uint64).reshape(-1, len(self.bands), 2)
+		meta = json.dumps(self.meta).encode()
+		self.file.write(index.tobytes())
+		self.file.write(meta)
+		self.file.write(TRAILER.pack(self.offset, len(meta), MAGIC))
+		self.file.close()
+
+# ============================== READER ============================== #
+class SnapshotArchive:
+	"""
+	Random access to the snapshots of an archive. Opening it reads the trailer, the metadata and the index only.
+	snapshot(i) (or archive[i]) decodes snapshot i, region() only the rows and columns asked for. The last decoded
+	snapshot of every band is kept, so reading snapshots in order decodes one delta per band each.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, "rb")
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		index_offset, meta_length, magic = TRAILER.unpack_from(self.map, len(self.map) - TRAILER.size)
+		if magic != MAGIC or self.map[:len(MAGIC)] != MAGIC:
+			raise ValueError("%s is not a snapshot archive." % path)
+		meta_offset = len(self.map) - TRAILER.size - meta_length
+		self.meta = json.loads(self.map[meta_offset:meta_offset + meta_length])
+		self.rows = self.meta["rows"]
+		self.band_rows = self.meta["band_rows"]
+		self.bands = -(-self.rows//self.band_rows)
+		self.index = np.frombuffer(self.map, dtype=np.uint64, count=self.meta["snapshots"]*self.bands*2,
+								   offset=index_offset).reshape(-1, self.bands, 2)
+		self.decompress = CODECS[self.meta["codec"]][1]
+		self.cache = {} # Band: (snapshot, packed band).
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __len__(self):
+		return self.meta["snapshots"]
+
+	def __getitem__(self, i):
+		return self.snapshot(i)
+
+	def close(self):
+		self.index = None
+		self.cache.clear()
+		self.map.close()
+		self.file.close()
+
+	# Generations of snapshot i.
+	def generation(self, i):
+		return self.meta["time_step"]*(i + 1)
+
+	def chunk(self, i, band):
+		offset, length = (int(value) for value in self.index[i, band])
+		return np.frombuffer(self.decompress(self.map[offset:offset + length]), dtype=np.uint8)
+
+	# Packed rows of a band of snapshot i, from the keyframe before it or from the cached snapshot, if it is closer.
+	def packed_band(self, i, band):
+		if not 0 <= i < len(self):
+			raise IndexError("Snapshot %d of %d." % (i, len(self)))
+		keyframe = i - i % self.meta["keyframe_interval"]
+		cached, packed = self.cache.get(band, (-1, None))
+		if not keyframe <= cached <= i:
+			cached, packed = keyframe, self.chunk(keyframe, band)
+		packed = packed.copy() # Chunks are read-only, and the cached band is not changed.
+		for j in range(cached + 1, i + 1):
+			packed ^= self.chunk(j, band)
+		self.cache[band] = (i, packed)
+		return packed
+
+	# Rows [row_start, row_stop) and columns [col_start, col_stop) of snapshot i. Only the bands of those rows are decoded.
+	def region(self, i, row_start=0, row_stop=None, col_start=0, col_stop=None):
+		row_stop = self.rows if row_stop is None else row_stop
+		first, last = row_start//self.band_rows, (row_stop - 1)//self.band_rows
+		packed = np.concatenate([self.packed_band(i, band) for band in range(first, last + 1)])
+		rows = min(self.rows, (last + 1)*self.band_rows) - first*self.band_rows
+		cells = unpack_cells(packed, self.meta["cell_size"], rows)
+		offset = first*self.band_rows
+		return cells[row_start - offset:row_stop - offset, col_start:col_stop]
+
+	def snapshot(self, i):
+		return self.region(i)
+
+	# BMP of snapshot i, as the results of simulate(), only when it is asked for.
+	def export_bmp(self, i, path):
+		return write_bmp(self.snapshot(i), path, self.meta["vertical_offset"], self.meta["total_states"])
+
+# ============================== PROJECTS ============================== #
+
+"""
+Archive of results already written as BMPs (one per snapshot, in order of generation), e.g. to pack an old project.
+The BMPs can be removed afterwards and exported again with SnapshotArchive.export_bmp().
+"""
+def archive_bmps(bmp_paths, path, grid_type, cell_size, time_step=1, total_states=None, **options):
+	null_rows = vertical_offset(grid_type)//2
+	with ArchiveWriter(path, grid_type, cell_size, time_step, total_states, **options) as writer:
+		for bmp_path in bmp_paths:
+			image = read_bmp(bmp_path)
+			writer.append(image[null_rows:image.shape[0] - null_rows])
+	return path
+
+# ============================== BENCHMARK ============================== #
+
+"""
+Game of Life from a soup, total_extracts snapshots. Returns the MB on disk and the seconds to open the results
+(read every BMP, as the viewer does, against opening the archive and decoding its last snapshot) for the BMPs and
+for the archive of every codec, and the seconds to decode a 64x64 region of a snapshot in the middle.
+Every snapshot of the archives must match.
+"""
+def benchmark(total_extracts=64, time_step=1, grid_type="NULL", codecs=("zlib", "lzma")):
+	import tempfile
+	from ca_engine import CAEngine
+	from bmp_writer import BmpWriter
+	kernel = [0]*841
+	for i in (390, 391, 392, 419, 421, 448, 449, 450): # Game of Life.
+		kernel[i] = 1
+	lut = [0]*16384
+	lut[3] = lut[(1 << 10) | 2] = lut[(1 << 10) | 3] = 1
+	rng = np.random.default_rng(0)
+	init_state = np.zeros((1080, 1920), dtype=np.uint8)
+	init_state[284:796, 704:1216] = rng.integers(0, 2, size=(512, 512))
+	engine = CAEngine(grid_type, 4, kernel, lut, 0, 1)
+	grids = list(engine.stream(init_state, time_step, total_extracts))
+	results = {}
+	with tempfile.TemporaryDirectory() as directory:
+		bmp_paths = [os.path.join(directory, "result_%dGENS.bmp" % (time_step*(i + 1))) for i in range(total_extracts)]
+		with BmpWriter(28, 2) as writer:
+			for grid, path in zip(grids, bmp_paths):
+				writer.submit(grid, path)
+		start = time.perf_counter()
+		images = [read_bmp(path) for path in bmp_paths]
+		results["bmp"] = (sum(os.path.getsize(path) for path in bmp_paths)/1e6, time.perf_counter() - start, None)
+		del images
+		for codec in codecs:
+			path = os.path.join(directory, "result.%s.snap" % codec)
+			with ArchiveWriter(path, grid_type, 4, time_step, 2, codec=codec) as writer:
+				for grid in grids:
+					writer.append(grid)
+			start = time.perf_counter()
+			with SnapshotArchive(path) as archive:
+				archive.snapshot(len(archive) - 1)
+				opened = time.perf_counter() - start
+				middle = len(archive)//2 + KEYFRAME_INTERVAL//2 - 1
+				start = time.perf_counter()
+				region = archive.region(middle, 500, 564, 900, 964)
+				random_access = time.perf_counter() - start
+				if not np.array_equal(region, grids[middle][500:564, 900:964]):
+					raise ValueError("Region of snapshot %d does not match." % middle)
+				if not all(np.array_equal(archive[i], grid) for i, grid in enumerate(grids)):
+					raise ValueError("The %s archive does not match the run." % codec)
+			results[codec] = (os.path.getsize(path)/1e6, opened, random_access)
+	return results
+
+if __name__ == "__main__":
+	results = benchmark()
+	bmp_size, bmp_open, _ = results.pop("bmp")
+	print("BMPs: %.1f MB, %.3fs to open" % (bmp_size, bmp_open))
+	for codec, (size, opened, random_access) in results.items():
+		print("%s archive: %.2f MB (x%.0f smaller), %.3fs to open, %.1fms for a 64x64 region"
+			  % (codec, size, bmp_size/size, opened, 1e3*random_access))
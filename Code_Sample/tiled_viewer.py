@@ -0,0 +1,203 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Image viewer of the results of a project, drawn on a single Canvas, tile by tile.
+	     Opening images only registers them. The image on display is decoded on demand through a TileCache
+	     (see image_pyramid.py), one tile per visible TILE_SIZE x TILE_SIZE square, at the pyramid level of the
+	     zoom. Opening the images of a project again only registers the new ones; the tiles of the rest are kept.
+"""
+
+# ============================== IMPORTS ============================== #
+# My Files
+from image_pyramid import BmpSource, TileCache, level_shape, total_levels
+# GUI
+from tkinter import *
+# Maths
+import numpy as np
+
+# Global Scope
+BACKGROUND = "#202020"
+
+# ============================== VIEWER ============================== #
+class TiledViewer(Canvas):
+	"""
+	Displays one image of the project at a time. The mouse wheel zooms (one pyramid level per step) around the
+	pointer, dragging pans, <Left>/<Right> show the previous/next image. Only the visible tiles are decoded, and
+	only the tiles that appear are drawn again when panning.
+	"""
+	def __init__(self, parent, cache=None, **options):
+		super().__init__(parent, background=BACKGROUND, highlightthickness=0, **options)
+		self.cache = cache or TileCache()
+		self.sources = {}	# Path: BmpSource. Registered images, in order.
+		self.paths = []
+		self.current = None	# Index of the image on display.
+		self.level = 0
+		self.origin = (0, 0) # Top-left pixel of the view, at the current level (column, row).
+		self.drawn = {}		# (ty, tx): (canvas item, PhotoImage) of the tiles on display.
+		self.palettes = {}	 # Palette: (256, 3) lookup of RGB values.
+		self.drag = None
+
+		self.bind("<Configure>", lambda event: self.redraw())
+		self.bind("<MouseWheel>", lambda event: self.zoom(-1 if event.delta > 0 else 1, event.x, event.y))
+		self.bind("<Button-4>", lambda event: self.zoom(-1, event.x, event.y))
+		self.bind("<Button-5>", lambda event: self.zoom(1, event.x, event.y))
+		self.bind("<ButtonPress-1>", self.start_drag)
+		self.bind("<B1-Motion>", self.drag_to)
+		self.bind("<Left>", lambda event: self.show(self.current - 1))
+		self.bind("<Right>", lambda event: self.show(self.current + 1))
+		self.bind("<Enter>", lambda event: self.focus_set())
+
+	# ============= IMAGES ============= #
+
+	# Show the images at paths. Images that are already registered are kept as they are, only new paths are added.
+	def open_images(self, paths):
+		paths = list(paths)
+		for path in set(self.sources) - set(paths):
+			self.cache.forget(self.sources.pop(path))
+		shown = self.paths[self.current] if self.current is not None else None
+		self.paths = []
+		self.register(paths)
+		# The image on display stays, with its zoom and position.
+		if shown in self.sources:
+			self.current = self.paths.index(shown)
+			self.redraw()
+		else:
+			self.current = None
+			self.show(0)
+
+	# Register new images after the ones on display, e.g. the results of a run. Nothing is decoded.
+	def add_images(self, paths):
+		self.register(paths)
+		if self.current is None:
+			self.show(0)
+
+	def register(self, paths):
+		for path in paths:
+			if path not in self.sources:
+				self.sources[path] = BmpSource(path)
+			if path not in self.paths:
+				self.paths.append(path)
+
+	def remove_images(self, paths):
+		gone = set(paths) & set(self.sources)
+		if not gone:
+			return
+		shown = self.paths[self.current] if self.current is not None else None
+		for path in gone:
+			self.cache.forget(self.sources.pop(path))
+		self.paths = [path for path in self.paths if path not in gone]
+		if shown in self.sources:
+			self.current = self.paths.index(shown)
+		else:
+			self.current = None
+			self.clear_tiles()
+			self.show(0)
+
+	# Listener of a ProjectIndex (see project_index.py): follows the images of its selected project.
+	def project_changed(self, event, index):
+		if event.project != index.selected_prj:
+			return
+		paths = [path for path in event.paths if path.endswith(".bmp")]
+		if event.kind == "added":
+			self.add_images(paths)
+		elif event.kind == "removed":
+			self.remove_images(paths)
+		elif event.kind == "project_removed":
+			self.close_images()
+
+	def close_images(self):
+		self.sources.clear()
+		self.paths = []
+		self.cache.clear()
+		self.current = None
+		self.clear_tiles()
+
+	def show(self, i):
+		if not self.paths or not 0 <= i < len(self.paths):
+			return
+		if i != self.current:
+			first = self.current is None
+			self.current = i
+			self.clear_tiles()
+			# The first image fits in the window. The next ones keep its zoom and position.
+			if first:
+				self.level, self.origin = self.fitting_level(), (0, 0)
+		self.redraw()
+
+	def source(self):
+		return self.sources[self.paths[self.current]] if self.current is not None else None
+
+	# Lowest level at which the whole image fits in the canvas.
+	def fitting_level(self):
+		source = self.source()
+		width, height = max(self.winfo_width(), 1), max(self.winfo_height(), 1)
+		level = 0
+		while level < total_levels(source.shape, self.cache.tile_size) - 1:
+			rows, cols = level_shape(source.shape, level)
+			if rows <= height and cols <= width:
+				break
+			level += 1
+		return level
+
+	# ============= NAVIGATION ============= #
+
+	# One level up (step=1, zoom out) or down (step=-1, zoom in), keeping the pixel under (x, y) in place.
+	def zoom(self, step, x, y):
+		source = self.source()
+		if source is None:
+			return
+		level = min(max(self.level + step, 0), total_levels(source.shape, self.cache.tile_size) - 1)
+		if level == self.level:
+			return
+		scale = 2.0**(self.level - level)
+		column, row = self.origin
+		self.origin = (int((column + x)*scale - x), int((row + y)*scale - y))
+		self.level = level
+		self.clear_tiles()
+		self.redraw()
+
+	def start_drag(self, event):
+		self.drag = (event.x, event.y)
+
+	def drag_to(self, event):
+		if self.drag is None or self.current is None:
+			return
+		dx, dy = event.x - self.drag[0], event.y - self.drag[1]
+		self.drag = (event.x, event.y)
+		self.origin = (self.origin[0] - dx, self.origin[1] - dy)
+		self.move("tile", dx, dy)
+		self.redraw()
+
+	# ============= DRAWING ============= #
+
+	def clear_tiles(self):
+		self.delete("tile")
+		self.drawn.clear()
+
+	# Draw the visible tiles that are not drawn yet, and drop the ones that left the view.
+	def redraw(self):
+		source = self.source()
+		if source is None:
+			return
+		size = self.cache.tile_size
+		rows, cols = level_shape(source.shape, self.level)
+		column, row = self.origin
+		width, height = self.winfo_width(), self.winfo_height()
+		visible = {(ty, tx) for ty in range(max(row//size, 0), min(-(-(row + height)//size), -(-rows//size)))
+				   for tx in range(max(column//size, 0), min(-(-(column + width)//size), -(-cols//size)))}
+		for key in set(self.drawn) - visible:
+			self.delete(self.drawn.pop(key)[0])
+		for ty, tx in visible - set(self.drawn):
+			photo = self.photo(self.cache.tile(source, self.level, ty, tx), source.palette)
+			item = self.create_image(tx*size - column, ty*size - row, image=photo, anchor="nw", tags="tile")
+			self.drawn[(ty, tx)] = (item, photo)
+
+	# PhotoImage of a tile of palette indices, as a binary PPM.
+	def photo(self, tile, palette):
+		lookup = self.palettes.get(palette)
+		if lookup is None:
+			lookup = np.zeros((256, 3), dtype=np.uint8)
+			lookup[:len(palette)] = palette
+			self.palettes[palette] = lookup
+		rgb = lookup[tile]
+		header = b"P6 %d %d 255\n" % (tile.shape[1], tile.shape[0])
+		return PhotoImage(data=header + rgb.tobytes(), format="PPM")
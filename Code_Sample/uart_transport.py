@@ -0,0 +1,291 @@
+"""
+Engineer: Mylonakis Manolis
+Description: Asynchronous, pipelined transport between the host and the board (or its emulator), with asyncio.
+	     A run used to be strictly sequential: serialize, send, wait, read every snapshot, convert.
+	     Here, three things overlap:
+	       - Uploads are written in large chunks into a large write buffer, so the line never waits for Python.
+	       - Snapshot N is decoded in a thread while snapshot N+1 is still arriving.
+	       - The next job's upload starts as soon as the current upload is out, while the current job's snapshots
+	         are still coming back. The UART is full duplex, so both directions of the line are kept busy.
+	     Jobs are read back in the order they were submitted.
+	     A failure on either direction of the line stops both and fails every pending job: after it, the stream cannot
+	     be trusted to be aligned on a snapshot.
+"""
+
+# ============================== IMPORTS ============================== #
+# Maths
+import numpy as np
+# My Files
+from serializer import Serializer, device_serializer
+from readback import SnapshotStore, unpack_cells, snapshot_rows, snapshot_bytes
+from boundary import check_hardware
+# OS
+import os
+import tty
+import termios
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import time
+
+# Global Scope
+WRITE_CHUNK = 1 << 18 		# Bytes per write of an upload.
+WRITE_BUFFER = 1 << 22 		# Bytes buffered before a write waits for the line.
+
+# ============================== TRANSPORT ============================== #
+class WriteProtocol(asyncio.Protocol):
+	"""
+	Write side of a tty/pty, with the write(), drain() and close() of an asyncio.StreamWriter.
+	The transport pauses the protocol when its buffer is over the high limit. drain() then waits until it resumes.
+	"""
+	def __init__(self):
+		self.transport = None
+		self.paused = False
+		self.waiter = None 	# Future of a drain(), while paused.
+		self.lost = None 	# Why the connection was lost.
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def connection_lost(self, error):
+		self.lost = error if error is not None else ConnectionResetError("Connection to the device lost.")
+		self.wake(self.lost)
+
+	def pause_writing(self):
+		self.paused = True
+
+	def resume_writing(self):
+		self.paused = False
+		self.wake(None)
+
+	def wake(self, error):
+		waiter, self.waiter = self.waiter, None
+		if waiter is None or waiter.done():
+			return
+		if error is None:
+			waiter.set_result(None)
+		else:
+			waiter.set_exception(error)
+
+	def write(self, data):
+		self.transport.write(data)
+
+	async def drain(self):
+		if self.lost is not None:
+			raise self.lost
+		if self.paused:
+			self.waiter = asyncio.get_running_loop().create_future()
+			await self.waiter
+
+	def close(self):
+		self.transport.close()
+
+class UartTransport:
+	"""
+	Connection to a device: a tty/pty path (e.g. /dev/ttyUSB1 or the pty of an EmulatedBoard) or a Unix socket.
+	submit() queues a job and returns a future of its decoded snapshots. Use it as an async context manager.
+	"""
+	def __init__(self, path, decode_workers=2):
+		self.path = path
+		self.decoder = ThreadPoolExecutor(decode_workers)
+		self.uploads = asyncio.Queue() # Jobs waiting for the line, to the board.
+		self.readbacks = asyncio.Queue() # Jobs waiting for their snapshots, from the board.
+		self.tasks = []
+		self.pending = set() # Futures of the jobs not done yet.
+		self.failure = None # What stopped the transport.
+		self.reader = self.writer = None
+		self.fd = None
+
+	async def __aenter__(self):
+		await self.open()
+		return self
+
+	async def __aexit__(self, *args):
+		await self.close()
+
+	# Open the device and start the upload and readback tasks.
+	async def open(self):
+		loop = asyncio.get_running_loop()
+		if self.path.startswith("/dev/"):
+			self.fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+			tty.setraw(self.fd)
+			termios.tcflush(self.fd, termios.TCIOFLUSH)
+			self.reader = asyncio.StreamReader(limit=WRITE_BUFFER)
+			await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self.reader), os.fdopen(self.fd, "rb", buffering=0, closefd=False))
+			_, self.writer = await loop.connect_write_pipe(WriteProtocol, os.fdopen(os.dup(self.fd), "wb", buffering=0))
+		else:
+			self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=WRITE_BUFFER)
+		self.writer.transport.set_write_buffer_limits(high=WRITE_BUFFER)
+		self.tasks = [asyncio.create_task(self.upload_loop()), asyncio.create_task(self.readback_loop())]
+
+	# Stop the tasks (after the submitted jobs, unless the transport failed) and close the device.
+	async def close(self):
+		await self.uploads.put(None)
+		await self.readbacks.put(None)
+		await asyncio.gather(*self.tasks, return_exceptions=True)
+		self.writer.close()
+		if self.fd is not None:
+			os.close(self.fd)
+		self.decoder.shutdown()
+
+	"""
+	Queue a job: the serialized payload, then snapshots snapshots of snapshot_size bytes, snapshot i decoded by
+	decode(i, bytes), e.g. SnapshotStore.decode. Returns a future of the list of decoded snapshots.
+	With on_snapshot, every decoded snapshot is given to on_snapshot(i, snapshot) instead, in order, as soon as it
+	and the ones before it are decoded (in the event loop). They are not kept and the future's result is None.
+	"""
+	def submit(self, payload, snapshots, snapshot_size, decode, on_snapshot=None):
+		job = {"payload": payload, "snapshots": snapshots, "size": snapshot_size, "decode": decode, "on_snapshot": on_snapshot,
+			   "result": asyncio.get_running_loop().create_future(), "timing": {}}
+		if self.failure is not None:
+			job["result"].set_exception(self.failure)
+			return job["result"]
+		self.pending.add(job["result"])
+		job["result"].add_done_callback(self.pending.discard)
+		self.uploads.put_nowait(job)
+		self.readbacks.put_nowait(job)
+		return job["result"]
+
+	# Stop both tasks (but the one failing) and fail every pending job with error.
+	def fail(self, error):
+		if self.failure is None:
+			self.failure = error
+		for task in self.tasks:
+			if task is not asyncio.current_task():
+				task.cancel()
+		for result in list(self.pending):
+			if not result.done():
+				result.set_exception(error)
+
+	# Upload jobs one after the other, without waiting for their snapshots.
+	async def upload_loop(self):
+		try:
+			while (job := await self.uploads.get()) is not None:
+				start = time.perf_counter()
+				view = memoryview(job["payload"])
+				for offset in range(0, view.nbytes, WRITE_CHUNK):
+					self.writer.write(view[offset:offset + WRITE_CHUNK])
+					await self.writer.drain()
+				job["timing"]["upload"] = time.perf_counter() - start
+		except Exception as error:
+			self.fail(error)
+
+	# Read the snapshots of each job in order. Each one is decoded in a thread, while the next one arrives.
+	async def readback_loop(self):
+		loop = asyncio.get_running_loop()
+		try:
+			while (job := await self.readbacks.get()) is not None:
+				start = time.perf_counter()
+				decoding = deque()
+				delivered = 0
+				for i in range(job["snapshots"]):
+					data = await self.reader.readexactly(job["size"])
+					decoding.append(loop.run_in_executor(self.decoder, job["decode"], i, data))
+					# Stream out the snapshots decoded so far, in order.
+					while job["on_snapshot"] and decoding[0].done():
+						job["on_snapshot"](delivered, decoding.popleft().result())
+						delivered += 1
+				job["timing"]["readback"] = time.perf_counter() - start
+				if job["on_snapshot"] is None:
+					job["result"].set_result(await asyncio.gather(*decoding))
+					continue
+				while decoding:
+					job["on_snapshot"](delivered, await decoding.popleft())
+					delivered += 1
+				job["result"].set_result(None)
+		except Exception as error:
+			self.fail(error)
+
+# ============================== RUNS ============================== #
+
+"""
+Runs on a device, pipelined. Each run is a tuple with the inputs of run_simulation() after curr_prj:
+(init_state, grid_type, cell_size, final_neighborhood, time_step, bram_values, others_value, addr_sel, total_extracts).
+Returns the list of extracted grids of every run. The snapshots of each run are decoded into a SnapshotStore,
+mapped to the .npy file memmap_paths[run] if memmap_paths is given.
+delta=True only uploads the sections the board does not hold yet (see serializer.DeltaSerializer).
+With on_snapshot, every extracted grid is given to on_snapshot(run, index, grid) as soon as it is decoded, a new array
+each, and is not kept: nothing is returned and memory does not grow with the number of extracts.
+compress_grid=False always sends the grids plain (0x32).
+"""
+async def run_pipelined(path, runs, memmap_paths=None, delta=False, on_snapshot=None, compress_grid=True):
+	for run in runs:
+		check_hardware(run[1])
+	serializer = device_serializer(path) if delta else Serializer(count_values=True, trim_weights=True, compress_grid=compress_grid)
+	async with UartTransport(path) as transport:
+		futures = []
+		stores = []
+		try:
+			for j, (init_state, grid_type, cell_size, final_neighborhood, time_step, bram_values, others_value, addr_sel, total_extracts) in enumerate(runs):
+				payload = serializer.serialize(time_step, final_neighborhood, bram_values, others_value,
+											   addr_sel, np.asarray(init_state, dtype=np.uint8))
+				if on_snapshot is not None:
+					decode = lambda i, data, cell_size=cell_size, rows=snapshot_rows(grid_type): unpack_cells(data, cell_size, rows)
+					deliver = lambda i, grid, j=j: on_snapshot(j, i, grid)
+					futures.append(transport.submit(bytes(payload), total_extracts, snapshot_bytes(grid_type, cell_size), decode, deliver))
+					continue
+				stores.append(SnapshotStore(grid_type, cell_size, total_extracts, memmap_paths[j] if memmap_paths else None))
+				futures.append(transport.submit(bytes(payload), total_extracts, stores[-1].size, stores[-1].decode))
+			await asyncio.gather(*futures)
+		except BaseException:
+			if delta:
+				serializer.forget() # Unknown what the board got.
+			raise
+		if on_snapshot is not None:
+			return
+		for store in stores:
+			store.flush()
+		return [store.grids() for store in stores]
+
+# Same inputs and output as run_simulation(), through the transport, on the device at path. curr_prj is not used.
+# With on_snapshot, every extracted grid is given to on_snapshot(index, grid) as it arrives instead, and nothing is returned.
+def run_simulation_uart(curr_prj, init_state, grid_type, cell_size, final_neighborhood, time_step,
+						bram_values, others_value, addr_sel, total_extracts, vertical_offset, path, memmap_path=None, delta=False,
+						on_snapshot=None):
+	run = (init_state, grid_type, cell_size, final_neighborhood, time_step, bram_values, others_value, addr_sel, total_extracts)
+	if on_snapshot is not None:
+		return asyncio.run(run_pipelined(path, [run], delta=delta, on_snapshot=lambda j, i, grid: on_snapshot(i, grid)))
+	return asyncio.run(run_pipelined(path, [run], [memmap_path] if memmap_path else None, delta))[0]
+
+# ============================== BENCHMARK ============================== #
+
+"""
+Jobs on an emulated board at a throttled baud rate, one after the other (blocking host) and pipelined.
+Grids are sent plain (0x32) unless compress_grid: random soups do not compress, and plain grids are decoded by the
+board at far more than the line rate, so the line is the bottleneck, as on the board.
+Returns the seconds of both, and the seconds the uploads alone take on the line (10 bits a byte). Results must be the same.
+"""
+def benchmark(jobs=3, baud=12000000, total_extracts=2, compress_grid=False):
+	from fpga_emulator import EmulatedBoard, run_on_device
+	rng = np.random.default_rng(0)
+	kernel = [0]*841
+	for i in (390, 391, 392, 419, 421, 448, 449, 450): # Game of Life.
+		kernel[i] = 1
+	lut = [0]*16384
+	lut[3] = lut[(1 << 10) | 2] = lut[(1 << 10) | 3] = 1
+	runs = [(rng.integers(0, 2, size=(1080, 1920)), "TOROIDAL", 4, kernel, 1 + j, lut, 0, 1, total_extracts) for j in range(jobs)]
+	timings = []
+	results = []
+	for pipelined in (False, True):
+		with EmulatedBoard("TOROIDAL", 4, baud, max_snapshots=total_extracts, verbose=False) as board:
+			board.open_pty()
+			board.start()
+			start = time.perf_counter()
+			if pipelined:
+				results.append(asyncio.run(run_pipelined(board.path, runs, compress_grid=compress_grid)))
+			else:
+				results.append([run_on_device(board.path, *run, compress_grid=compress_grid, verbose=False) for run in runs])
+			timings.append(time.perf_counter() - start)
+	for sequential, pipelined in zip(*results):
+		if not all(np.array_equal(a, b) for a, b in zip(sequential, pipelined)):
+			raise ValueError("Pipelined transport does not match the blocking host.")
+	serializer = Serializer(count_values=True, trim_weights=True, compress_grid=compress_grid)
+	upload_bytes = sum(len(serializer.serialize(time_step, kernel, lut, others, addr_sel, np.asarray(state, dtype=np.uint8)))
+					   for state, _, _, kernel, time_step, lut, others, addr_sel, _ in runs)
+	return timings + [10*upload_bytes/baud]
+
+if __name__ == "__main__":
+	sequential, pipelined, uploads = benchmark()
+	print("Blocking host: %.2fs, pipelined transport: %.2fs (x%.2f)" % (sequential, pipelined, sequential/pipelined))
+	print("Uploads alone take %.2fs of line: the line to the board is busy %.0f%% of the pipelined run, %.0f%% of the blocking one."
+		  % (uploads, 100*uploads/pipelined, 100*uploads/sequential))
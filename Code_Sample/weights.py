@@ -8,16 +8,24 @@ Description: Generates grid-like entries to configure the CA neighborhood
 # ============================== IMPORTS ============================== #
 # My Files
 from run_sim import *
+from neighborhood import * # NeighborhoodModel, TOTAL_ENTRIES, GRID_SIZE, CELL_*
+from grid_editor import WeightsGrid
+from ca_engine import run_simulation_cpu
+from fpga_emulator import run_simulation_emulated
+from bmp_writer import BmpWriter
+from tiled_viewer import TiledViewer
+from project_index import ProjectIndex
+from project_config import ProjectConfig, ConfigCache
+from boundary import prepare_state, vertical_offset as null_offset
 # GUI
 from tkinter import *
 from tkinter import ttk
 # Maths (Linspace)
 import numpy as np
 from threading import Thread
+import inspect
 import time
 from threading import Thread # To Run simulation on the background and avoid program crashing
-# Global Scope
-TOTAL_ENTRIES = 29*29
 
 # ============================== WEIGHTS FRAME / WIDGETS ============================== #
 class Weights(ttk.Frame):
@@ -28,7 +36,7 @@ class Weights(ttk.Frame):
 	"""
 	# ====================== CLASS ATRIBUTES ====================== #
 	# =========== Widgets =========== #
-	weights_entries = []			  # Entries for weights
+	grid_editor = None				  # 29x29 grid editor for weights. Single Canvas.
 	diam_entry = None 				  # Entry for diamater
 	set_button = None 				  # Set button for diameter
 	menu_neigh_type = None 			  # Neighborhood type drop down menu
@@ -46,15 +54,11 @@ class Weights(ttk.Frame):
 	error_msg_label = None            # To print error mesages, below the weights' entries.
 	
 	# =========== Extra Variables =========== #
-	entry_vars = []      				   # To trace changes in Entries.
-	xy_coordinates = []	 				   # Keeps a list of (x, y) tuples that correspond each weight entry to a coordinate.
-	diameter = 29 		 				   # Diameter that has been set.		
-	radius = 14          				   # Radius that has been set.
-	neigh_type = "Moore" 				   # Type of neighborhood. Is being updated when a type is selected.
-	is_weighted = 0 	 				   # Checkbox's value. If is weightes is set to 1.
-	is_mirror_enabled = False 			   # Indicates us whether Mirror mode is enabled or not
-	x0, y0 = (0, 0)						   # Central point of the entries.
+	model = None 						   # NeighborhoodModel. Weights, diameter, central point, etc. The entries only display it.
+	configs = None 						   # ConfigCache. Configurations of the projects used recently.
 	is_center_shifted = None    		   # Variable/Object that provided in checkbox "Shift Central Cell".
+	use_cpu = None 						   # Variable/Object of checkbox "Simulate on CPU". Runs without a board.
+	use_emulator = None 				   # Variable/Object of checkbox "Simulate on emulated board". Runs without a board.
 	final_neighborhood = [0]*TOTAL_ENTRIES # Neighborhood will always be 29x29.
 	
 	# Init current Frame.
@@ -62,8 +66,9 @@ class Weights(ttk.Frame):
 		
 		super().__init__(parent)
 		
-		# Init xy_coordinates list of tuples (x,y)
-		self.init_coordinates()
+		# The neighborhood itself. GUI-independent.
+		self.model = NeighborhoodModel()
+		self.configs = ConfigCache()
 
 		# Place Frame of Weights. Contains grid-like entries, buttons, etc.
 		self.place(relx = 0.563, rely=0, relheight = 0.9, relwidth=0.6)
@@ -76,6 +81,14 @@ class Weights(ttk.Frame):
 		# So we define both of them in this module/file.
 		self.run_button = ttk.Button(parent, text ="Run Simulation", command=lambda:[self.run_simulation_button_pressed(parent)])
 		self.run_button.pack(side='bottom', anchor='se', padx=3, pady=3)
+		# Simulate on the CPU reference engine instead of the FPGA. E.g. when the board is busy.
+		self.use_cpu = IntVar()
+		cpu_checkbox = ttk.Checkbutton(parent, text="Simulate on CPU", variable=self.use_cpu)
+		cpu_checkbox.pack(side='bottom', anchor='se', padx=3)
+		# Simulate on an emulated board (see fpga_emulator.py): the whole host path, serial line included, without a board.
+		self.use_emulator = IntVar()
+		emulator_checkbox = ttk.Checkbutton(parent, text="Simulate on emulated board", variable=self.use_emulator)
+		emulator_checkbox.pack(side='bottom', anchor='se', padx=3)
 
 		# Label to print Error Messages. Create a new frame for it.
 		err_msg_frame = ttk.Frame(parent)
@@ -88,35 +101,11 @@ class Weights(ttk.Frame):
 
 		
 
-	# Place 29x29 Entries for inserting neighborhood's weights.
+	# Place the 29x29 grid editor for inserting neighborhood's weights.
+	# One Canvas with a floating entry, instead of 841 Entry widgets.
 	def create_grid_like_entries(self):
-		# Use linspace to equally distribute entries.
-		row_linspace = np.linspace(0.00, 0.963, 29, dtype=float)
-		col_linspace = np.linspace(0.00, 0.7, 29, dtype=float)
-		loops = 1 # Loops counter to find central entry.
-		# Place entries according to the values of linspace
-		for rows in row_linspace:
-			for cols in col_linspace:
-				entry_var = StringVar()
-				weight_entry = Entry(self, width=3, borderwidth=2, font=('Romans 10 bold'), justify=CENTER, textvariable=entry_var)			
-				weight_entry.insert(0, "1")
-				
-				# Center cell with green background
-				if loops == np.ceil((TOTAL_ENTRIES)/2):
-					weight_entry.config(bg="#50FFA0")
-				else: # Blue background
-					weight_entry.config(bg="#0090FF")
-
-				weight_entry.place(relx=cols, rely=rows)
-				# Keep a list of created entries.
-				self.weights_entries.append(weight_entry)
-				self.entry_vars.append(entry_var)
-				loops += 1
-
-		# To trace changes in an entry
-		for i in range(TOTAL_ENTRIES):
-			x, y = self.xy_coordinates[i]
-			self.entry_vars[i].trace("w", lambda *_, entry=self.weights_entries[i], x=x, y=y: self.entry_triggered(*_, entry=entry, x=x, y=y))
+		self.grid_editor = WeightsGrid(self, self.model, on_edit=self.entry_triggered)
+		self.grid_editor.place(relx=0, rely=0)
 
 	def weights_functionalities(self, parent):
 
@@ -148,7 +137,7 @@ class Weights(ttk.Frame):
 		types_label.place(relx=0.062, rely=0.27)
 		# Drop down menu for weight types.
 		selected_neigh_type = StringVar(frame) # To get what is clicked
-		types = ("Moore", "Moore", "von Neumann", "Circular", "L2/Euclidean", "Cherckerboard", "Cherckerboard'", "Hash", "Cross", "Saltire", "Star")
+		types = ("Moore", *pattern_names()) # Registered types. See register_pattern() in neighborhood.py.
 		selected_neigh_type.set(types[0]) # type[0] default, the rest in menu.
 		self.menu_neigh_type = ttk.OptionMenu(frame, selected_neigh_type, *types, command=self.update_neighborhood_type)
 		self.menu_neigh_type.place(relx=0.56, rely=0.27)
@@ -229,10 +218,9 @@ class Weights(ttk.Frame):
 
 	# Enable
 	def weights_enable_widgets(self):
-		for weight_entry in self.weights_entries:
-			weight_entry.config(state="normal")
-			weight_entry.delete(0, END)
-			weight_entry.insert(0, "1")
+		# Every entry active and equal to 1.
+		self.model.reset()
+		self.sync_from_model()
 
 		self.diam_entry.config(state="normal")
 		self.diam_entry.insert(0, "29")
@@ -251,11 +239,8 @@ class Weights(ttk.Frame):
 
 	# Disable
 	def weights_disable_widgets(self):
-		for weight_entry in self.weights_entries:
-			# If a project closes, some entries are already disabled and we can not delete their content, if we dont activate them first.
-			weight_entry.config(state="normal")
-			weight_entry.delete(0, END)
-			weight_entry.config(state="disabled")
+		# Empty and disable the grid of weights.
+		self.grid_editor.clear()
 
 		self.diam_entry.delete(0, END)
 		self.diam_entry.config(state="disabled")
@@ -281,37 +266,42 @@ class Weights(ttk.Frame):
 		self.diam_entry.delete(0, END)
 		self.diam_entry.insert(0, neighborhood[0].strip().split(':')[1])
 
-		# It will always be 29x29. Smaller neighborhoods are wrapped-arround with 0s.
-		count = 0
-		for i in range(1, 30): # For every row
-			for w in neighborhood[i].strip().split(' '): # Weights are seperated with ' '
-				self.weights_entries[count].delete(0, END)
-				self.weights_entries[count].insert(0, w)
-				count += 1
-	
-	# Each entry correspond to a (x,y) coordinate on x'x|y'y axis.
-	# This way, we can draw a neighborhood according to its type.
-	def init_coordinates(self):
-		# Horizontically traverse entries of weights using (x,y) coordinates
-		for y in range(14, -15, -1):
-			for x in range(-14, 15):
-				self.xy_coordinates.append((x,y))
-
-	# Traces when an entry has been triggered.
-	def entry_triggered(self, *args, entry, x, y):
-		# Check the value of the entry and change its background colour respectively.
-		# Zeros and non central ones with ligth pink.
-		if entry.get() == "0" and (self.x0 != x or self.y0 != y):
-			entry.config(bg="#D0D0FF")
-		# Wrong input with red.
-		elif not(entry.get().isdigit()):
-			entry.config(bg="#FF6040")
-		# Central entry with green.
-		elif self.x0 == x and self.y0 == y:
-			entry.config(bg="#50FFA0")
-		else: # Others with blue.
-			entry.config(bg="#0090FF")
+		# Only the diameter x diameter block is stored (29x29 in older files). It is wrapped-arround with 0s.
+		self.model.from_config_lines(neighborhood)
+		self.sync_from_model()
+
+	"""
+	Restore the configurations of a project when the user switches to it: rules, LUT and weights.
+	They come from the cache of recent projects, or from the binary config (migrated from the .config if needed),
+	so nothing is parsed and only the cells that differ are redrawn.
+	"""
+	def import_configs(self, parent, config_file):
+		config = self.configs.get(config_file)
+		parent.rules.entry_states.delete(0, END)
+		parent.rules.entry_states.insert(0, config.states)
+		parent.rules.dd_menu_var.set(config.grid_type)
+		parent.rules.TR_editor.delete("1.0", END)
+		parent.rules.TR_editor.insert("1.0", config.rule)
+		if config.lut is not None:
+			parent.rules.LUT_BRAM = config.lut.tolist()
+			parent.rules.others = config.others_value
+			parent.rules.addr_sel = config.addr_sel
+		self.diam_entry.delete(0, END)
+		self.diam_entry.insert(0, "%d" % config.diameter)
+		self.model.set_weights(config.diameter, config.block, config.invalid)
+		self.sync_from_model()
+
+	# Draw the model in the grid editor. Only the cells that changed are redrawn.
+	def sync_from_model(self):
+		if self.grid_editor.refresh():
+			# Something changed. Disable run simulation button.
+			self.run_button.config(state = "disabled")
+			# Also clear error message.
+			self.error_msg_label.config(foreground="red")
+			self.error_msg_label.config(text="")
 
+	# A cell has been edited in the grid editor. It has already stored the value in the model and coloured the cell.
+	def entry_triggered(self, row, col):
 		# Something changed. Disable run simulation button.
 		self.run_button.config(state = "disabled")
 		# Also clear error message.
@@ -330,53 +320,21 @@ class Weights(ttk.Frame):
 		entry_val = self.diam_entry.get()
 
 		# Check if is alpharithmetic or even or out of range [3,29]
-		if not(entry_val.isdigit()) or int(entry_val)%2==0 or int(entry_val)>29 or int(entry_val)<3:
+		if not(entry_val.isdigit()) or not(self.model.is_valid_diameter(int(entry_val))):
 			self.diam_entry.config(background="#FF6040") # Red background
 			self.diam_entry.delete(0, END)
-			self.diam_entry.insert(0, "%d" % int(self.diameter))
+			self.diam_entry.insert(0, "%d" % self.model.diameter)
 			return
 		
 		# White background.
 		self.diam_entry.config(background="#FFFFFF")
-		# Update diameter and radius
-		self.diameter = int(entry_val)
-		self.radius = int((self.diameter-1)/2)
+		# Update diameter and radius, active entries and draw the neighborhood.
+		# The central point stays shifted only if the new radius allows it.
+		self.model.is_center_shifted = self.is_center_shifted.get()
+		self.model.set_diameter(int(entry_val))
 		# To enable or disable "Shift central point" checkbox.
 		self.enable_disable_shift_center()
-		# Shift the center since a new diameter has propebly been set.
-		self.shift_center(self.is_center_shifted)
-		# Active and disable entries according to radius or mirror mode.
-		self.update_active_entries()		
-		# Draw neighborhood
-		self.draw_neighborhood()
-
-	# Enables and disables entries according to the provided diameter.
-	def update_active_entries(self):		
-		for i in range(TOTAL_ENTRIES):
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# Count distance, square-shaped.
-			distance = max(abs(x), abs(y))
-			
-			# If mirror mode is enabled, keep active only the entries in the 2nd quadrant.
-			if self.is_mirror_enabled:
-				if distance <= self.radius and x<=0 and y>=0:
-					self.weights_entries[i].config(state="normal")
-					self.weights_entries[i].delete(0, END)
-					self.weights_entries[i].insert(0, "0")
-				else:# disable
-					self.weights_entries[i].delete(0, END)
-					self.weights_entries[i].insert(0, 0)
-					self.weights_entries[i].config(state="disabled")
-			else: # Else Activate or disable according to radius.
-				if distance <= self.radius:
-					self.weights_entries[i].delete(0, END)
-					self.weights_entries[i].insert(0, "0")
-					self.weights_entries[i].config(state="normal")			
-				else:# disable
-					self.weights_entries[i].delete(0, END)
-					self.weights_entries[i].insert(0, 0)
-					self.weights_entries[i].config(state="disabled")
+		self.sync_from_model()
 
 	# Weights Type Menu has been triggered.
 	def update_neighborhood_type(self, selection):
@@ -387,7 +345,7 @@ class Weights(ttk.Frame):
 		self.error_msg_label.config(text="")
 
 		# Update type.
-		self.neigh_type = selection
+		self.model.neigh_type = selection
 		# Draw neighborhood.
 		self.draw_neighborhood()
 
@@ -399,266 +357,18 @@ class Weights(ttk.Frame):
 		self.error_msg_label.config(foreground="red")
 		self.error_msg_label.config(text="")	
 
-		self.is_weighted = var.get()
+		self.model.is_weighted = var.get()
 		# Draw neighborhood.
 		self.draw_neighborhood()
 
 	# Draws the neighborhood according to its type, weights, etc.
 	def draw_neighborhood(self):
-		r = self.radius			
-		# Check if central point has been shifted
-		if self.x0 != 0: # Then, the radius is r/2.
-			# Shift the central point.	
-			# In this case, it will always be and even number due to the way that we enable and disable the "Shift Central Point" checkbox.
-			r = self.radius/2
-
-		if self.neigh_type == "Moore":
-			self.draw_Moore(r)
-		elif self.neigh_type == "von Neumann":
-			self.draw_vonNeumann(r)
-		elif self.neigh_type == "Circular":
-			self.draw_Circular(r)
-		elif self.neigh_type == "L2/Euclidean":
-			self.draw_L2Euclidean(r)
-		elif self.neigh_type == "Cherckerboard":
-			self.draw_Cherckerboard(parity=0) # Even
-		elif self.neigh_type == "Cherckerboard'":
-			self.draw_Cherckerboard(parity=1) # Odd
-		elif self.neigh_type == "Hash":
-			self.draw_Hash()
-		elif self.neigh_type == "Cross":
-			self.draw_Cross()
-		elif self.neigh_type == "Saltire":
-			self.draw_Saltire()
-		elif self.neigh_type == "Star":
-			self.draw_Star()
-		
-		self.color_entries()
+		self.model.draw_neighborhood()
+		self.sync_from_model()
 	
-	# Set colors to entries according to their value
+	# Set colors to entries according to their value. Only the changed ones are recoloured.
 	def color_entries(self):
-		for i in range(TOTAL_ENTRIES):
-			# Get coordinates
-			x,y = self.xy_coordinates[i]
-			# Central entry with green.
-			if self.x0 == x and self.y0 == y:
-				self.weights_entries[i].config(bg="#50FFA0")
-				continue
-
-			# Entries with 0s light ping.
-			if int(self.weights_entries[i].get()) == 0:
-				self.weights_entries[i].config(bg="#D0D0FF")
-				continue
-
-			# Others with blue
-			self.weights_entries[i].config(bg = "#0090FF")
-
-# ==================== NEIGHBORHOOD TYPES ==================== #
-	# Draw Moore neighborhood.
-	def draw_Moore(self, r):
-		# Moore is a square-shaped region.
-		for i in range(TOTAL_ENTRIES):
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-			
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# Value to insert in entry
-			value = 1
-			# If is weighted, add a value according to the distance from the central point.
-			if self.is_weighted:
-				value = max(abs(x-self.x0), abs(y-self.y0)) + 1
-
-			# It is a square-shaped region, whole neighborhood.
-			self.weights_entries[i].delete(0, END)
-			self.weights_entries[i].insert(0, "%d" % value)
-
-	# Draw von Neumann neighborhood.
-	def draw_vonNeumann(self, r):
-		# Diamond-shaped region.
-		for i in range(TOTAL_ENTRIES):			
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-
-			# Value to insert in entry
-			value = 1
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# If is weighted, add a value according to distance.
-			if self.is_weighted:
-				# According to distance from the center.
-				value = max(abs(x-self.x0), abs(y-self.y0)) + 1
-
-			# If it's not in the disired region, set zero.
-			if abs(x-self.x0) + abs(y-self.y0) <= r:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "%d" % value)				
-			else:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "0")
-				
-				
-	def draw_Circular(self, r):
-		# Circle: x^2 + x^2 = r^2. Area in circle: x^2 + x^2 <= r^2
-		# We have discrete values (not Real) so we use x^2 + x^2 <= r^2+1
-		for i in range(TOTAL_ENTRIES):			
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-
-			# Value to insert in entry
-			value = 1
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# If is weighted, add a value according to distance
-			if self.is_weighted:
-				value = max(abs(x-self.x0), abs(y-self.y0)) + 1
-
-			if pow(abs(x-self.x0),2) + pow(abs(y-self.y0),2) <= (pow(r,2) + 1):
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "%d" % value)				
-			else:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "0")
-
-	def draw_L2Euclidean(self, r):
-		for i in range(TOTAL_ENTRIES):
-			
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-
-			# Value to insert in entry
-			value = 1
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# If is weighted, add a value according to distance
-			if self.is_weighted:
-				value = max(abs(x-self.x0), abs(y-self.y0)) + 1
-
-			# For Euclidean x^2 + x^2 <= r^2
-			if pow(abs(x-self.x0),2) + pow(abs(y-self.y0),2) <= (pow(r,2)):
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "%d" % value)				
-			else:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "0")
-
-	# Draw a checkerboard.
-	# Parity = 0, every odd entry.
-	# Parity = 1, every even entry.
-	def draw_Cherckerboard(self, parity):
-		for i in range(TOTAL_ENTRIES):
-			
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-
-			# Value to insert in entry
-			value = 1
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# If is weighted, add a value according to distance
-			if self.is_weighted:
-				value = max(abs(x-self.x0), abs(y-self.y0)) + 1
-
-			# i starts from 0. The first entry is even.
-			if (i+1) % 2 == parity:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "%d" % value)				
-			else:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "0")
-
-	# Draw Hash. 2 Horintal and 2 Verical Lines on either side of central cell
-	def draw_Hash(self):
-		for i in range(TOTAL_ENTRIES):
-			
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-
-			# Value to insert in entry
-			value = 1
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# If is weighted, add a value according to distance
-			if self.is_weighted:
-				value = max(abs(x-self.x0), abs(y-self.y0)) + 1
-
-			if x==self.x0-1 or x==self.x0+1 or y==self.y0+1 or y==self.y0-1:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "%d" % value)				
-			else:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "0")
-
-	def draw_Cross(self):
-		for i in range(TOTAL_ENTRIES):
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-
-			# Value to insert in entry
-			value = 1
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# If is weighted, add a value according to distance
-			if self.is_weighted:
-				value = max(abs(x-self.x0), abs(y-self.y0)) + 1
-
-			if x==self.x0 or y==self.y0:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "%d" % value)				
-			else:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "0")
-
-	def draw_Saltire(self):
-		for i in range(TOTAL_ENTRIES):
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-
-			# Value to insert in entry
-			value = 1
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# If is weighted, add a value according to distance
-			if self.is_weighted:
-				x, y = self.xy_coordinates[i]
-				value = max(abs(x-self.x0), abs(y-self.y0)) + 1
-
-			# Think of it like y= ax + y0, where a is the gradient and y0 is where the line cuts the Y-Axis.
-			if y==x+2*self.y0 or y==-x:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "%d" % value)				
-			else:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "0")
-
-	def draw_Star(self):
-		for i in range(TOTAL_ENTRIES):
-			# If it is a disabled entry, skip it.
-			if self.weights_entries[i]["state"] == "disabled":
-				continue
-
-			# Value to insert in entry
-			value = 1
-			# Get coordinates for the i-th entry
-			x, y = self.xy_coordinates[i]
-			# If is weighted, add a value according to distance
-			if self.is_weighted:
-				value = max(abs(x), abs(y)) + 1
-
-			if y==x+2*self.y0 or y==-x or x==self.x0 or y==self.y0:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "%d" % value)				
-			else:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, "0")
+		self.sync_from_model()
 
 # ==================== ADD OPERATION ==================== #
 
@@ -688,20 +398,9 @@ class Weights(ttk.Frame):
 		# Entry's value to add
 		to_add = int(self.add_entry.get())
 
-		for i in range(TOTAL_ENTRIES):
-
-			# If it's a non zero value, skip it.
-			if int(self.weights_entries[i].get()) != 0 and except_non_zeros_var.get() == 1:
-				continue
-
-			# If it contains zero and has been excluded, skip it.
-			if int(self.weights_entries[i].get()) == 0 and except_zeros_var.get() == 1:
-				continue
-
-			# Otherwise add in the entry
-			old_value = int(self.weights_entries[i].get())
-			self.weights_entries[i].delete(0, END)
-			self.weights_entries[i].insert(0, "%d"%(old_value + to_add))
+		# Add to every active entry, except the excluded ones.
+		self.model.add_to_every_entry(to_add, except_non_zeros_var.get() == 1, except_zeros_var.get() == 1)
+		self.sync_from_model()
 
 
 # ==================== MIRROR MODE ==================== #
@@ -714,8 +413,8 @@ class Weights(ttk.Frame):
 		self.error_msg_label.config(foreground="red")
 		self.error_msg_label.config(text="")	
 
-		# Mirror mode is enabled
-		self.is_mirror_enabled = True
+		# Mirror mode is enabled. Keep enabled the entries that belong in the 2nd quadrant.
+		self.model.enable_mirror_mode()
 
 		# Disable "Enable" Button
 		self.enable_button.config(state="disabled")
@@ -724,16 +423,8 @@ class Weights(ttk.Frame):
 		
 		# To Enable or Disable "Shift central point" checkbox.
 		self.enable_disable_shift_center()
-		
-		# Keep enable the entries that belong in the 2nd quadrant.
-		for i in range(TOTAL_ENTRIES):
-			# Get coordinates
-			x, y = self.xy_coordinates[i]
-			# If it is not in 2nd quadrant, disable.
-			if x>0 or y<0:
-				self.weights_entries[i].delete(0, END)
-				self.weights_entries[i].insert(0, 0)
-				self.weights_entries[i].config(state="disabled")
+		self.sync_from_model()
+
 	"""
 	During mirror mode, we provide user with the option to shift the central point (0,0) to the center of the 2nd quandrant (-r/2, r/2)
 	This is only work for odd, NxN, quadrant boxes. Otherwise, a central point can not be determined.
@@ -742,7 +433,7 @@ class Weights(ttk.Frame):
 	# Enables or Disable "Shift central point" checkbox.
 	def enable_disable_shift_center(self):
 		# Only if Mirror Mode is enabled and radius is an even number.
-		if self.is_mirror_enabled and self.radius%2 == 0:
+		if self.model.can_shift_center():
 			self.shift_center_checkbox.config(state="normal")
 		else:
 			self.is_center_shifted.set(0) # Uncheck and disable.
@@ -752,139 +443,40 @@ class Weights(ttk.Frame):
 	# We have taken care to enable or disable the checkbox, only when the aforementioned criteria are met.
 	def shift_center(self, var):
 		# Retrieve the value of the checkbox
-		is_checked = var.get()
-		if is_checked:
-			self.x0, self.y0 = ((-self.radius)/2, self.radius/2)
-		else:
-			self.x0, self.y0 = (0, 0)
-
-		self.draw_neighborhood()
+		self.model.shift_center(var.get())
 		# Place green color to the new center.
-		#self.color_entries()
-
-
-	"""
-	End mirroring. Done button has been pressed. Concept:
-	quadrant_values is a dictionary where values of the 2nd will be stored. 
-	The key is a tuple of (x,y) coordinates of the respective entry.
-	Since we do simple horizontal scan of the grid entries, only one for-loop is required.
-	Braking the scanning into rows and quadrants, we have the following order:
-		1:  1st row of 2nd quadrant.
-		2:  1st row of 1st quadrant.
-		3:  2nd row of 2nd quadrant.
-		4:  2nd row of 1st quadrant.
-		.
-		.
-		.
-		27: 14th row of 2nd quandrant
-		28: 14th row of 1st quadrant.
-		29: 1st row of 3rd quadrant.
-		30: 1st row of 4th quadrant.
-		.
-		.
-		.
-	The 1st quadrant is the reflection of 2nd quadrant over the Y'Y axe. When the 1st quadrant needs the information
-	from the 2nd one, it will be already updated in the dictionary quadrant_values due to horizontal scan.
-	So, only one for-loop can do the job. It is not required to pre-store the values of the 2nd quadrants.
-
-	Reflections(Q=quandrant):
-	2nd Q --> 1st Q : x1=-x2, y1= y2 
-	2nd Q --> 3rd Q : x3= x2, y3=-y2 
-	2nd Q --> 4th Q : x4=-x2, y4=-y2
+		self.sync_from_model()
 
-	"""
+	# End mirroring. Done button has been pressed.
+	# The 1st, 3rd and 4th quadrants become reflections of the 2nd one. See NeighborhoodModel.mirror_the_entries().
 	def mirror_the_entries(self):
 		# Mirror mode is disabled
-		self.is_mirror_enabled = False
+		self.model.mirror_the_entries()
 		# To disable "Shift central point" checkbox
 		self.enable_disable_shift_center()
 		# Enable "Enable" Button
 		self.enable_button.config(state="normal")
 		# Disable Done Button
 		self.done_button.config(state="disabled")
-
-		# To store the values in the 2nd quadrant
-		quadrant_values = {}
-
-		# Mirror Entries
-		for i in range(TOTAL_ENTRIES):
-			# Get Coordinates.
-			x,y = self.xy_coordinates[i]
-			# Distance from center
-			distance = max(abs(x), abs(y))
-
-			# If out of radius, skip it
-			if distance > self.radius:
-				continue
-
-			# It's the 2nd quadrant
-			if x<=0 and y>=0:
-				# Store the entry's value.
-				quadrant_values[(x,y)] = int(self.weights_entries[i].get())
-				continue
-
-			if x>0 and y>=0: # 1st quadrant
-				# Reflected x,y
-				rx = -x
-				ry = y
-				# Get the respective value in the 2nd quadrant
-				rvalue = quadrant_values[(rx,ry)]
-			elif x<0 and y<0: # 3rd quadrant
-				# Reflected x,y
-				rx = x
-				ry = -y
-				# Get the respective value in the 2nd quadrant
-				rvalue = quadrant_values[(rx,ry)]
-			else: # 4th quadrant
-				# Reflected x,y
-				rx = -x
-				ry = -y
-				# Get the respective value in the 2nd quadrant
-				rvalue = quadrant_values[(rx,ry)]
-
-			# Enable entry and insert value.
-			self.weights_entries[i].config(state="normal")
-			self.weights_entries[i].delete(0, END)
-			self.weights_entries[i].insert(0, rvalue)
 		
-		# Update new center and color it.
-		self.x0, self.y0 = (0,0)
-		self.color_entries()
+		# Enable mirrored entries, insert values and color the new center.
+		self.sync_from_model()
 
 # ====================== APPLY CONFIGURATIONS AND RUN SIMULATION ====================== #
 
-	# Auto save configurations, when the user switches project.
+	"""
+	Auto save configurations, when the user switches project. The .config (text) and its binary twin are each
+	written at once (see project_config.py), and the project's configurations are kept in the cache.
+	"""
 	def auto_save_configs(self, parent, config_file):
-		# To store the content of the file, line by line. This is the 1st line.
-		file_content = ["*** PLEASE DO NOT EDIT. This file is auto-generated by the tool. ***\n"]
-		# 2nd line: Number of states. strip() it, if user add space character by accident.
-		file_content.append("States:%s\n" % parent.rules.entry_states.get().strip())
-		# 3rd line: Grid Type
-		file_content.append("Grid_Type:%s\n" % parent.rules.dd_menu_var.get())
-		# 4th Line
-		file_content.append("# Transition Rule\n")
-		# Get Transition Rule from Text Editor.
-		file_content.append(parent.rules.TR_editor.get("1.0", END).strip()+"\n_END_\n")
-		# Add line NEIGHBORHOOD:DIAMETER
-		file_content.append("NEIGHBORHOOD:%s\n" % self.diam_entry.get().strip())
-
-		# 29x29 weights. One line contains 29 weights
-		line_weights = ""
-		for i in range(TOTAL_ENTRIES):
-			# Every 29, switch line. Each weight is separated with a space char.
-			if (i+1) % 29 == 0:
-				# "... w\n"
-				line_weights += self.weights_entries[i].get() + "\n"
-				file_content.append(line_weights)
-				line_weights = ""
-			else:
-				#"... w w "
-				line_weights += self.weights_entries[i].get() + " "
-
-		# Store in file.
-		with open(config_file, "w") as file:
-			file.writelines(file_content)
-		file.close()
+		# Number of states. strip() it, if user add space character by accident.
+		states = parent.rules.entry_states.get().strip()
+		# Grid Type and Transition Rule from Text Editor.
+		grid_type = parent.rules.dd_menu_var.get()
+		rule = parent.rules.TR_editor.get("1.0", END).strip()
+		# Diameter and the diameter x diameter weights around the center, without the 0s around them.
+		diameter, block = self.model.config_block()
+		self.configs.save(config_file, ProjectConfig(states, grid_type, rule, diameter, block))
 
 
 	"""
@@ -923,12 +515,17 @@ class Weights(ttk.Frame):
 			return
 				
 
+		# Check weights.
+		if self.model.invalid.any():
+			self.error_msg_label.config(foreground="red")
+			self.error_msg_label.config(text="Weights contain incorrect values (red entries).\n They should be non-negative integers.")
+			return
+
 		# All checks passed.
-		# Store final form of neighborhood.
-		# For every weight entry.
-		for i in range(TOTAL_ENTRIES):
-			# Store each value as integer.
-			self.final_neighborhood[i] = int(self.weights_entries[i].get())			
+		# Store final form of neighborhood. Each value as integer.
+		self.final_neighborhood[:] = self.model.final_neighborhood()
+		# Keep the LUT of the rule with the project's configurations.
+		self.configs.set_lut(parent.prj_tree.config_path, parent.rules.LUT_BRAM, parent.rules.others, parent.rules.addr_sel)
 
 		# Input is corrent. Enable Run Simulation Button.
 		self.run_button.config(state = "normal")
@@ -958,7 +555,6 @@ class Weights(ttk.Frame):
 	# Run Simulation.
 	def simulate(self, parent):
 		curr_prj = parent.prj_tree.selected_prj # Selected project to store results.
-		init_state = parent.img_viewer.img_arr # Initial state, the image array.
 		# The name of the initial image. We use it to generation the names of the result appropriately.
 		init_img_name = parent.rules.init_state_entry.get().replace(".bmp", "") # Also remove its data type.
 		total_states = int(parent.rules.entry_states.get()) # Total number of states.
@@ -974,44 +570,71 @@ class Weights(ttk.Frame):
 		# This is how the hardware treats these boundary conditions.
 		# The TOROIDAL grid eliminates boundary conditions, since it is a priodically, infinite grid.
 		grid_type = parent.rules.dd_menu_var.get() # Drop Down menu of grid type.
-		if grid_type == "TOROIDAL":
-			vertical_offset = 0
-		else:
-			vertical_offset = 28
-
-		# Set the 0s in the init state.
-		if vertical_offset != 0:
-			for i in range(0,14):
-				for j in range(0, 1920):
-					init_state[i][j] = 0
+		vertical_offset = null_offset(grid_type)
 
-			for i in range(1080-14,1080):
-				for j in range(0, 1920):
-					init_state[i][j] = 0
+		# Initial state, the image array, with the 0s of the null rows (see boundary.py).
+		# The image on display is not changed: the null rows are set on a copy, only if they are not 0 already.
+		init_state = prepare_state(parent.img_viewer.img_arr, grid_type)
 
-		list_of_extracted_grids = run_simulation(curr_prj, init_state, grid_type, cell_size, self.final_neighborhood, time_step, 
-												 bram_values, others_value, addr_sel, total_extracts, vertical_offset)
-		
 		# Full path of results. We are goind to replace *@* with the number of generations. 
 		# We wish that user will use the sequence "*@*" to name a file.bmp. What are the odds ? :'-).
 		results_path = curr_prj + '/' + init_img_name + "_result_*@*.bmp"
-		
+
+		# Extracted grid i to its image, as soon as it is available. Images are encoded on a pool of threads,
+		# as palette-indexed BMPs (one colour per state), while the next grids are computed.
+		# Every image is registered (tree, index, viewer) on the Tk thread as soon as it is written, in order.
+		writer = BmpWriter(vertical_offset, total_states)
+		index = getattr(parent.prj_tree, "index", None)
+		written = {} # Snapshot number to its path (None if it could not be written), until it is registered.
+		registered = [0] # Next snapshot to register.
+		def register_written(i, img_out_path):
+			written[i] = img_out_path
+			while registered[0] in written:
+				img_out_path = written.pop(registered[0])
+				registered[0] += 1
+				if img_out_path is None:
+					continue
+				new_name = img_out_path.split("/")[-1]
+				if isinstance(index, ProjectIndex):
+					# Only the new image is inserted. Its listeners (tree, viewer) receive it in a change event.
+					index.add_files(curr_prj, [new_name])
+					continue
+				# Update tree_elements dictionary with the new image (the name) and the Project Tree.
+				parent.prj_tree.tree_elements[curr_prj].append(new_name)
+				parent.prj_tree.update_elements(parent)
+				# Update paths of bmps. The tiled viewer only registers the new image.
+				parent.prj_tree.update_file_paths_of_curr_prj(parent)
+				if isinstance(parent.img_viewer, TiledViewer):
+					parent.img_viewer.add_images([img_out_path])
+			# Otherwise, close already open images and open all of them, once, after the last image.
+			if registered[0] == total_extracts and not isinstance(index, ProjectIndex) and not isinstance(parent.img_viewer, TiledViewer):
+				parent.img_viewer.close_images()
+				parent.img_viewer.open_images(parent.prj_tree.list_bmp_paths)
+		def save_snapshot(i, grid):
+			img_out_path = results_path.replace('*@*', '%dGENS'%(time_step*(i + 1)))
+			def on_written(future):
+				written_path = img_out_path if future.exception() is None else None
+				parent.after(0, register_written, i, written_path)
+			writer.submit(grid, img_out_path).add_done_callback(on_written)
+
+		# FPGA, CPU engine or emulated board. Same inputs, same extracted grids.
+		# Runners that stream hand over every grid as it is extracted, so only one is in memory at a time.
+		if self.use_cpu.get():
+			run = run_simulation_cpu
+		elif self.use_emulator.get():
+			run = run_simulation_emulated
+		else:
+			run = run_simulation
 		print("Converting Arrays to Image...")
-		curr_generation = time_step
-		for i in range(0, total_extracts):
-			img_out_path = results_path.replace('*@*', '%dGENS'%curr_generation)
-			parent.img_viewer.array2img(list_of_extracted_grids[i], img_out_path, vertical_offset, total_states)
-			# Update tree_elements dictionary with new images (the names).
-			parent.prj_tree.tree_elements[curr_prj].append(img_out_path.split("/")[-1])			
-			curr_generation += time_step
-
-		# Update Project Tree
-		parent.prj_tree.update_elements(parent)
-		# Update paths of bmps and open them in Image viewer.
-		parent.prj_tree.update_file_paths_of_curr_prj(parent)
-		# Close already open images and open new ones.
-		parent.img_viewer.close_images()
-		parent.img_viewer.open_images(parent.prj_tree.list_bmp_paths)
+		with writer:
+			if "on_snapshot" in inspect.signature(run).parameters:
+				run(curr_prj, init_state, grid_type, cell_size, self.final_neighborhood, time_step,
+					bram_values, others_value, addr_sel, total_extracts, vertical_offset, on_snapshot=save_snapshot)
+			else:
+				list_of_extracted_grids = run(curr_prj, init_state, grid_type, cell_size, self.final_neighborhood, time_step, 
+														 bram_values, others_value, addr_sel, total_extracts, vertical_offset)
+				for i in range(0, total_extracts):
+					save_snapshot(i, list_of_extracted_grids[i])
 
 		print("Done !")
 